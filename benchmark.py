@@ -0,0 +1,99 @@
+"""
+Capture throughput benchmark on the simulator stand-in (mock_airsim): runs CV_Capture for N frames over a matrix of
+camera counts, image types and crowd sizes and reports frames/sec and the latency of each stage of the loop
+(p50/p95/p99 per frame) as JSON.
+"""
+import os
+import json
+import time
+import shutil
+import itertools
+
+import mock_airsim
+from instrumentation import TRACER
+
+COLORS_FILE = 'color_to_pedestrian.json'
+
+
+def run_capture(number_cameras, image_types, number_pedestrians, frames, width=640, height=480, keep_data=False,
+                rpc_latency=0.0, **config_kwargs):
+    """ Run one capture on the stand-in and measure it
+    :param number_cameras (int), image_types (str): 'RGB', 'RGB-D' or 'RGB-DS', number_pedestrians (int)
+           frames (int): frames to capture
+           width, height (int): frame size
+           keep_data (bool): keep the recorded experiment on disk
+           rpc_latency (float): simulated latency of every RPC in seconds
+           config_kwargs: extra Configuration parameters (e.g. pipelined=True)
+    :return: dict with the parameters, 'seconds' of the whole capture (setup included), 'fps' of the capture loop and
+             'stages' latency statistics"""
+    mock_airsim.install()
+    from settings import Configuration
+    from client_pool import create_clients
+    import main_cv_fixed
+
+    world = mock_airsim.configure(number_cameras=number_cameras, number_pedestrians=number_pedestrians,
+                                  width=width, height=height, rpc_latency=rpc_latency)
+    name_experiment = 'benchmark_{}cam_{}_{}ped'.format(number_cameras, image_types, number_pedestrians)
+    config = Configuration(image_types, frames, 'start', name_experiment, settings_airsim=world.settings, **config_kwargs)
+    pool, clients, query_clients = create_clients(mock_airsim.VehicleClient, config)
+
+    # get_name_pedestrians writes the segmentation colors to the working directory
+    previous_colors = None
+    if os.path.exists(COLORS_FILE):
+        with open(COLORS_FILE, 'rb') as f:
+            previous_colors = f.read()
+
+    TRACER.reset()
+    TRACER.enable()
+    start = time.perf_counter()
+    main_cv_fixed.CV_Capture(clients, config, frames, query_clients)
+    elapsed = time.perf_counter() - start
+    TRACER.disable()
+
+    if not keep_data:
+        shutil.rmtree(config.path_save, ignore_errors=True)
+        if previous_colors is not None:
+            with open(COLORS_FILE, 'wb') as f:
+                f.write(previous_colors)
+        elif os.path.exists(COLORS_FILE):
+            os.remove(COLORS_FILE)
+
+    return {'cameras': number_cameras,
+            'image_types': image_types,
+            'pedestrians': number_pedestrians,
+            'frames': frames,
+            'width': width,
+            'height': height,
+            'config': config_kwargs,
+            'seconds': elapsed,
+            'fps': TRACER.frame_rate(),
+            'stages': TRACER.stage_stats()}
+
+
+def run_matrix(cameras=(1, 2, 4), image_types=('RGB', 'RGB-D', 'RGB-DS'), pedestrians=(20, 80), frames=30,
+               path_results=None, **kwargs):
+    """ Run run_capture for every combination of cameras, image types and pedestrians
+    :param path_results (str): json file to write the results (optional)
+           kwargs: run_capture parameters
+    :return: list of results"""
+    results = []
+    for number_cameras, types, number_pedestrians in itertools.product(cameras, image_types, pedestrians):
+        result = run_capture(number_cameras, types, number_pedestrians, frames, **kwargs)
+        print('-> {} cameras {} {} pedestrians: {:.2f} fps'.format(number_cameras, types, number_pedestrians, result['fps']))
+        results.append(result)
+
+    if path_results is not None:
+        with open(path_results, 'w') as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    # Settings
+    frames = 30
+    width, height = 640, 480
+    config_kwargs = {}  # e.g. {'pipelined': True, 'rpc_clients': 4}
+    path_results = os.path.join(os.getcwd(), 'benchmark_results.json')
+
+    run_matrix(frames=frames, width=width, height=height, path_results=path_results, **config_kwargs)
+    print('-> Results saved to {}'.format(path_results))
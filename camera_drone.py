@@ -1,9 +1,12 @@
 import airsim
-import json
 import math
 import numpy as np
 
 from scipy.spatial.transform import Rotation as R
+from camera_model import CameraModel
+from instrumentation import traced
+from record_log import RecordLog
+from state_log import STATE_DTYPE, STATE_FILE, export_states_json
 
 environment_street_limits = {"Drone1": [10, 14, -7]}# [-153.4, -2, -4]}
 orientations_deg = {"Drone1": [0, 0, -135]}
@@ -17,10 +20,10 @@ class MultiRotor:
         self.Z_init = init_position[2]
         self.vel = vel
 
-        self.cam_states = []
-        self.states = []
+        self.state_log = None
 
         self.extrinsics_camera = None
+        self.camera_model = None
 
     def arm(self, client):
         """ Arm drone
@@ -164,97 +167,81 @@ class MultiRotor:
         return translation, rot_matrix, E
 
     def set_extrinsic_camera(self, state):
-        """ Get extrinsic of the system
-        :param client: airsim.VehicleClient
+        """ Update the camera model, only rebuilt when the pose of the camera changes
+        :param state: airsim.CameraInfo in AirSimLocal coordinates
         :return: translation (list) = [[x],[y],[z]]
-                 rot_matrix (3x3 matrix)
-                 extrinsic matrix (4x3 matrix)"""
-        # Get rotation matrix
-        rotation = state.pose.orientation
-        quaternions = [rotation.x_val, rotation.y_val, rotation.z_val, rotation.w_val]
-        rot = R.from_quat(quaternions)
-        rot_matrix = rot.as_matrix()
-
-        # Get translation
-        translation = [[state.pose.position.x_val],
-                       [state.pose.position.y_val],
-                       [state.pose.position.z_val]]
-        E = np.append(rot_matrix, translation, axis=1)
-
-        assert np.shape(E)[0] == 3 and np.shape(E)[1] == 4
-        self.extrinsics_camera = translation, rot_matrix
-
-    def update_state_cam_info(self, client, frame_index, rgb):
-        """ Update dictionary of camera states
+                 rot_matrix (3x3 matrix)"""
+        position = state.pose.position
+        orientation = state.pose.orientation
+        if self.camera_model is None or not self.camera_model.same_pose(
+                [position.x_val, position.y_val, position.z_val],
+                [orientation.w_val, orientation.x_val, orientation.y_val, orientation.z_val], state.fov):
+            self.camera_model = CameraModel.from_camera_info(state)
+        self.extrinsics_camera = self.camera_model.pose
+        return self.extrinsics_camera
+
+    def open_state_log(self, path, append=False):
+        """ Start recording the states of the drone in path/<name>/states.bin
+        :param path (str): experiment path
+               append (bool): continue an existing log (resume from a checkpoint), otherwise it is started again"""
+        self.state_log = RecordLog(path + '/' + self.name + '/' + STATE_FILE, STATE_DTYPE)
+        if not append:
+            self.state_log.truncate(0)
+
+    def request_state(self, client):
+        """ Request the camera and drone states of a frame, each one once
         :param client: airsim.VehicleClient
-               frame_index (int) """
-        state = self.cam_state(client)
-        self.set_extrinsic_camera(state)
-
-        cam_position = state.pose.position
-        cam_orientation = state.pose.orientation
-
-        pos_x = cam_position.x_val
-        pos_y = cam_position.y_val
-        pos_z = cam_position.z_val
-
-        orient_w = cam_orientation.w_val
-        orient_x = cam_orientation.x_val
-        orient_y = cam_orientation.y_val
-        orient_z = cam_orientation.z_val
-
-        f_fov = self.get_focal_length_px(state.fov, rgb)
-        focal_length = self.get_focal_length(client)
-
-        info_state = {'frame_index': frame_index,
-                      'focal_length': focal_length,
-                      'f_fov': f_fov,
-                      'pos_x': pos_x,
-                      'pos_y': pos_y,
-                      'pos_z': pos_z,
-                      'orient_w': orient_w,
-                      'orient_x': orient_x,
-                      'orient_y': orient_y,
-                      'orient_z': orient_z}
-        self.cam_states.append(info_state)
-
-    def update_state_drone_info(self, client, frame_index):
-        """ Update dictionary of drone states
+        :return: (camera state, drone state, focal length) to be recorded by record_state"""
+        return self.cam_state(client), self.get_state(client), self.get_focal_length(client)
+
+    def record_state(self, frame_index, timestamp, rgb, requested_state):
+        """ Update the camera model and record the states of a frame
+        :param frame_index (int)
+               timestamp (int): airsim timestamp of the images of the frame
+               rgb: image of the frame (its width gives the focal length in pixels)
+               requested_state: given by request_state"""
+        cam_state, state, focal_length = requested_state
+        self.set_extrinsic_camera(cam_state)
+        f_fov = self.camera_model.focal_length_px(np.shape(rgb)[1])
+
+        position, orientation = state.position, state.orientation
+        cam_position, cam_orientation = cam_state.pose.position, cam_state.pose.orientation
+        record = (frame_index, timestamp, focal_length, f_fov,
+                  position.x_val, position.y_val, position.z_val,
+                  orientation.w_val, orientation.x_val, orientation.y_val, orientation.z_val,
+                  cam_position.x_val, cam_position.y_val, cam_position.z_val,
+                  cam_orientation.w_val, cam_orientation.x_val, cam_orientation.y_val, cam_orientation.z_val)
+        if self.state_log is not None:
+            self.state_log.append(record)
+        return record
+
+    @traced('update_state')
+    def update_state(self, client, frame_index, timestamp, rgb):
+        """ Request and record the drone and camera states of a frame
         :param client: airsim.VehicleClient
-               frame_index (int) """
-        state = self.get_state(client)
-        position = state.position
-        orientation = state.orientation
-
-        pos_x = position.x_val
-        pos_y = position.y_val
-        pos_z = position.z_val
-
-        orient_w = orientation.w_val
-        orient_x = orientation.x_val
-        orient_y = orientation.y_val
-        orient_z = orientation.z_val
-
-        focal_length = self.get_focal_length(client)
-
-        info_state = {'frame_index': frame_index,
-                      'focal_length': focal_length,
-                      'pos_x': pos_x,
-                      'pos_y': pos_y,
-                      'pos_z': pos_z,
-                      'orient_w': orient_w,
-                      'orient_x': orient_x,
-                      'orient_y': orient_y,
-                      'orient_z': orient_z}
-        self.states.append(info_state)
-
-    def save_info_state(self, path):
-        """ Save camera and drone states
-        :param path (str): final path to save file """
-        final_path_drone = path + '/' + self.name + '/state_info.json'
-        with open(final_path_drone, 'w') as f:
-            json.dump(self.states, f)
-
-        final_path_cam = path + '/' + self.name + '/state_cam_info.json'
-        with open(final_path_cam, 'w') as f:
-            json.dump(self.cam_states, f)
+               frame_index (int)
+               timestamp (int): airsim timestamp of the images of the frame
+               rgb: image of the frame (its width gives the focal length in pixels)"""
+        return self.record_state(frame_index, timestamp, rgb, self.request_state(client))
+
+    def flush_state(self):
+        """Make the recorded states durable (checkpoints)"""
+        if self.state_log is not None:
+            self.state_log.flush()
+
+    def truncate_state(self, last_frame):
+        """ Drop the states recorded after a frame (resume from a checkpoint)
+        :param last_frame (int): last frame index kept"""
+        if self.state_log is not None:
+            self.state_log.file.flush()
+            frames = RecordLog.load(self.state_log.path)['frame']
+            self.state_log.truncate(int(np.sum(frames <= last_frame)))
+
+    def save_info_state(self, path, export_json=True):
+        """ Close the state log
+        :param path (str): experiment path
+               export_json (bool): also write the legacy state_info.json and state_cam_info.json"""
+        if self.state_log is not None:
+            self.state_log.close()
+        if export_json:
+            export_states_json(path + '/' + self.name)
@@ -0,0 +1,126 @@
+import math
+import numpy as np
+
+from scipy.spatial.transform import Rotation as R
+
+
+class CameraModel:
+    """
+    Pinhole model of a camera computed once from its pose and fov: extrinsic transformation (camera -> global), its
+    inverse, the focal length in pixels and the view frustum of each frame size.
+    Camera axes follow AirSim: x forward (depth), y right (image x), z down (image y).
+    """
+
+    def __init__(self, position, orientation, fov, focal_length_mm=None):
+        """
+        :param position (list): [x, y, z] meters
+               orientation (list): quaternion [w, x, y, z]
+               fov (float): horizontal field of view in degrees
+               focal_length_mm (float)"""
+        self.position = tuple(float(v) for v in position)
+        self.orientation = tuple(float(v) for v in orientation)
+        self.fov = fov
+        self.focal_length_mm = focal_length_mm
+
+        orient_w, orient_x, orient_y, orient_z = self.orientation
+        self.rot_matrix = R.from_quat([orient_x, orient_y, orient_z, orient_w]).as_matrix()
+        self.translation = [[self.position[0]],
+                            [self.position[1]],
+                            [self.position[2]]]
+
+        transformation_gr = np.append(self.rot_matrix, self.translation, axis=1)
+        self.extrinsic = np.append(transformation_gr, [[0, 0, 0, 1]], axis=0)
+        self.extrinsic_inv = np.linalg.inv(self.extrinsic)
+        self.f_fov = 2 * math.tan((fov / 2) * (math.pi / 180))
+
+        self.frustum = {}
+
+    @classmethod
+    def from_state(cls, info_cam):
+        """ Build the model from the camera states saved by Configuration.get_camera_states
+        :param info_cam (dict): {'fov':, 'focal_length_mm':, 'pos_x':, ..., 'orient_w':, ...}"""
+        return cls([info_cam['pos_x'], info_cam['pos_y'], info_cam['pos_z']],
+                   [info_cam['orient_w'], info_cam['orient_x'], info_cam['orient_y'], info_cam['orient_z']],
+                   info_cam['fov'], info_cam.get('focal_length_mm'))
+
+    @classmethod
+    def from_camera_info(cls, camera_info, focal_length_mm=None):
+        """ Build the model from airsim.CameraInfo"""
+        position = camera_info.pose.position
+        orientation = camera_info.pose.orientation
+        return cls([position.x_val, position.y_val, position.z_val],
+                   [orientation.w_val, orientation.x_val, orientation.y_val, orientation.z_val],
+                   camera_info.fov, focal_length_mm)
+
+    def same_pose(self, position, orientation, fov):
+        """Check if the model is still valid for a new pose"""
+        return (self.position == tuple(float(v) for v in position) and
+                self.orientation == tuple(float(v) for v in orientation) and self.fov == fov)
+
+    @property
+    def pose(self):
+        """ :return: translation (list) = [[x], [y], [z]]
+                     rot_matrix (3x3 matrix)"""
+        return self.translation, self.rot_matrix
+
+    def focal_length_px(self, width_frame):
+        """Focal length in pixels f_px = width / (2 * tan(fov / 2))"""
+        return width_frame / self.f_fov
+
+    def to_camera(self, points):
+        """ Global 3d points to camera coordinates
+        :param points: array N X 3
+        :return: array N X 3 (x is the depth)"""
+        return points @ self.extrinsic_inv[:3, :3].T + self.extrinsic_inv[:3, 3]
+
+    def to_global(self, points):
+        """ Camera coordinates to global 3d points
+        :param points: array N X 3
+        :return: array N X 3"""
+        return points @ self.rot_matrix.T + self.extrinsic[:3, 3]
+
+    def frustum_planes(self, width, height, far=100.):
+        """ Planes of the view frustum in global coordinates, computed once per frame size: a point p is inside when
+        normals @ p + offsets >= 0 for every plane
+        :param width, height (int): frame size
+               far (float): farthest distance along the camera axis in meters
+        :return: normals: array 6 X 3 unit vectors pointing inside (near, far, left, right, top, bottom)
+                 offsets: array 6"""
+        key = (width, height, far)
+        if key not in self.frustum:
+            tan_h = self.f_fov / 2
+            tan_v = tan_h * height / width
+            # Camera axes: x forward, y right, z down
+            normals = np.array([[1, 0, 0],
+                                [-1, 0, 0],
+                                [tan_h, 1, 0],
+                                [tan_h, -1, 0],
+                                [tan_v, 0, 1],
+                                [tan_v, 0, -1]], dtype=np.float64)
+            normals /= np.linalg.norm(normals, axis=1)[:, None]
+            offsets_camera = np.array([0, far, 0, 0, 0, 0], dtype=np.float64)
+
+            normals_global = normals @ self.rot_matrix.T
+            position = np.array(self.position)
+            self.frustum[key] = (normals_global, offsets_camera - normals_global @ position)
+        return self.frustum[key]
+
+    def frustum_corners(self, width, height, far=100.):
+        """ Corners of the view frustum (camera center and the 4 corners at the far distance) in global coordinates
+        :return: array 5 X 3"""
+        tan_h = self.f_fov / 2
+        tan_v = tan_h * height / width
+        corners = np.array([[0, 0, 0],
+                            [far, -far * tan_h, -far * tan_v],
+                            [far, far * tan_h, -far * tan_v],
+                            [far, -far * tan_h, far * tan_v],
+                            [far, far * tan_h, far * tan_v]])
+        return self.to_global(corners)
+
+    def in_frustum(self, points, width, height, margin=0., far=100.):
+        """ Points inside the view frustum
+        :param points: array N X 3 global coordinates
+               margin (float): meters the frustum is enlarged, e.g. the size of the objects around the points
+        :return: array N bool"""
+        normals, offsets = self.frustum_planes(width, height, far)
+        return np.all(np.asarray(points) @ normals.T + offsets >= -margin, axis=1)
@@ -0,0 +1,139 @@
+import queue
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from image_utils import getResponseImages, save_images, FrameBuffers
+from instrumentation import span
+
+
+def get_frame(clients, config, buffers=None, requests=None, frame_index=None):
+    """ Images of a frame and its ground truth, requested right after the images
+    :param clients, config, buffers: see getResponseImages
+           requests: GroundTruthRequests or None
+           frame_index (int)
+    :return: images_info[cam_name] = {'timestamp': t, 'rgb': ..., 'depth': ..., 'segmentation': ...}
+             ground truth given by GroundTruthRequests.finish, None without requests"""
+    finish = requests.start(frame_index) if requests is not None else None
+    images = getResponseImages(clients, config, buffers, frame_index)
+    return images, finish() if finish is not None else None
+
+
+class FrameWriter:
+    """
+    Bounded pool of writer threads persisting frames with save_images.
+    cv2.imwrite and np.save release the GIL while encoding/writing, so several threads keep the disk busy while the
+    capture loop keeps talking to the simulator. When the queue is full submit() blocks (backpressure).
+    """
+
+    def __init__(self, config, num_workers=4, queue_size=8):
+        self.config = config
+        self.jobs = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.workers = []
+        for i in range(num_workers):
+            worker = threading.Thread(target=self._run, name='FrameWriter-{}'.format(i), daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                if job is None:
+                    return
+                images_info, frame_index_key, cam = job
+                if self.error is None:
+                    save_images(images_info, frame_index_key, cam, self.config)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.jobs.task_done()
+
+    def _check_error(self):
+        if self.error is not None:
+            raise RuntimeError('Writer worker failed') from self.error
+
+    def submit(self, images_info, frame_index_key, cam):
+        """ Queue images of one camera to be saved, blocks while the queue is full
+        :param images_info: dict = {'timestamp': t, 'rgb': array H X W X 3, 'depth': array H X W  [0,100000], 'segmentation': array H X W X 3}
+               frame_index_key (str): frame index converted to string, e.g., 0000
+               cam (str): camera name"""
+        self._check_error()
+        self.jobs.put((images_info, frame_index_key, cam))
+
+    def drain(self):
+        """Wait until every queued frame is on disk"""
+        self.jobs.join()
+        self._check_error()
+
+    def close(self):
+        """Flush pending frames and stop the workers"""
+        for _ in self.workers:
+            self.jobs.put(None)
+        for worker in self.workers:
+            worker.join()
+        self._check_error()
+
+
+class CapturePipeline:
+    """
+    Pipelined capture: while ground truth of frame N is computed and frame N is persisted by the FrameWriter pool,
+    the images of frame N+1 (and its ground truth requests, see get_frame) are already being requested to the simulator.
+    The image clients must not be shared with the client used for ground truth queries (AirSim clients are not thread safe).
+    """
+
+    def __init__(self, clients, config):
+        self.clients = clients
+        self.config = config
+        self.fetcher = ThreadPoolExecutor(max_workers=1)
+        self.next_images = None
+        self.writer = FrameWriter(config, config.writer_workers, config.writer_queue_size)
+
+        # Frames still in use: queued + being written + current + prefetched
+        self.buffers = None
+        if config.reuse_image_buffers:
+            self.buffers = FrameBuffers(config.writer_queue_size + config.writer_workers + 3)
+
+    def get_images(self, prefetch=True):
+        """ Get images of the current frame and start requesting the images of the next frame
+        :param prefetch (bool): request the next frame in background
+        :return: images_info[cam_name] = {'timestamp': t, 'rgb': array H X W X 3, 'depth': array H X W  [0,100000], 'segmentation': array H X W X 3}"""
+        return self.get_frame(prefetch=prefetch)[0]
+
+    def get_frame(self, frame_index=None, requests=None, prefetch=True):
+        """ Get the images and ground truth of the current frame and start requesting the next frame. The ground truth
+        of the next frame is requested in the same background job, right after its images
+        :param frame_index (int)
+               requests: GroundTruthRequests or None
+               prefetch (bool): request the next frame in background
+        :return: images_info (dict), ground truth (see get_frame)"""
+        if self.next_images is None:
+            frame = get_frame(self.clients, self.config, self.buffers, requests, frame_index)
+        else:
+            # Cleared before waiting: if the prefetched request failed, the frame is requested again
+            next_images, self.next_images = self.next_images, None
+            with span('image_wait'):
+                frame = next_images.result()
+
+        if prefetch:
+            next_index = frame_index + 1 if frame_index is not None else None
+            self.next_images = self.fetcher.submit(get_frame, self.clients, self.config, self.buffers, requests, next_index)
+        return frame
+
+    def save_images(self, images_info, frame_index_key, cam):
+        """Queue images to save, same arguments as image_utils.save_images"""
+        self.writer.submit(images_info, frame_index_key, cam)
+
+    def drain(self):
+        """Wait until the frames queued to save are on disk"""
+        self.writer.drain()
+
+    def close(self):
+        """Wait for pending requests and writes"""
+        if self.next_images is not None:
+            self.next_images.result()
+            self.next_images = None
+        self.fetcher.shutdown()
+        self.writer.close()
+
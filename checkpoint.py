@@ -0,0 +1,107 @@
+import os
+import json
+import time
+
+from instrumentation import span
+
+CHECKPOINT_FILE = 'checkpoint.json'
+
+
+def save_json_atomic(path, data):
+    """Write a json file through a temporary file so that a crash leaves the previous version"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path_save):
+    """ Last checkpoint of an experiment
+    :param path_save (str): experiment path
+    :return: dict = {'frame_index': last consistent frame, 'gt_chunks': {...}, 'depth_frames': {...}, 'time': t} or None"""
+    path_checkpoint = path_save + '/' + CHECKPOINT_FILE
+    if not os.path.exists(path_checkpoint):
+        return None
+    with open(path_checkpoint, 'r') as f:
+        return json.load(f)
+
+
+def write_checkpoint(frame_index, config, gt_store, pipeline=None, uavs=None):
+    """ Make every frame up to frame_index persistent (images, depth, ground truth, drone states) and record it as the
+    last consistent frame of the experiment. Called between frames, when no frame after frame_index has been saved
+    :param frame_index (int): last captured frame
+           config: Configuration Class
+           gt_store: GroundTruthStore
+           pipeline: CapturePipeline, to wait for its writers
+           uavs (list): MultiRotor Class"""
+    with span('checkpoint', frame_index):
+        if pipeline is not None:
+            pipeline.drain()
+        if config.image_encoder is not None:
+            config.image_encoder.drain()
+        depth_frames = {}
+        if config.depth_store is not None:
+            config.depth_store.flush()
+            depth_frames = config.depth_store.frame_counts()
+        gt_store.flush()
+        for drone in uavs or []:
+            drone.flush_state()
+
+        checkpoint = {'frame_index': frame_index,
+                      'gt_chunks': gt_store.chunk_counts(),
+                      'depth_frames': depth_frames,
+                      'time': time.time()}
+        save_json_atomic(config.path_save + '/' + CHECKPOINT_FILE, checkpoint)
+
+
+def remove_orphan_images(path_save, camera_names, last_frame):
+    """ Remove the images saved after the last consistent frame (<frame_index>_<timestamp>.<ext> files)
+    :return: number of files removed"""
+    folders = [path_save + '/' + cam + '/' + folder for cam in camera_names for folder in ('Frames', 'Depth', 'Segmentation')]
+    folders.append(path_save + '/GT')
+    removed = 0
+    for folder in folders:
+        if not os.path.isdir(folder):
+            continue
+        for name_file in os.listdir(folder):
+            prefix = name_file.split('_')[0]
+            if prefix.isdigit() and int(prefix) > last_frame:
+                os.remove(folder + '/' + name_file)
+                removed += 1
+    return removed
+
+
+def clear_capture(path_save, camera_names):
+    """ Start an experiment again (capture without resume): remove the checkpoint and the images of a previous run with
+    the same name, which a later resume would otherwise mix with the new frames
+    :return: number of files removed"""
+    path_checkpoint = path_save + '/' + CHECKPOINT_FILE
+    if os.path.exists(path_checkpoint):
+        os.remove(path_checkpoint)
+    return remove_orphan_images(path_save, camera_names, -1)
+
+
+def resume_capture(config, gt_store, uavs=None):
+    """ Roll back an experiment to its last checkpoint: ground truth chunks, depth frames, images and drone states saved
+    after it are removed, the images before it are kept
+    :param config: Configuration Class, with the stores of the capture already open
+           gt_store: GroundTruthStore
+           uavs (list): MultiRotor Class
+    :return: first frame index to capture"""
+    checkpoint = load_checkpoint(config.path_save)
+    if checkpoint is None:
+        print('-> No checkpoint in {}, capturing from frame 0'.format(config.path_save))
+        checkpoint = {'frame_index': -1, 'gt_chunks': {}, 'depth_frames': {}}
+    last_frame = checkpoint['frame_index']
+
+    gt_store.rollback(checkpoint['gt_chunks'])
+    if config.depth_store is not None:
+        config.depth_store.truncate(checkpoint['depth_frames'])
+    removed = remove_orphan_images(config.path_save, config.camera_names, last_frame)
+    for drone in uavs or []:
+        drone.truncate_state(last_frame)
+
+    print('-> Resuming from frame {} ({} files after the checkpoint removed)'.format(last_frame + 1, removed))
+    return last_frame + 1
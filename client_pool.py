@@ -0,0 +1,245 @@
+import time
+import queue
+import threading
+
+from functools import partial
+
+# Errors of a broken connection or a request without answer: the connection is created again and the request repeated.
+# Errors answered by the simulator (msgpackrpc CallError: wrong arguments, unknown method) are raised as they are
+try:
+    from msgpackrpc.error import TransportError, TimeoutError as RPCTimeoutError
+    RPC_ERRORS = (TransportError, RPCTimeoutError, ConnectionError, TimeoutError)
+except ImportError:
+    RPC_ERRORS = (ConnectionError, TimeoutError)
+
+# Requests that change the simulation relative to its current state: repeating one that reached the simulator before
+# failing would apply it twice (two sim steps, a second move command), so they are never retried
+NOT_RETRIED = ('simContinueForTime', 'moveToPositionAsync')
+
+
+def close_client(client):
+    """Close the connection of an airsim client (msgpackrpc socket and IO loop) instead of leaving it open"""
+    rpc_client = getattr(client, 'client', None)
+    if rpc_client is None:
+        return
+    try:
+        rpc_client.close()
+        loop = getattr(rpc_client, '_loop', None)
+        if loop is not None and hasattr(loop, '_ioloop'):
+            loop._ioloop.close(all_fds=True)
+    except Exception as e:
+        print('-> Closing a broken simulator connection failed ({})'.format(e))
+
+
+class Connection:
+    """One airsim client of a ClientPool, created again when it fails"""
+
+    def __init__(self, shared=True):
+        self.shared = shared
+        self.client = None
+        self.last_used = 0.
+        self.lock = threading.Lock()
+
+
+class ClientProxy:
+    """
+    Used in place of an airsim client (getResponseImages, PoseQueryPool, drone control...): every method call takes a
+    connection of the pool, or its dedicated connection, and is retried on another one if it fails.
+    """
+
+    def __init__(self, pool, connection=None):
+        self.pool = pool
+        self.connection = connection
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return partial(self.pool.call, name, connection=self.connection)
+
+
+class ClientPool:
+    """
+    Pool of airsim clients to one simulator, sized independently of the number of cameras: the threads requesting
+    images and poses share its connections, waiting for a free one. A failed request (connection lost, timeout) drops
+    its connection, which is closed and created again with exponential backoff, and the request is repeated up to
+    retries times (except the NOT_RETRIED requests).
+    Connections unused for more than health_interval seconds are checked with ping before being used.
+    """
+
+    def __init__(self, client_class, size, ip='', port=41451, timeout=60, retries=3, backoff=0.5, max_backoff=30.,
+                 reconnect_attempts=8, health_interval=30.):
+        """
+        :param client_class: airsim.VehicleClient or airsim.MultirotorClient
+               size (int): number of shared connections
+               ip, port: simulator address
+               timeout (float): seconds to wait for the answer of a request
+               retries (int): times a failed request is repeated
+               backoff, max_backoff (float): seconds between reconnections, doubled after each failed attempt
+               reconnect_attempts (int): failed reconnections before giving up"""
+        assert size > 0, 'The client pool needs at least one connection'
+        self.factory = partial(client_class, ip=ip, port=port, timeout_value=timeout)
+        self.size = size
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.reconnect_attempts = reconnect_attempts
+        self.health_interval = health_interval
+
+        # Connections are created on first use
+        self.connections = [Connection() for _ in range(size)]
+        self.idle = queue.LifoQueue()
+        for connection in self.connections:
+            self.idle.put(connection)
+
+        self.lock = threading.Lock()
+        self.stats = {'calls': 0, 'failures': 0, 'reconnects': 0, 'health_checks': 0}
+
+    def _count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def _delay(self, attempt):
+        return min(self.backoff * 2 ** attempt, self.max_backoff)
+
+    def _connect(self, connection):
+        """Create the client of a connection, waiting between failed attempts"""
+        reconnect = connection.client is not None or connection.last_used > 0
+        self._drop(connection)
+        for attempt in range(self.reconnect_attempts):
+            try:
+                client = self.factory()
+                client.ping()
+            except RPC_ERRORS as e:
+                print('-> Simulator connection failed ({}), attempt {}/{}'.format(e, attempt + 1, self.reconnect_attempts))
+                time.sleep(self._delay(attempt))
+                continue
+            connection.client = client
+            if reconnect:
+                self._count('reconnects')
+            return
+        raise ConnectionError('Could not connect to the simulator after {} attempts'.format(self.reconnect_attempts))
+
+    @staticmethod
+    def _drop(connection):
+        """Close the client of a connection, created again on next use"""
+        if connection.client is not None:
+            close_client(connection.client)
+            connection.client = None
+
+    def _check(self, connection):
+        """Health check: ping the client, created again if it does not answer"""
+        self._count('health_checks')
+        try:
+            connection.client.ping()
+        except RPC_ERRORS:
+            self._count('failures')
+            self._connect(connection)
+
+    def acquire(self, connection=None):
+        """ Take a free connection of the pool (or lock a dedicated one) with a working client
+        :return: Connection, give it back with release"""
+        if connection is None:
+            connection = self.idle.get()
+        else:
+            connection.lock.acquire()
+        try:
+            if connection.client is None:
+                self._connect(connection)
+            elif time.perf_counter() - connection.last_used > self.health_interval:
+                self._check(connection)
+        except Exception:
+            self.release(connection)
+            raise
+        return connection
+
+    def release(self, connection, broken=False):
+        """:param broken (bool): the client failed, it is created again on next use"""
+        connection.last_used = time.perf_counter()
+        if broken:
+            self._drop(connection)
+        if connection.shared:
+            self.idle.put(connection)
+        else:
+            connection.lock.release()
+
+    def call(self, name, *args, connection=None, **kwargs):
+        """ Call a method of the airsim client, retried after a failure
+        :param name (str): method, e.g. 'simGetImages'
+               connection: dedicated Connection, None to use any connection of the pool
+        :return: the result of the method"""
+        retries = 0 if name in NOT_RETRIED else self.retries
+        for attempt in range(retries + 1):
+            conn = self.acquire(connection)
+            try:
+                result = getattr(conn.client, name)(*args, **kwargs)
+            except RPC_ERRORS as e:
+                self.release(conn, broken=True)
+                self._count('failures')
+                if attempt == retries:
+                    raise
+                print('-> {} failed ({}), retrying'.format(name, e))
+                time.sleep(self._delay(attempt))
+                continue
+            except Exception:
+                self.release(conn)
+                raise
+            self.release(conn)
+            self._count('calls')
+            return result
+
+    def proxy(self, dedicated=False):
+        """ Client to pass where an airsim client is expected
+        :param dedicated (bool): the proxy has its own connection (outside the pool size), for calls whose result keeps
+                                 using the client such as the drone *Async futures
+        :return: ClientProxy"""
+        return ClientProxy(self, Connection(shared=False) if dedicated else None)
+
+    def proxies(self, number):
+        """:return: list of number ClientProxy sharing the pool"""
+        return [self.proxy() for _ in range(number)]
+
+    def health_check(self):
+        """Ping the idle connections of the pool, the ones that do not answer are created again"""
+        idle = []
+        while True:
+            try:
+                idle.append(self.idle.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            for connection in idle:
+                if connection.client is not None:
+                    self._check(connection)
+        finally:
+            for connection in idle:
+                self.idle.put(connection)
+
+    def format_stats(self):
+        with self.lock:
+            return 'rpc {calls} calls, {failures} failures, {reconnects} reconnects'.format(**self.stats)
+
+
+def recover(clients):
+    """ Health check of the pools of some clients before repeating a failed frame (raw airsim clients are skipped)
+    :param clients (list): airsim clients or ClientProxy"""
+    pools = []
+    for client in clients:
+        if isinstance(client, ClientProxy) and client.pool not in pools:
+            pools.append(client.pool)
+    for pool in pools:
+        pool.health_check()
+
+
+def create_clients(client_class, config, ip='', port=41451):
+    """ Clients of the capture sharing one ClientPool (config.rpc_pool_size connections, by default one per client)
+    :param client_class: airsim.VehicleClient or airsim.MultirotorClient
+           config: Configuration Class
+    :return: pool: ClientPool
+             clients (list): number_cameras (+ 1 pipelined) ClientProxy, the first one (reference client) with its own
+                             connection
+             query_clients (list): rpc_clients ClientProxy for PoseQueryPool"""
+    number_clients = config.number_cameras + int(config.pipelined)
+    size = config.rpc_pool_size or (number_clients - 1 + config.rpc_clients) or 1
+    pool = ClientPool(client_class, size, ip, port, timeout=config.rpc_timeout, retries=config.rpc_retries)
+    clients = [pool.proxy(dedicated=True)] + pool.proxies(number_clients - 1)
+    return pool, clients, pool.proxies(config.rpc_clients)
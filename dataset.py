@@ -0,0 +1,338 @@
+"""
+Reader of the experiments recorded by main_cv_fixed / main_cv_movable (record_data/<name_experiment>):
+frame index built once and cached on disk, random access by (camera, frame) with images decoded on demand, depth
+memory mapped and ground truth read from the columnar store (gt_store) instead of the full json files.
+"""
+import os
+import glob
+import json
+import cv2
+import numpy as np
+
+from depth_store import DepthReader
+from gt_store import GT2D_DTYPE, GT3D_DTYPE, OPTIONAL_COLUMNS, as_dtype, save_atomic_npz
+from state_log import STATE_FILE, load_states, states_to_dicts
+
+INDEX_NAME = 'dataset_index.npz'
+CACHE_FOLDER = 'dataset_cache'
+STREAMS = {'rgb': ('Frames', ('.png', '.webp', '.jpg')), 'depth': ('Depth', ('.npy',)),
+           'segmentation': ('Segmentation', ('.png', '.webp', '.jpg'))}
+# Extension of the file of each stream, '' if it was not saved ('.bin' for chunked depth)
+INDEX_DTYPE = np.dtype([('frame', np.int32), ('timestamp', np.uint64), ('stem', 'U48'),
+                        ('rgb', 'U5'), ('depth', 'U5'), ('segmentation', 'U5')])
+
+
+def parse_stem(stem):
+    """ File names of the images are <frame_index>_<timestamp>
+    :return: frame_index (int), timestamp (int)"""
+    frame_index, timestamp = stem.split('_')[:2]
+    return int(frame_index), int(timestamp)
+
+
+def list_stems(folder, extensions):
+    """:return: dict stem = extension of the images of a folder"""
+    if not os.path.isdir(folder):
+        return {}
+    stems = {}
+    for name in os.listdir(folder):
+        stem, extension = os.path.splitext(name)
+        if extension in extensions:
+            stems[stem] = extension
+    return stems
+
+
+def build_camera_index(path_cam):
+    """ Index of the frames saved for one camera
+    :param path_cam (str): experiment/<cam>
+    :return: structured array of INDEX_DTYPE sorted by frame"""
+    stems = {stream: list_stems(path_cam + '/' + folder, extensions) for stream, (folder, extensions) in STREAMS.items()}
+    depth_reader = None
+    if os.path.exists(path_cam + '/Depth/index.bin'):
+        depth_reader = DepthReader(path_cam + '/Depth')
+
+    all_stems = set().union(*[set(stream_stems) for stream_stems in stems.values()])
+    index = np.zeros(len(all_stems), dtype=INDEX_DTYPE)
+    for i, stem in enumerate(all_stems):
+        frame_index, timestamp = parse_stem(stem)
+        index[i] = (frame_index, timestamp, stem, stems['rgb'].get(stem, ''), stems['depth'].get(stem, ''),
+                    stems['segmentation'].get(stem, ''))
+
+    # Chunked depth has no file per frame: frames only found in its index are added
+    if depth_reader is not None:
+        missing = np.setdiff1d(depth_reader.frames, index['frame'])
+        extra = np.zeros(len(missing), dtype=INDEX_DTYPE)
+        extra['frame'] = missing
+        extra['timestamp'] = [depth_reader.timestamp(frame_index) for frame_index in missing]
+        extra['stem'] = ['{}_{}'.format(frame_index, timestamp) for frame_index, timestamp in zip(extra['frame'], extra['timestamp'])]
+        index = np.concatenate([index, extra])
+        index['depth'] = np.where(np.isin(index['frame'], depth_reader.frames), '.bin', '')
+    return index[np.argsort(index['frame'], kind='stable')]
+
+
+def folder_signature(path_cam):
+    """Modification times of the folders of a camera, to know if the cached index is still valid"""
+    signature = []
+    for folder in ['Frames', 'Depth', 'Segmentation']:
+        folder_path = path_cam + '/' + folder
+        signature.append(os.stat(folder_path).st_mtime_ns if os.path.isdir(folder_path) else 0)
+    return signature
+
+
+class CameraFrame:
+    """One frame of one camera. Images are read from disk the first time they are used"""
+
+    def __init__(self, dataset, cam, entry):
+        self.dataset = dataset
+        self.cam = cam
+        self.frame_index = int(entry['frame'])
+        self.timestamp = int(entry['timestamp'])
+        self.entry = entry
+        self.cache = {}
+
+    def _path(self, stream):
+        folder, _ = STREAMS[stream]
+        return self.dataset.path + '/' + self.cam + '/' + folder + '/' + str(self.entry['stem']) + str(self.entry[stream])
+
+    @property
+    def rgb(self):
+        """:return: array H X W X 3 (BGR as saved by cv2) or None"""
+        if 'rgb' not in self.cache:
+            self.cache['rgb'] = cv2.imread(self._path('rgb')) if self.entry['rgb'] else None
+        return self.cache['rgb']
+
+    @property
+    def segmentation(self):
+        """:return: array H X W X 3 (BGR), array H X W of segmentation ids if it was saved with segmentation_indexed
+        (image_encoder.SegmentationPalette.to_color gives the colors back) or None"""
+        if 'segmentation' not in self.cache:
+            self.cache['segmentation'] = cv2.imread(self._path('segmentation'), cv2.IMREAD_UNCHANGED) if self.entry['segmentation'] else None
+        return self.cache['segmentation']
+
+    @property
+    def depth(self):
+        """:return: depth in millimeters, memory mapped (array H X W X 1 float for .npy files, H X W uint16 for chunked
+        storage) or None"""
+        if 'depth' not in self.cache:
+            self.cache['depth'] = self.dataset.get_depth(self.cam, self.frame_index, self.entry)
+        return self.cache['depth']
+
+    @property
+    def gt2d(self):
+        """:return: structured array GT2D_DTYPE (id is the index in dataset.name_pedestrians)"""
+        return self.dataset.get_gt2d(self.cam, self.frame_index)
+
+    @property
+    def camera_state(self):
+        """:return: dict with the pose of the camera in this frame"""
+        return self.dataset.get_camera_state(self.cam, self.frame_index)
+
+
+class ExperimentDataset:
+    """
+    Random access to a recorded experiment:
+        dataset = ExperimentDataset('record_data/TEST')
+        sample = dataset.get('cam1', 10)          # CameraFrame
+        for frame_index, samples in dataset:      # synchronized cameras: samples[cam] = CameraFrame
+    """
+
+    def __init__(self, path, camera_names=None, rebuild_index=False, gt2d_folder=None):
+        """
+        :param path (str): experiment folder record_data/<name_experiment>
+               camera_names (list str): cameras to read, by default every camera folder
+               rebuild_index (bool): ignore the cached frame index
+               gt2d_folder (str): folder of the experiment with 2d ground truth regenerated by regenerate_gt, None for
+                                  the ground truth recorded with the images"""
+        self.path = path
+        self.gt2d_folder = gt2d_folder
+        if camera_names is None:
+            camera_names = sorted(name for name in os.listdir(path)
+                                  if os.path.isdir(path + '/' + name) and any(os.path.isdir(path + '/' + name + '/' + folder) or
+                                                                              os.path.exists(path + '/' + name + '/camera_info.json')
+                                                                              for folder in ['Frames', 'Depth', 'Segmentation']))
+        self.camera_names = list(camera_names)
+        self.index = self.load_index(rebuild_index)
+        self.frames = self.synchronized_frames()
+
+        self.depth_readers = {}
+        self.camera_states = {}
+        self.name_pedestrians, self.gt3d, self.gt2d = self.load_gt()
+        self.scene = self.load_scene()
+
+    # ---------Frame index------------------
+    def load_index(self, rebuild=False):
+        """ Per camera frame index, read from INDEX_NAME if the camera folders did not change since it was built
+        :return: dict index[cam] = structured array INDEX_DTYPE"""
+        index_path = self.path + '/' + INDEX_NAME
+        signatures = {cam: folder_signature(self.path + '/' + cam) for cam in self.camera_names}
+        if not rebuild and os.path.exists(index_path):
+            with np.load(index_path) as data:
+                cached_signatures = json.loads(str(data['signatures']))
+                if all(cached_signatures.get(cam) == signatures[cam] and data['index_' + cam].dtype == INDEX_DTYPE
+                       for cam in self.camera_names):
+                    return {cam: data['index_' + cam] for cam in self.camera_names}
+
+        index = {cam: build_camera_index(self.path + '/' + cam) for cam in self.camera_names}
+        arrays = {'index_' + cam: camera_index for cam, camera_index in index.items()}
+        save_atomic_npz(index_path, signatures=np.array(json.dumps(signatures)), **arrays)
+        return index
+
+    def synchronized_frames(self):
+        """Frames recorded by every camera"""
+        frames = None
+        for cam in self.camera_names:
+            frames = self.index[cam]['frame'] if frames is None else np.intersect1d(frames, self.index[cam]['frame'])
+        return frames if frames is not None else np.empty(0, dtype=np.int32)
+
+    def entry(self, cam, frame_index):
+        camera_index = self.index[cam]
+        i = np.searchsorted(camera_index['frame'], frame_index)
+        if i == len(camera_index) or camera_index['frame'][i] != frame_index:
+            raise KeyError('Frame {} not found for camera {}'.format(frame_index, cam))
+        return camera_index[i]
+
+    # ---------Ground truth------------------
+    def load_gt(self):
+        """ Ground truth tables sorted by frame: gt_store chunks, or the legacy json files converted once to
+        dataset_cache
+        :return: name_pedestrians (list), gt3d (structured array), gt2d (dict cam = structured array)"""
+        path_store = self.path + '/gt_store'
+        if os.path.exists(path_store + '/pedestrian_names.json'):
+            with open(path_store + '/pedestrian_names.json', 'r') as f:
+                name_pedestrians = json.load(f)
+            gt3d = self.load_chunks(path_store, 'gt3d', GT3D_DTYPE)
+            gt2d = {cam: self.load_chunks(path_store, 'gt2d_' + cam, GT2D_DTYPE) for cam in self.camera_names}
+        else:
+            name_pedestrians, gt3d, gt2d = self.load_legacy_gt()
+        if self.gt2d_folder is not None:
+            gt2d = {cam: self.load_chunks(self.path + '/' + self.gt2d_folder, 'gt2d_' + cam, GT2D_DTYPE) for cam in self.camera_names}
+        gt3d = gt3d[np.argsort(gt3d['frame'], kind='stable')]
+        gt2d = {cam: rows[np.argsort(rows['frame'], kind='stable')] for cam, rows in gt2d.items()}
+        return name_pedestrians, gt3d, gt2d
+
+    def load_scene(self):
+        """ Every pose requested during the capture (GroundTruthStore.add_scene) sorted by frame, the 3d ground truth
+        for experiments recorded without it
+        :return: structured array GT3D_DTYPE"""
+        scene = self.load_chunks(self.path + '/gt_store', 'scene', GT3D_DTYPE)
+        if len(scene) == 0:
+            return self.gt3d
+        return scene[np.argsort(scene['frame'], kind='stable')]
+
+    @staticmethod
+    def load_chunks(path, name, dtype):
+        chunks = [np.empty(0, dtype=dtype)]
+        for chunk_path in sorted(glob.glob(path + '/' + name + '_' + '[0-9]' * 5 + '.npz')):
+            with np.load(chunk_path) as data:
+                chunks.append(as_dtype(data['rows'], dtype))
+        return np.concatenate(chunks)
+
+    def load_legacy_gt(self):
+        path_cache = self.path + '/' + CACHE_FOLDER
+        names_path = path_cache + '/pedestrian_names.json'
+        if os.path.exists(names_path):
+            with open(names_path, 'r') as f:
+                name_pedestrians = json.load(f)
+            gt3d = as_dtype(np.load(path_cache + '/gt3d.npy'), GT3D_DTYPE)
+            gt2d = {}
+            for cam in self.camera_names:
+                cam_path = path_cache + '/gt2d_' + cam + '.npy'
+                gt2d[cam] = as_dtype(np.load(cam_path), GT2D_DTYPE) if os.path.exists(cam_path) else np.empty(0, dtype=GT2D_DTYPE)
+            return name_pedestrians, gt3d, gt2d
+
+        dict_names = {}
+        gt3d = self.legacy_to_rows(self.path + '/gt3d_pedestrians.json', GT3D_DTYPE, dict_names)
+        gt2d = {cam: self.legacy_to_rows(self.path + '/' + cam + '/gt2d_pedestrians.json', GT2D_DTYPE, dict_names)
+                for cam in self.camera_names}
+        name_pedestrians = sorted(dict_names, key=dict_names.get)
+
+        if not os.path.exists(path_cache):
+            os.makedirs(path_cache)
+        np.save(path_cache + '/gt3d.npy', gt3d)
+        for cam, rows in gt2d.items():
+            np.save(path_cache + '/gt2d_' + cam + '.npy', rows)
+        # Names last: the cache is only used when it is complete
+        with open(names_path, 'w') as f:
+            json.dump(name_pedestrians, f)
+        return name_pedestrians, gt3d, gt2d
+
+    @staticmethod
+    def legacy_to_rows(path_json, dtype, dict_names):
+        """ Legacy json {frame_index_key: [{'id': name, ...}, ...]} to a structured array, ids assigned in dict_names"""
+        if not os.path.exists(path_json):
+            return np.empty(0, dtype=dtype)
+        with open(path_json, 'r') as f:
+            info = json.load(f)
+        columns = [name for name in dtype.names if name not in ('frame', 'id')]
+        rows = []
+        for frame_index_key, info_pedestrians in info.items():
+            for info_ped in info_pedestrians:
+                id_ped = dict_names.setdefault(info_ped['id'], len(dict_names))
+                rows.append((int(frame_index_key), id_ped) + tuple(info_ped.get(column, -1) if column in OPTIONAL_COLUMNS
+                                                                   else info_ped[column] for column in columns))
+        return np.array(rows, dtype=dtype)
+
+    @staticmethod
+    def frame_rows(rows, frame_index):
+        start, end = np.searchsorted(rows['frame'], [frame_index, frame_index + 1])
+        return rows[start:end]
+
+    def get_gt2d(self, cam, frame_index):
+        """:return: structured array GT2D_DTYPE of the frame"""
+        return self.frame_rows(self.gt2d[cam], frame_index)
+
+    def get_gt3d(self, frame_index):
+        """:return: structured array GT3D_DTYPE of the frame"""
+        return self.frame_rows(self.gt3d, frame_index)
+
+    def get_scene(self, frame_index):
+        """:return: structured array GT3D_DTYPE, every pose requested in the frame"""
+        return self.frame_rows(self.scene, frame_index)
+
+    # ---------Images and states------------------
+    def get_depth(self, cam, frame_index, entry=None):
+        if entry is None:
+            entry = self.entry(cam, frame_index)
+        if not entry['depth']:
+            return None
+        path_depth = self.path + '/' + cam + '/Depth'
+        if os.path.exists(path_depth + '/index.bin'):
+            if cam not in self.depth_readers:
+                self.depth_readers[cam] = DepthReader(path_depth)
+            return self.depth_readers[cam].get(frame_index)
+        return np.load(path_depth + '/' + str(entry['stem']) + '.npy', mmap_mode='r')
+
+    def get_camera_state(self, cam, frame_index):
+        """ Pose of a camera: camera_info.json for external cameras, states.bin (or state_cam_info.json) per frame for drones"""
+        if cam not in self.camera_states:
+            path_cam = self.path + '/' + cam
+            if os.path.exists(path_cam + '/' + STATE_FILE):
+                self.camera_states[cam] = {state['frame_index']: state for state in states_to_dicts(load_states(path_cam))}
+            elif os.path.exists(path_cam + '/state_cam_info.json'):
+                with open(path_cam + '/state_cam_info.json', 'r') as f:
+                    self.camera_states[cam] = {state['frame_index']: state for state in json.load(f)}
+            elif os.path.exists(path_cam + '/camera_info.json'):
+                with open(path_cam + '/camera_info.json', 'r') as f:
+                    self.camera_states[cam] = json.load(f)
+            else:
+                self.camera_states[cam] = None
+        states = self.camera_states[cam]
+        if states is not None and 'pos_x' not in states:
+            return states.get(frame_index)
+        return states
+
+    def get(self, cam, frame_index):
+        """:return: CameraFrame"""
+        return CameraFrame(self, cam, self.entry(cam, frame_index))
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, i):
+        """ i-th synchronized frame
+        :return: frame_index (int), samples (dict): samples[cam] = CameraFrame"""
+        frame_index = int(self.frames[i])
+        return frame_index, {cam: self.get(cam, frame_index) for cam in self.camera_names}
+
+    def __iter__(self):
+        for i in range(len(self.frames)):
+            yield self[i]
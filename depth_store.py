@@ -0,0 +1,206 @@
+import os
+import glob
+import zlib
+import threading
+import numpy as np
+
+from image_utils import check_path
+from record_log import RecordLog
+
+INDEX_DTYPE = np.dtype([('frame', np.int32), ('timestamp', np.uint64), ('chunk', np.int32), ('offset', np.int64),
+                        ('nbytes', np.int64), ('height', np.int32), ('width', np.int32), ('compression', np.int8)])
+
+
+def depth_to_uint16(depth_img_in_mm):
+    """ Depth in millimeters as uint16 (the values are already clamped to [0, 65535] by responseTOdepth_mm)
+    :param depth_img_in_mm: array H X W (X 1) float
+    :return: array H X W uint16"""
+    depth = np.asarray(depth_img_in_mm)
+    if depth.ndim == 3:
+        depth = depth[:, :, 0]
+    return np.rint(np.clip(depth, 0, 65535)).astype(np.uint16)
+
+
+def encode_depth(depth_mm, level):
+    """ uint16 depth to bytes: raw (level 0) or zlib over the byte planes (high bytes first, then low bytes),
+    which compresses much better than the interleaved values"""
+    if level == 0:
+        return depth_mm.tobytes()
+    planes = depth_mm.reshape(-1).view(np.uint8).reshape(-1, 2).T
+    return zlib.compress(np.ascontiguousarray(planes[::-1]).tobytes(), level)
+
+
+def decode_depth(blob, height, width, compressed):
+    """Inverse of encode_depth: array H X W uint16"""
+    if not compressed:
+        return np.frombuffer(blob, dtype=np.uint16).reshape(height, width)
+    planes = np.frombuffer(zlib.decompress(blob), dtype=np.uint8).reshape(2, -1)[::-1]
+    return np.ascontiguousarray(planes.T).view(np.uint16).reshape(height, width)
+
+
+class DepthWriter:
+    """
+    Depth of one camera stored as uint16 millimeters in append-only chunk files of chunk_frames frames
+    (Depth/depth_00000.bin, ...) plus an index (Depth/index.bin, RecordLog of INDEX_DTYPE) with the position of each frame.
+    """
+
+    def __init__(self, path, chunk_frames=500, compression=1, append=False):
+        """
+        :param path (str): camera Depth folder
+               chunk_frames (int): frames per chunk file
+               compression (int): zlib level 1-9, 0 stores raw frames that can be memory mapped
+               append (bool): keep the frames of a previous capture (resume from a checkpoint), otherwise removed"""
+        check_path(path)
+        self.path = path
+        self.chunk_frames = chunk_frames
+        self.compression = compression
+        self.lock = threading.Lock()
+        self.index = RecordLog(path + '/index.bin', INDEX_DTYPE)
+        if not append:
+            self.index.truncate(0)
+            for chunk_path in glob.glob(self.path + '/depth_' + '[0-9]' * 5 + '.bin'):
+                os.remove(chunk_path)
+
+        entries = RecordLog.load(self.index.path)
+        self.chunk = int(entries['chunk'].max()) if len(entries) else 0
+        self.frames_in_chunk = int(np.sum(entries['chunk'] == self.chunk))
+        self.file = None
+
+    def chunk_path(self, chunk):
+        return self.path + '/depth_{:05d}.bin'.format(chunk)
+
+    def append(self, frame_index, timestamp, depth_img_in_mm):
+        """ Add one frame, written immediately (writers of different frames can call it concurrently)
+        :param frame_index (int)
+               timestamp (int): airsim timestamp
+               depth_img_in_mm: array H X W (X 1) in millimeters"""
+        depth = depth_to_uint16(depth_img_in_mm)
+        blob = encode_depth(depth, self.compression)
+        height, width = depth.shape
+
+        with self.lock:
+            if self.frames_in_chunk >= self.chunk_frames:
+                if self.file is not None:
+                    self.file.close()
+                    self.file = None
+                self.chunk += 1
+                self.frames_in_chunk = 0
+            if self.file is None:
+                self.file = open(self.chunk_path(self.chunk), 'ab')
+            offset = self.file.tell()
+            self.file.write(blob)
+            # Blob before its index entry: an indexed frame is always complete
+            self.file.flush()
+            self.index.append((frame_index, timestamp, self.chunk, offset, len(blob), height, width, self.compression))
+            self.frames_in_chunk += 1
+
+    def truncate(self, number_frames):
+        """Keep the first number_frames frames of the index and remove the depth written after them (resume from a checkpoint)"""
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            self.index.file.flush()
+            entries = RecordLog.load(self.index.path)[:number_frames]
+            self.index.truncate(len(entries))
+
+            if len(entries):
+                self.chunk = int(entries['chunk'][-1])
+                end = int(entries['offset'][-1] + entries['nbytes'][-1])
+            else:
+                self.chunk, end = 0, 0
+            self.frames_in_chunk = int(np.sum(entries['chunk'] == self.chunk))
+            for chunk_path in glob.glob(self.path + '/depth_' + '[0-9]' * 5 + '.bin'):
+                chunk = int(os.path.basename(chunk_path)[6:11])
+                if chunk > self.chunk:
+                    os.remove(chunk_path)
+                elif chunk == self.chunk:
+                    os.truncate(chunk_path, end)
+
+    def flush(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+            self.index.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            self.index.close()
+
+
+class DepthStore:
+    """Chunked depth storage of every camera: path_save/<cam>/Depth"""
+
+    def __init__(self, path_save, camera_names, chunk_frames=500, compression=1, append=False):
+        self.writers = {cam: DepthWriter(path_save + '/' + cam + '/Depth', chunk_frames, compression, append)
+                        for cam in camera_names}
+
+    def append(self, cam, frame_index, timestamp, depth_img_in_mm):
+        self.writers[cam].append(frame_index, timestamp, depth_img_in_mm)
+
+    def frame_counts(self):
+        """:return: dict cam = number of frames in the index"""
+        return {cam: len(writer.index) for cam, writer in self.writers.items()}
+
+    def truncate(self, frame_counts):
+        """:param frame_counts (dict): given by frame_counts, missing cameras are emptied"""
+        for cam, writer in self.writers.items():
+            writer.truncate(frame_counts.get(cam, 0))
+
+    def flush(self):
+        for writer in self.writers.values():
+            writer.flush()
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+
+
+class DepthReader:
+    """
+    Random access to the depth of one camera saved by DepthWriter. Raw chunks are memory mapped, so a frame is only read
+    from disk when it is used.
+    """
+
+    def __init__(self, path):
+        """:param path (str): camera Depth folder"""
+        self.path = path
+        self.index = RecordLog.load(path + '/index.bin')
+        order = np.argsort(self.index['frame'], kind='stable')
+        self.index = self.index[order]
+        self.frames = self.index['frame']
+        self.maps = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def chunk_map(self, chunk):
+        if chunk not in self.maps:
+            self.maps[chunk] = np.memmap(self.path + '/depth_{:05d}.bin'.format(chunk), dtype=np.uint8, mode='r')
+        return self.maps[chunk]
+
+    def entry(self, frame_index):
+        i = np.searchsorted(self.frames, frame_index)
+        if i == len(self.frames) or self.frames[i] != frame_index:
+            raise KeyError('Frame {} not found in {}'.format(frame_index, self.path))
+        return self.index[i]
+
+    def get(self, frame_index):
+        """ Depth of a frame
+        :param frame_index (int)
+        :return: array H X W uint16 in millimeters (read-only view of the file for raw chunks)"""
+        entry = self.entry(frame_index)
+        chunk = self.chunk_map(int(entry['chunk']))
+        blob = chunk[int(entry['offset']):int(entry['offset']) + int(entry['nbytes'])]
+        return decode_depth(blob, int(entry['height']), int(entry['width']), int(entry['compression']) != 0)
+
+    def timestamp(self, frame_index):
+        return int(self.entry(frame_index)['timestamp'])
+
+    def __iter__(self):
+        for frame_index in self.frames:
+            yield int(frame_index), self.get(frame_index)
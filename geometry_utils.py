@@ -10,6 +10,7 @@ class Point3D:
     """
     Represents a 3d point.
     """
+    __slots__ = ('x', 'y', 'z', 's')
 
     def __init__(self, x, y, z=0., s=1.):
         self.x = x
@@ -28,6 +29,8 @@ class Point3D:
 
 
 class Cylinder:
+    __slots__ = ('center', 'width', 'height')
+
     def __init__(self, center, width, height):
         self.center = center
         self.width = width
@@ -68,6 +71,7 @@ class Point2D:
     Represents a 2d point.
     Can transform between normal (x,y) and homogeneous (x,y,s) coordinates
     """
+    __slots__ = ('x', 'y', 's')
 
     def __init__(self, x, y, s=1.):
         self.x = x
@@ -92,6 +96,7 @@ class Bbox:
     Represents a bounding box (region) on a plane.
     Can transform between 'opposite corners' [(xmin, ymin), (xmax, ymax)] and 'size' [(xmin, ymin), height, width] coordinates
     """
+    __slots__ = ('xmin', 'xmax', 'width', 'ymin', 'ymax', 'height')
 
     def __init__(self, xmin, xmax, width, ymin, ymax, height):
         self.xmin = int(xmin)
@@ -114,6 +119,7 @@ class Bbox:
         return self.xmin, self.ymin, self.xmax, self.ymax
 
 
+
 # ----------------Geometry UTILS----------------
 
 
@@ -0,0 +1,236 @@
+import os
+import glob
+import json
+import numpy as np
+
+from image_utils import check_path
+
+FRAME_DTYPE = np.dtype([('frame', np.int32)])
+
+GT3D_DTYPE = np.dtype([('frame', np.int32), ('id', np.int32),
+                       ('pos_x', np.float64), ('pos_y', np.float64), ('pos_z', np.float64),
+                       ('orient_w', np.float64), ('orient_x', np.float64), ('orient_y', np.float64), ('orient_z', np.float64),
+                       ('predicted', np.int8)])
+
+GT2D_DTYPE = np.dtype([('frame', np.int32), ('id', np.int32),
+                       ('xmin', np.float64), ('ymin', np.float64), ('xmax', np.float64), ('ymax', np.float64),
+                       ('visible_px', np.int32), ('occlusion', np.float64), ('visibility', np.float64),
+                       ('predicted', np.int8)])
+
+# Columns only known for some ground truth sources (segmentation, depth test) or capture modes (predicted: 1 when the
+# pose, or the pose the bbox was reprojected from, was extrapolated by PoseTrajectories and not requested), -1 when
+# unknown and not exported to json
+OPTIONAL_COLUMNS = ('visible_px', 'occlusion', 'visibility', 'predicted')
+
+
+def as_dtype(rows, dtype):
+    """ Rows saved with an older version of a table dtype: common columns copied, optional columns set to -1"""
+    if rows.dtype == dtype:
+        return rows
+    converted = np.zeros(len(rows), dtype=dtype)
+    for name in dtype.names:
+        if name in rows.dtype.names:
+            converted[name] = rows[name]
+        elif name in OPTIONAL_COLUMNS:
+            converted[name] = -1
+    return converted
+
+
+def save_atomic_npz(path, **arrays):
+    """Write a .npz file through a temporary file so that a crash never leaves a half written chunk"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+class ChunkedTable:
+    """
+    Append-only table of structured rows kept in a fixed size buffer and flushed to disk as numbered .npz chunks:
+    path/<name>_00000.npz, path/<name>_00001.npz, ...
+    """
+
+    def __init__(self, path, name, dtype, chunk_size):
+        self.path = path
+        self.name = name
+        self.dtype = dtype
+        self.buffer = np.empty(chunk_size, dtype=dtype)
+        self.size = 0
+        self.chunk_index = len(self.chunk_files())
+
+    def chunk_files(self):
+        return sorted(glob.glob(self.path + '/' + self.name + '_' + '[0-9]' * 5 + '.npz'))
+
+    def append(self, rows):
+        """ Append rows to the table
+        :param rows (list tuple): values in the order of the table dtype"""
+        for row in rows:
+            if self.size == len(self.buffer):
+                self.flush()
+            self.buffer[self.size] = row
+            self.size += 1
+
+    def flush(self):
+        """Write the rows in memory as a new chunk"""
+        if self.size == 0:
+            return
+        chunk_path = self.path + '/' + self.name + '_' + str(self.chunk_index).zfill(5) + '.npz'
+        save_atomic_npz(chunk_path, rows=self.buffer[:self.size])
+        self.chunk_index += 1
+        self.size = 0
+
+    def rollback(self, number_chunks):
+        """Remove the chunks written after the first number_chunks and the rows in memory (resume from a checkpoint)"""
+        for chunk_path in self.chunk_files()[number_chunks:]:
+            os.remove(chunk_path)
+        self.chunk_index = min(number_chunks, self.chunk_index)
+        self.size = 0
+
+    def load(self):
+        """ Load the full table (chunks on disk and rows in memory)
+        :return: structured array"""
+        chunks = []
+        for chunk_path in self.chunk_files():
+            with np.load(chunk_path) as data:
+                chunks.append(as_dtype(data['rows'], self.dtype))
+        chunks.append(self.buffer[:self.size].copy())
+        return np.concatenate(chunks)
+
+
+class GroundTruthStore:
+    """
+    Columnar storage of the pedestrian ground truth. Each frame is appended to structured arrays with integer
+    pedestrian ids (index in name_pedestrians, as dict_names) and flushed to path_save/gt_store in chunks of
+    chunk_size rows, so memory stays bounded and a crash only loses the last chunk.
+    gt3d keeps the pedestrians captured by some camera (as the legacy json) and scene every pose requested in the
+    frame, to project the 3d ground truth again offline (regenerate_gt).
+    The legacy json layout (gt3d_pedestrians.json, <cam>/gt2d_pedestrians.json) is exported on demand.
+    """
+
+    def __init__(self, path_save, camera_names, name_pedestrians, chunk_size=5000, append=False):
+        """:param append (bool): keep the chunks of a previous capture in the same folder (resume from a checkpoint),
+                                otherwise they are removed"""
+        self.path_save = path_save
+        self.path = path_save + '/gt_store'
+        self.camera_names = camera_names
+        self.name_pedestrians = list(name_pedestrians)
+        self.dict_names = {name: i for i, name in enumerate(self.name_pedestrians)}
+        check_path(self.path)
+        if not append:
+            # Chunks of a previous run with the same name_experiment, their ids refer to its pedestrian names
+            for chunk_path in glob.glob(self.path + '/*_' + '[0-9]' * 5 + '.npz'):
+                os.remove(chunk_path)
+
+        with open(self.path + '/pedestrian_names.json', 'w') as f:
+            json.dump(self.name_pedestrians, f)
+
+        self.frames = ChunkedTable(self.path, 'frames', FRAME_DTYPE, chunk_size)
+        self.gt3d = ChunkedTable(self.path, 'gt3d', GT3D_DTYPE, chunk_size)
+        self.scene = ChunkedTable(self.path, 'scene', GT3D_DTYPE, chunk_size)
+        self.gt2d = {cam: ChunkedTable(self.path, 'gt2d_' + cam, GT2D_DTYPE, chunk_size) for cam in camera_names}
+
+    def add_3d(self, frame_index, info_pedestrians_3d):
+        """ Append 3d ground truth of one frame
+        :param frame_index (int)
+               info_pedestrians_3d (list): [{'id': name_pedestrian, 'pos_x': x, 'pos_y': y, 'pos_z': z, 'orient_w': o_w, 'orient_x': o_x, 'orient_y': o_y, 'orient_z': o_z}, ...]
+                                           optionally with 'predicted'"""
+        self.gt3d.append(self.rows_3d(frame_index, info_pedestrians_3d))
+
+    def add_scene(self, frame_index, info_pedestrians_3d):
+        """ Append every pose requested in one frame, captured or not by the cameras
+        :param frame_index (int)
+               info_pedestrians_3d (list): as add_3d"""
+        self.scene.append(self.rows_3d(frame_index, info_pedestrians_3d))
+
+    def rows_3d(self, frame_index, info_pedestrians_3d):
+        return [(frame_index, self.dict_names[info['id']],
+                 info['pos_x'], info['pos_y'], info['pos_z'],
+                 info['orient_w'], info['orient_x'], info['orient_y'], info['orient_z'], info.get('predicted', -1))
+                for info in info_pedestrians_3d]
+
+    def add_2d(self, cam_name, frame_index, info_pedestrians_2d):
+        """ Append 2d ground truth of one frame
+        :param cam_name (str): camera name
+               frame_index (int)
+               info_pedestrians_2d (list): [{'id': name_pedestrian, 'xmin': xmin_bbox, 'ymin': ymin_bbox, 'xmax': xmax_bbox, 'ymax': ymax_bbox}, ...]
+                                           optionally with 'visible_px', 'occlusion', 'visibility' and 'predicted'"""
+        self.gt2d[cam_name].append([(frame_index, self.dict_names[info['id']],
+                                     info['xmin'], info['ymin'], info['xmax'], info['ymax'],
+                                     info.get('visible_px', -1), info.get('occlusion', -1), info.get('visibility', -1),
+                                     info.get('predicted', -1))
+                                    for info in info_pedestrians_2d])
+
+    def end_frame(self, frame_index):
+        """Mark frame as captured (frames without pedestrians are also exported)"""
+        self.frames.append([(frame_index,)])
+
+    def flush(self):
+        """Write every table in memory to disk"""
+        self.frames.flush()
+        self.gt3d.flush()
+        self.scene.flush()
+        for table in self.gt2d.values():
+            table.flush()
+
+    def tables(self):
+        tables = {'frames': self.frames, 'gt3d': self.gt3d, 'scene': self.scene}
+        tables.update({'gt2d_' + cam: table for cam, table in self.gt2d.items()})
+        return tables
+
+    def chunk_counts(self):
+        """:return: dict table name = number of chunks on disk"""
+        return {name: table.chunk_index for name, table in self.tables().items()}
+
+    def rollback(self, chunk_counts):
+        """ Go back to the chunks on disk at a checkpoint
+        :param chunk_counts (dict): given by chunk_counts, missing tables are emptied"""
+        for name, table in self.tables().items():
+            table.rollback(chunk_counts.get(name, 0))
+
+    def close(self):
+        self.flush()
+
+    # ---------Legacy json------------------
+    def to_legacy(self, rows, frames, pixel_columns=False):
+        """ Convert rows of a table to the legacy layout
+        :param rows: structured array
+               frames: array of frame indexes
+               pixel_columns (bool): write integral values as int, as the reprojected bboxes in the legacy files
+        :return: generator of (frame_index_key, [{'id': name_pedestrian, ...}, ...])"""
+        rows = rows[np.argsort(rows['frame'], kind='stable')]
+        columns = [name for name in rows.dtype.names if name not in ('frame', 'id')]
+        starts = np.searchsorted(rows['frame'], frames, side='left')
+        ends = np.searchsorted(rows['frame'], frames, side='right')
+        for frame, start, end in zip(frames, starts, ends):
+            info = []
+            for row in rows[start:end].tolist():
+                item = {'id': self.name_pedestrians[row[1]]}
+                for column, value in zip(columns, row[2:]):
+                    if column in OPTIONAL_COLUMNS and value < 0:
+                        continue
+                    if pixel_columns and column not in OPTIONAL_COLUMNS and value.is_integer():
+                        value = int(value)
+                    item[column] = value
+                info.append(item)
+            yield str(int(frame)).zfill(4), info
+
+    def dump_legacy(self, rows, frames, final_path, pixel_columns=False):
+        """Stream the legacy json of a table frame by frame instead of building the whole dict"""
+        with open(final_path, 'w') as f:
+            f.write('{')
+            for i, (frame_index_key, info) in enumerate(self.to_legacy(rows, frames, pixel_columns)):
+                if i > 0:
+                    f.write(', ')
+                f.write(json.dumps(frame_index_key) + ': ' + json.dumps(info))
+            f.write('}')
+
+    def export_legacy_json(self, path_save_info=None):
+        """ Export gt3d_pedestrians.json and <cam>/gt2d_pedestrians.json as save_3dgroundTruth and save_2dgroundTruth
+        :param path_save_info (str): experiment folder, by default the one of the store"""
+        if path_save_info is None:
+            path_save_info = self.path_save
+        frames = np.unique(self.frames.load()['frame'])
+
+        self.dump_legacy(self.gt3d.load(), frames, path_save_info + '/gt3d_pedestrians.json')
+        for cam in self.camera_names:
+            self.dump_legacy(self.gt2d[cam].load(), frames, path_save_info + '/' + cam + '/gt2d_pedestrians.json', pixel_columns=True)
@@ -0,0 +1,183 @@
+import time
+import threading
+import multiprocessing
+import cv2
+import numpy as np
+
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, wait
+
+CODECS = {'png': '.png', 'webp': '.webp', 'jpeg': '.jpg'}
+# Codecs that give back the exact pixels, needed for images of ids
+LOSSLESS_CODECS = ('png', 'webp')
+
+
+def codec_params(codec, level=None):
+    """ File extension and cv2.imwrite parameters of a codec
+    :param codec (str): 'png' (level: compression 0-9), 'webp' (lossless) or 'jpeg' (level: quality 0-100)
+           level (int): None for the OpenCV default
+    :return: extension (str), params (list)"""
+    if codec == 'png':
+        params = [] if level is None else [cv2.IMWRITE_PNG_COMPRESSION, int(level)]
+    elif codec == 'webp':
+        # Quality above 100 selects lossless WebP
+        params = [cv2.IMWRITE_WEBP_QUALITY, 101]
+    elif codec == 'jpeg':
+        params = [] if level is None else [cv2.IMWRITE_JPEG_QUALITY, int(level)]
+    else:
+        raise ValueError('Unknown codec {}, available: {}'.format(codec, list(CODECS)))
+    return CODECS[codec], params
+
+
+class SegmentationPalette:
+    """
+    Colors of the segmentation ids (segmentation_rgb.txt, see pedestrians.get_dict_colors). Segmentation images are
+    stored as single channel images of ids, 3 times smaller than the color images before compression.
+    """
+
+    def __init__(self, color_dict):
+        """:param color_dict (dict): color_dict[id] = [r, g, b]"""
+        ids = np.array(sorted(color_dict))
+        colors = np.array([color_dict[i] for i in ids], dtype=np.uint32)
+        packed = (colors[:, 0] << 16) | (colors[:, 1] << 8) | colors[:, 2]
+        order = np.argsort(packed)
+        self.packed = packed[order]
+        self.ids = ids[order].astype(np.uint8 if ids.max() < 256 else np.uint16)
+
+        # id -> BGR color, as the images given by airsim
+        self.colors_bgr = np.zeros((ids.max() + 1, 3), dtype=np.uint8)
+        self.colors_bgr[ids] = colors[:, ::-1]
+
+    def to_index(self, segmentation):
+        """ Color segmentation to ids. Colors out of the palette get id 0
+        :param segmentation: array H X W X 3 BGR
+        :return: array H X W uint8 (uint16 for palettes over 256 ids)"""
+        segmentation = segmentation.astype(np.uint32)
+        packed = (segmentation[:, :, 2] << 16) | (segmentation[:, :, 1] << 8) | segmentation[:, :, 0]
+        positions = np.searchsorted(self.packed, packed)
+        np.minimum(positions, len(self.packed) - 1, out=positions)
+        index = self.ids[positions]
+        index[self.packed[positions] != packed] = 0
+        return index
+
+    def to_color(self, index):
+        """ Ids to color segmentation
+        :param index: array H X W
+        :return: array H X W X 3 BGR"""
+        return self.colors_bgr[index]
+
+
+def encode_image_file(path, image, extension, params, palette=None):
+    """ Encode and write one image (run in the encoder processes)
+    :param path (str): file without extension
+           image: array H X W X 3
+           extension (str), params (list): see codec_params
+           palette: SegmentationPalette to store the ids instead of the colors
+    :return: raw bytes, encoded bytes, encoding time (s)"""
+    start = time.perf_counter()
+    raw_bytes = image.nbytes
+    if palette is not None:
+        image = palette.to_index(image)
+    ok, buffer = cv2.imencode(extension, image, params)
+    if not ok:
+        raise IOError('Could not encode {}'.format(path + extension))
+    with open(path + extension, 'wb') as f:
+        f.write(buffer.tobytes())
+    return raw_bytes, len(buffer), time.perf_counter() - start
+
+
+class ImageEncoder:
+    """
+    Encodes and writes images in a pool of processes, so that PNG/WebP/JPEG encoding is not limited by the GIL.
+    With processes=0 images are encoded in the calling thread. Keeps encoding statistics per stream (rgb, segmentation).
+    At most max_pending images are waiting to be encoded, submit() blocks after that (backpressure).
+    """
+
+    def __init__(self, processes=0, max_pending=None):
+        self.processes = processes
+        self.executor = None
+        if processes > 0:
+            # spawn: the capture process has rpc threads running, forking it is not safe
+            self.executor = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn'))
+        self.slots = threading.BoundedSemaphore(max_pending if max_pending is not None else 4 * max(processes, 1))
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.error = None
+        self.stats = {}
+        self.start = time.perf_counter()
+        self.end = None
+
+    def _record(self, stream, raw_bytes, encoded_bytes, seconds):
+        with self.lock:
+            stats = self.stats.setdefault(stream, {'images': 0, 'raw_bytes': 0, 'encoded_bytes': 0, 'encode_s': 0.})
+            stats['images'] += 1
+            stats['raw_bytes'] += raw_bytes
+            stats['encoded_bytes'] += encoded_bytes
+            stats['encode_s'] += seconds
+
+    def _done(self, stream, future):
+        try:
+            self._record(stream, *future.result())
+        except Exception as e:
+            self.error = e
+        with self.lock:
+            self.pending.discard(future)
+        self.slots.release()
+
+    def _check_error(self):
+        if self.error is not None:
+            raise RuntimeError('Image encoder failed') from self.error
+
+    def submit(self, stream, path, image, extension, params, palette=None):
+        """ Encode and write an image
+        :param stream (str): statistics key, e.g. 'rgb'
+               path (str): file without extension
+               image: array H X W X 3 (copied, the caller can reuse it)
+               extension, params, palette: see encode_image_file"""
+        self._check_error()
+        if self.executor is None:
+            self._record(stream, *encode_image_file(path, image, extension, params, palette))
+            return
+        self.slots.acquire()
+        future = self.executor.submit(encode_image_file, path, image.copy(), extension, params, palette)
+        with self.lock:
+            self.pending.add(future)
+        future.add_done_callback(partial(self._done, stream))
+
+    def drain(self):
+        """Wait until every submitted image is on disk"""
+        with self.lock:
+            pending = list(self.pending)
+        wait(pending)
+        self._check_error()
+
+    def get_stats(self):
+        """ Encoding statistics per stream
+        :return: dict stream = {'images', 'raw_MB', 'encoded_MB', 'ratio', 'encode_ms', 'images_per_s', 'MB_per_s'}"""
+        elapsed = (self.end if self.end is not None else time.perf_counter()) - self.start
+        with self.lock:
+            stats = {stream: dict(values) for stream, values in self.stats.items()}
+        summary = {}
+        for stream, values in stats.items():
+            summary[stream] = {'images': values['images'],
+                               'raw_MB': values['raw_bytes'] / 1e6,
+                               'encoded_MB': values['encoded_bytes'] / 1e6,
+                               'ratio': values['raw_bytes'] / max(values['encoded_bytes'], 1),
+                               'encode_ms': values['encode_s'] * 1000 / max(values['images'], 1),
+                               'images_per_s': values['images'] / elapsed,
+                               'MB_per_s': values['raw_bytes'] / 1e6 / elapsed}
+        return summary
+
+    def format_stats(self):
+        return ', '.join('{}: {} images {:.1f} MB -> {:.1f} MB (x{:.1f}), {:.1f} ms/image, {:.1f} images/s'.format(
+            stream, s['images'], s['raw_MB'], s['encoded_MB'], s['ratio'], s['encode_ms'], s['images_per_s'])
+            for stream, s in self.get_stats().items())
+
+    def close(self):
+        """Wait for pending images and stop the processes"""
+        if self.executor is not None:
+            self.drain()
+            self.executor.shutdown()
+            self.executor = None
+        self.end = time.perf_counter()
+        self._check_error()
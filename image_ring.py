@@ -0,0 +1,260 @@
+"""
+Shared memory transport of the captured images: the capture publishes every frame in one ring per camera and other
+local processes read them without waiting for the files. Kept apart from image_utils (and airsim) so that the readers
+only import NumPy.
+"""
+import time
+import multiprocessing
+import numpy as np
+
+from multiprocessing import shared_memory, resource_tracker
+
+from instrumentation import span
+
+# Ring header: magic, slots, height, width, depth and segmentation flags, frames published
+RING_MAGIC = 0x50454452
+RING_HEADER_SIZE = 64
+# Slot header (seqlock): sequence (odd while the slot is written), frame index, timestamp
+SLOT_HEADER_DTYPE = np.dtype([('sequence', np.uint64), ('frame', np.int64), ('timestamp', np.uint64)])
+SLOT_HEADER_SIZE = 64
+
+
+def ring_name(prefix, cam_name):
+    """Name of the shared memory block of a camera"""
+    return '{}_{}'.format(prefix, cam_name)
+
+
+def ring_layout(height, width, depth, segmentation):
+    """ Offsets of the arrays inside one slot of the ring
+    :return: dict key = (offset, shape, dtype), slot size in bytes"""
+    layout, offset = {}, SLOT_HEADER_SIZE
+    streams = [('rgb', (height, width, 3), np.uint8)]
+    if depth:
+        streams.append(('depth', (height, width, 1), np.float32))
+    if segmentation:
+        streams.append(('segmentation', (height, width, 3), np.uint8))
+    for key, shape, dtype in streams:
+        layout[key] = (offset, shape, dtype)
+        offset += int(np.prod(shape)) * np.dtype(dtype).itemsize
+        offset += -offset % 64
+    return layout, offset
+
+
+def attach_shared_memory(name):
+    """ Open an existing shared memory block without letting this process remove it at exit. Before python 3.13 every
+    block opened is registered in the resource tracker, which unlinks it when the process ends: the registration is
+    removed, except in child processes, which share the tracker (and its registration) of their parent
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+    shm = shared_memory.SharedMemory(name=name)
+    if multiprocessing.parent_process() is None:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+class ImageRing:
+    """
+    Ring of fixed slots in shared memory with the images of one camera: ring header, then per slot a seqlock header
+    (sequence, frame index, timestamp) and the rgb, depth (mm, float32) and segmentation arrays. The writer makes the
+    sequence odd while it copies a frame and even again when the frame is complete, so readers detect torn frames.
+    """
+
+    def __init__(self, shm, owner=False):
+        self.shm = shm
+        self.owner = owner
+        self.header = np.ndarray((8,), dtype=np.int64, buffer=shm.buf)
+        assert self.header[0] == RING_MAGIC, 'Shared memory {} is not an image ring'.format(shm.name)
+        self.slots = int(self.header[1])
+        self.layout, self.slot_size = ring_layout(int(self.header[2]), int(self.header[3]), bool(self.header[4]), bool(self.header[5]))
+        self.slot_headers = []
+        self.arrays = []
+        for slot in range(self.slots):
+            base = RING_HEADER_SIZE + slot * self.slot_size
+            self.slot_headers.append(np.ndarray((), dtype=SLOT_HEADER_DTYPE, buffer=shm.buf, offset=base))
+            self.arrays.append({key: np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=base + offset)
+                                for key, (offset, shape, dtype) in self.layout.items()})
+
+    @classmethod
+    def create(cls, name, slots, height, width, depth, segmentation):
+        _, slot_size = ring_layout(height, width, depth, segmentation)
+        try:
+            # Left by a capture that did not finish
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        shm = shared_memory.SharedMemory(name=name, create=True, size=RING_HEADER_SIZE + slots * slot_size)
+        header = np.ndarray((8,), dtype=np.int64, buffer=shm.buf)
+        header[:] = (RING_MAGIC, slots, height, width, int(depth), int(segmentation), 0, 0)
+        del header
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        return cls(attach_shared_memory(name))
+
+    @property
+    def published(self):
+        """Frames written since the ring was created"""
+        return int(self.header[6])
+
+    def write(self, frame_index, images_info):
+        """ Copy the images of one frame to the next slot
+        :param images_info (dict): {'timestamp': t, 'rgb': array H X W X 3, 'depth': ..., 'segmentation': ...}"""
+        count = self.published
+        slot_header = self.slot_headers[count % self.slots]
+        sequence = int(slot_header['sequence'])
+        slot_header['sequence'] = sequence + 1
+        for key, array in self.arrays[count % self.slots].items():
+            np.copyto(array, images_info[key].reshape(array.shape))
+        slot_header['frame'] = frame_index
+        slot_header['timestamp'] = images_info['timestamp']
+        slot_header['sequence'] = sequence + 2
+        self.header[6] = count + 1
+
+    def view(self, count):
+        """ Zero-copy access to the frame number count (published - 1 is the last one)
+        :return: sequence (int) to check with valid() after using the arrays, or None if the frame is being written
+                 or was overwritten
+                 frame (dict): {'frame_index', 'timestamp', 'rgb', 'depth', 'segmentation'} views of the slot"""
+        published = self.published
+        if count < 0 or count >= published or count < published - self.slots:
+            return None, None
+        slot = count % self.slots
+        sequence = int(self.slot_headers[slot]['sequence'])
+        if sequence % 2:
+            return None, None
+        frame = dict(self.arrays[slot])
+        frame['frame_index'] = int(self.slot_headers[slot]['frame'])
+        frame['timestamp'] = int(self.slot_headers[slot]['timestamp'])
+        return sequence, frame
+
+    def valid(self, count, sequence):
+        """True if the slot of the frame number count was not written since view() returned sequence"""
+        return int(self.slot_headers[count % self.slots]['sequence']) == sequence
+
+    def read(self, count, retries=10):
+        """ Copy of the frame number count, None if it is no longer in the ring"""
+        for _ in range(retries):
+            if count < self.published - self.slots:
+                return None
+            sequence, frame = self.view(count)
+            if sequence is None:
+                continue
+            frame = {key: value.copy() if isinstance(value, np.ndarray) else value for key, value in frame.items()}
+            if self.valid(count, sequence):
+                return frame
+        return None
+
+    def close(self):
+        self.slot_headers, self.arrays, self.header = [], [], None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class ImagePublisher:
+    """
+    Publishes the decoded images of every frame in one shared memory ring per camera (<prefix>_<cam>), so local
+    processes read them at capture rate without waiting for the files (see ImageSubscriber). Rings are created with
+    the first frame, when the image size is known.
+    """
+
+    def __init__(self, camera_names, prefix='pedenv', slots=8):
+        self.camera_names = camera_names
+        self.prefix = prefix
+        self.slots = slots
+        self.rings = {}
+
+    def publish(self, frame_index, images_info):
+        """ Copy a frame set to the rings
+        :param frame_index (int)
+               images_info (dict): images_info[cam_name] given by responseTOimages"""
+        with span('publish_images', frame_index):
+            for cam in self.camera_names:
+                info = images_info[cam]
+                if cam not in self.rings:
+                    height, width = info['rgb'].shape[:2]
+                    self.rings[cam] = ImageRing.create(ring_name(self.prefix, cam), self.slots, height, width,
+                                                       'depth' in info, 'segmentation' in info)
+                self.rings[cam].write(frame_index, info)
+
+    def close(self):
+        """Remove the rings, subscribers still attached keep their mapping until they close"""
+        for ring in self.rings.values():
+            ring.close()
+        self.rings = {}
+
+
+class ImageSubscriber:
+    """
+    Reader of the ring of one camera in another process:
+        subscriber = ImageSubscriber('cam1')
+        frame = subscriber.next_frame(timeout=1.)   # {'frame_index', 'timestamp', 'rgb', 'depth', 'segmentation'} copies
+    Reading starts at the oldest frame in the ring. Frames are skipped when the reader falls more than the ring size
+    behind (subscriber.skipped).
+    """
+
+    def __init__(self, cam_name, prefix='pedenv', timeout=10.):
+        """:param timeout (float): seconds to wait for the publisher to create the ring"""
+        start = time.perf_counter()
+        while True:
+            try:
+                self.ring = ImageRing.attach(ring_name(prefix, cam_name))
+                break
+            except FileNotFoundError:
+                if time.perf_counter() - start > timeout:
+                    raise
+                time.sleep(0.05)
+        # Oldest frame still in the ring (and not the next one to be overwritten), so a subscriber started before the
+        # capture, or while the ring is not full yet, also gets the first frames
+        self.next_count = max(self.ring.published - self.ring.slots + 1, 0)
+        self.skipped = 0
+
+    def next_frame(self, timeout=None, copy=True, poll_interval=0.001):
+        """ Wait for the next frame
+        :param timeout (float): seconds, None to wait forever
+               copy (bool): False returns views of the shared memory (zero-copy), valid until the publisher writes
+                            slots more frames, check with subscriber.still_valid()
+        :return: frame (dict) or None after the timeout"""
+        start = time.perf_counter()
+        while True:
+            published = self.ring.published
+            if published - self.next_count > self.ring.slots - 1:
+                # Too far behind: jump to the oldest frame that is not being overwritten
+                self.skipped += published - self.ring.slots + 1 - self.next_count
+                self.next_count = published - self.ring.slots + 1
+            if self.next_count < published:
+                count = self.next_count
+                if copy:
+                    frame = self.ring.read(count)
+                else:
+                    self.sequence, frame = self.ring.view(count)
+                    self.count = count
+                self.next_count += 1
+                if frame is not None:
+                    return frame
+                self.skipped += 1
+                continue
+            if timeout is not None and time.perf_counter() - start > timeout:
+                return None
+            time.sleep(poll_interval)
+
+    def latest(self, copy=True):
+        """Last complete frame, skipping the ones not read"""
+        published = self.ring.published
+        if published > self.next_count:
+            self.skipped += published - 1 - self.next_count
+            self.next_count = published - 1
+        return self.next_frame(timeout=0, copy=copy)
+
+    def still_valid(self):
+        """After next_frame(copy=False): True if the views were not overwritten while they were used"""
+        return self.ring.valid(self.count, self.sequence)
+
+    def close(self):
+        self.ring.close()
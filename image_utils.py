@@ -5,6 +5,7 @@ import airsim
 import numpy as np
 
 from joblib import Parallel, delayed
+from instrumentation import span
 
 MIN_DEPTH_METERS = 0
 MAX_DEPTH_METERS = 100
@@ -70,86 +71,157 @@ def get_responses_seg(client, vehicle_name):
     return responses
 
 
-def responseTOrgb(response):
+def responseTOrgb(response, out=None):
     """ From airsim.response to image in array format H X W X 3
     :param response: airsim.response.ImageType.Scene or airsim.ImageType.Segmentation
+           out: preallocated array H X W X 3 uint8 to copy the image into (optional)
     :return: img_rgb: array H X W X 3"""
     img_rgb = np.frombuffer(response.image_data_uint8, dtype=np.uint8).reshape(response.height, response.width, 3)
+    if out is not None:
+        np.copyto(out, img_rgb)
+        img_rgb = out
     return img_rgb
 
 
+def responseTOdepth_meters(response):
+    """ From airsim.response to depth in meters without intermediate copies when the data is a buffer
+    :param response: airsim.response.ImageType.DepthPlanar
+    :return: depth_img_in_meters: depth matrix in meters, array H X W float32"""
+    data = response.image_data_float
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        depth_img_in_meters = np.frombuffer(data, dtype=np.float32)
+    else:
+        # msgpack delivers a list of floats: a single float32 conversion, no float64 round trip
+        depth_img_in_meters = np.asarray(data, dtype=np.float32)
+    return depth_img_in_meters.reshape(response.height, response.width)
+
+
+def responseTOdepth_mm(response, out=None):
+    """ From airsim.response to depth in millimeters, computed in place
+    :param response: airsim.response.ImageType.DepthPlanar
+           out: preallocated array H X W float32 (optional)
+    :return: depth_img_in_mm: depth matrix in mm, array H X W X 1 float32 [0,65535]"""
+    depth_img_in_meters = responseTOdepth_meters(response).reshape(response.height, response.width, 1)
+    # Convert depth_img to millimeters to fill out 16bit unsigned int space (0..65535). Also clamp large values (e.g. SkyDome) to 65535
+    depth_img_in_mm = np.multiply(depth_img_in_meters, 1000, out=out, dtype=np.float32)
+    np.clip(depth_img_in_mm, 0, 65535, out=depth_img_in_mm)
+    return depth_img_in_mm
+
+
+def depth_visualization(depth_img_in_mm):
+    """ Depth visualization, only computed on demand (depth beyond 65.5 m is already clamped in mm)
+    :param depth_img_in_mm: depth matrix in mm, array H X W
+    :return: depth_img: depth visualization H X W [0,255]"""
+    # Lerp 0..100m to 0..255 gray values
+    return np.interp(depth_img_in_mm, (MIN_DEPTH_METERS * 1000, MAX_DEPTH_METERS * 1000), (0, 255))
+
+
 def responseTOdepth(response):
     """ From airsim.response to depth in array format H X W
     :param response: airsim.response.ImageType.DepthPlanar
     :return: depth_img_in_meters: depth matrix in meters, array H X W [0,100]
              depth_img_in_mm: depth matrix in mm, array H X W [0,100000]
              depth_img: depth visualization H X W [0,255]"""
-    # Reshape to a 2d array with correct width and height
-    depth_img_in_meters = airsim.list_to_2d_float_array(response.image_data_float, response.width, response.height)
-    depth_img_in_meters = depth_img_in_meters.reshape(response.height, response.width, 1)
+    depth_img_in_meters = responseTOdepth_meters(response).reshape(response.height, response.width, 1)
 
     # Lerp 0..100m to 0..255 gray values
     depth_img = np.interp(depth_img_in_meters, (MIN_DEPTH_METERS, MAX_DEPTH_METERS), (0, 255))
 
-    # Convert depth_img to millimeters to fill out 16bit unsigned int space (0..65535). Also clamp large values (e.g. SkyDome) to 65535
-    depth_img_in_millimeters = depth_img_in_meters * 1000
-    depth_img_in_mm = np.clip(depth_img_in_millimeters, 0, 65535)
+    depth_img_in_mm = np.clip(depth_img_in_meters * 1000, 0, 65535)
     return depth_img_in_meters, depth_img_in_mm, depth_img
 
 
-def responseTOimages(responses, camera_names):
+class FrameBuffers:
+    """
+    Preallocated ring of arrays per camera and image type, reused by the decoding to avoid allocating full size
+    arrays every frame. A slot is overwritten after 'slots' frames, so slots must be larger than the number of frames
+    that can still be in use (e.g. queued in a writer).
+    """
+
+    def __init__(self, slots=2):
+        self.slots = slots
+        self.buffers = {}
+        self.index = {}
+
+    def next_frame(self, cam_name):
+        """Move the ring of the camera to the next slot"""
+        self.index[cam_name] = (self.index.get(cam_name, -1) + 1) % self.slots
+
+    def get(self, cam_name, key, shape, dtype):
+        """ Get the array of the current slot, allocated once
+        :param cam_name (str): camera name
+               key (str): 'rgb', 'depth' or 'segmentation'
+               shape (tuple), dtype: array description
+        :return: array"""
+        ring = self.buffers.get((cam_name, key))
+        if ring is None or ring[0].shape != shape:
+            ring = [np.empty(shape, dtype=dtype) for _ in range(self.slots)]
+            self.buffers[(cam_name, key)] = ring
+        return ring[self.index[cam_name]]
+
+
+def responseTOimages(responses, camera_names, buffers=None):
     """ Get info from responses and transform format to numpy array
     :param responses (list): [airsim.response cam1, airsim.response cam2, ...]
+           buffers: FrameBuffers to decode into (optional)
     :return: images_info[cam_name] = {'timestamp': t, 'rgb': array H X W X 3, 'depth': array H X W  [0,100000], 'segmentation': array H X W X 3}"""
     images_info = {}
     for i, resp in enumerate(responses):
         cam_name = camera_names[i]
         images_info[cam_name] = {}
         images_info[cam_name]['timestamp'] = resp[0].time_stamp
+        if buffers is not None:
+            buffers.next_frame(cam_name)
         for j, r in enumerate(resp):
             if r.pixels_as_float:
-                depth_matrix = responseTOdepth(r)
-                images_info[cam_name]['depth'] = depth_matrix[1]
+                out = None
+                if buffers is not None:
+                    out = buffers.get(cam_name, 'depth', (r.height, r.width, 1), np.float32)
+                images_info[cam_name]['depth'] = responseTOdepth_mm(r, out)
             else:
-                img = responseTOrgb(r)
-                if j == 0:
-                    images_info[cam_name]['rgb'] = img
-                else:
-                    images_info[cam_name]['segmentation'] = img
+                key = 'rgb' if j == 0 else 'segmentation'
+                out = None
+                if buffers is not None:
+                    out = buffers.get(cam_name, key, (r.height, r.width, 3), np.uint8)
+                images_info[cam_name][key] = responseTOrgb(r, out)
     return images_info
 
 
-def getResponseImages(clients, config):
+def getResponseImages(clients, config, buffers=None, frame_index=None):
     """ Get images from cameras
     :param client: airsim.VehicleClient
            config: Configuration Class
+           buffers: FrameBuffers to decode into (optional)
+           frame_index (int): frame of the tracer spans, given when the images are prefetched in another thread
     :return: images_info[cam_name] = {'timestamp': t, 'rgb': array H X W X 3, 'depth': array H X W  [0,100000], 'segmentation': array H X W X 3}"""
 
     camera_names = config.camera_names
 
     # Select image response
-    if config.image_types == 'RGB' and config.external:
-        responses = Parallel(n_jobs=config.number_cameras, backend='threading')(
-            delayed(get_responses_rgb_ext)(cl, name) for cl, name in zip(clients, camera_names))
-    elif config.image_types == 'RGB' and not config.external:
-        responses = Parallel(n_jobs=config.number_cameras, backend='threading')(
-            delayed(get_responses_rgb)(cl, name) for cl, name in zip(clients, camera_names))
-    elif config.image_types == 'RGB-D' and config.external:
-        responses = Parallel(n_jobs=config.number_cameras, backend='threading')(
-            delayed(get_responses_rgbd_ext)(cl, name) for cl, name in zip(clients, camera_names))
-    elif config.image_types == 'RGB-D' and not config.external:
-        responses = Parallel(n_jobs=config.number_cameras, backend='threading')(
-            delayed(get_responses_rgbd)(cl, name) for cl, name in zip(clients, camera_names))
-    elif config.image_types == 'RGB-DS' and config.external:
-        responses = Parallel(n_jobs=config.number_cameras, backend='threading')(
-            delayed(get_responses_seg_ext)(cl, name) for cl, name in zip(clients, camera_names))
-    elif config.image_types == 'RGB-DS' and not config.external:
-        responses = Parallel(n_jobs=config.number_cameras, backend='threading')(
-            delayed(get_responses_seg)(cl, name) for cl, name in zip(clients, camera_names))
-    else:
-        sys.exit('Image types defined is not implemented')
-
-    images_info = responseTOimages(responses, config.camera_names)
+    with span('image_rpc', frame_index):
+        if config.image_types == 'RGB' and config.external:
+            responses = Parallel(n_jobs=config.number_cameras, backend='threading')(
+                delayed(get_responses_rgb_ext)(cl, name) for cl, name in zip(clients, camera_names))
+        elif config.image_types == 'RGB' and not config.external:
+            responses = Parallel(n_jobs=config.number_cameras, backend='threading')(
+                delayed(get_responses_rgb)(cl, name) for cl, name in zip(clients, camera_names))
+        elif config.image_types == 'RGB-D' and config.external:
+            responses = Parallel(n_jobs=config.number_cameras, backend='threading')(
+                delayed(get_responses_rgbd_ext)(cl, name) for cl, name in zip(clients, camera_names))
+        elif config.image_types == 'RGB-D' and not config.external:
+            responses = Parallel(n_jobs=config.number_cameras, backend='threading')(
+                delayed(get_responses_rgbd)(cl, name) for cl, name in zip(clients, camera_names))
+        elif config.image_types == 'RGB-DS' and config.external:
+            responses = Parallel(n_jobs=config.number_cameras, backend='threading')(
+                delayed(get_responses_seg_ext)(cl, name) for cl, name in zip(clients, camera_names))
+        elif config.image_types == 'RGB-DS' and not config.external:
+            responses = Parallel(n_jobs=config.number_cameras, backend='threading')(
+                delayed(get_responses_seg)(cl, name) for cl, name in zip(clients, camera_names))
+        else:
+            sys.exit('Image types defined is not implemented')
+
+    with span('decode', frame_index):
+        images_info = responseTOimages(responses, config.camera_names, buffers)
     return images_info
 
 
@@ -167,27 +239,35 @@ def save_images(images_info, frame_index_key, cam, config):
            config: Configuration Class
     """
 
-    time_stamp = str(images_info['timestamp'])
-    final_name = str(frame_index_key) + '_' + time_stamp
-
-    path_save = config.path_save + '/' + cam
-
-    if 'RGB' in config.image_types:
-        final_path_rgb = path_save + '/Frames'
-        check_path(final_path_rgb)
-
-        cv2.imwrite(final_path_rgb + '/' + final_name + '.png', images_info['rgb'])
-    if 'D' in config.image_types:
-        final_path_depth = path_save + '/Depth'
-        check_path(final_path_depth)
-
-        np.save(final_path_depth + '/' + final_name + '.npy', images_info['depth'])
-    if 'S' in config.image_types:
-        final_path_seg = path_save + '/Segmentation'
-        check_path(final_path_seg)
-
-        cv2.imwrite(final_path_seg + '/' + final_name + '.png', images_info['segmentation'])
-
+    with span('save_images', int(frame_index_key)):
+        time_stamp = str(images_info['timestamp'])
+        final_name = str(frame_index_key) + '_' + time_stamp
 
+        path_save = config.path_save + '/' + cam
 
+        if 'RGB' in config.image_types:
+            final_path_rgb = path_save + '/Frames'
+            check_path(final_path_rgb)
 
+            if config.image_encoder is not None:
+                extension, params = config.rgb_encoding
+                config.image_encoder.submit('rgb', final_path_rgb + '/' + final_name, images_info['rgb'], extension, params)
+            else:
+                cv2.imwrite(final_path_rgb + '/' + final_name + '.png', images_info['rgb'])
+        if 'D' in config.image_types and config.depth_store is not None:
+            config.depth_store.append(cam, int(frame_index_key), images_info['timestamp'], images_info['depth'])
+        elif 'D' in config.image_types:
+            final_path_depth = path_save + '/Depth'
+            check_path(final_path_depth)
+
+            np.save(final_path_depth + '/' + final_name + '.npy', images_info['depth'])
+        if 'S' in config.image_types:
+            final_path_seg = path_save + '/Segmentation'
+            check_path(final_path_seg)
+
+            if config.image_encoder is not None:
+                extension, params = config.segmentation_encoding
+                config.image_encoder.submit('segmentation', final_path_seg + '/' + final_name, images_info['segmentation'],
+                                            extension, params, config.segmentation_palette)
+            else:
+                cv2.imwrite(final_path_seg + '/' + final_name + '.png', images_info['segmentation'])
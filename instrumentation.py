@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import threading
+import numpy as np
+
+from collections import deque
+
+
+class _NullSpan:
+    """Span returned while the tracer is disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, tracer, name, frame):
+        self.tracer = tracer
+        self.name = name
+        self.frame = frame
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.tracer.record(self.name, self.frame, self.start, time.perf_counter() - self.start)
+        return False
+
+
+class Tracer:
+    """
+    Records the duration of the stages of the capture loop (spans) by frame and thread.
+    Disabled by default: span() then returns a shared no-op context manager.
+    Only the last max_spans spans are kept, so it can stay enabled during long captures.
+    """
+
+    def __init__(self, max_spans=200000, window=30):
+        self.enabled = False
+        self.frame = None
+        self.lock = threading.Lock()
+        self.max_spans = max_spans
+        self.window = window
+        self.origin = time.perf_counter()
+        self.spans = deque(maxlen=max_spans)
+        self.recent = {}
+        self.frame_ends = deque(maxlen=window + 1)
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self.lock:
+            self.spans = deque(maxlen=self.max_spans)
+            self.recent = {}
+            self.frame_ends = deque(maxlen=self.window + 1)
+        self.frame = None
+
+    def set_frame(self, frame_index):
+        """Frame assigned to the next spans that do not give one"""
+        self.frame = frame_index
+
+    def span(self, name, frame=None):
+        """ Time a stage: with TRACER.span('save_images'): ...
+        :param name (str): stage name
+               frame (int): frame index, by default the current one
+        """
+        if not self.enabled:
+            return NULL_SPAN
+        return _Span(self, name, self.frame if frame is None else frame)
+
+    def record(self, name, frame, start, duration):
+        with self.lock:
+            self.spans.append((name, frame, start, duration, threading.get_ident()))
+            recent = self.recent.get(name)
+            if recent is None:
+                recent = self.recent[name] = deque(maxlen=4096)
+            recent.append((frame, duration))
+
+    def end_frame(self, frame_index, start):
+        """ Close a frame of the capture loop
+        :param frame_index (int)
+               start (float): time.perf_counter() at the beginning of the frame"""
+        if not self.enabled:
+            return
+        end = time.perf_counter()
+        self.record('frame', frame_index, start, end - start)
+        with self.lock:
+            self.frame_ends.append(end)
+
+    def frame_rate(self):
+        """ Frames per second of the capture loop: frames closed with end_frame over the time from the start of the
+        first one to the end of the last one, without the setup and the shutdown of the capture
+        :return: float"""
+        with self.lock:
+            frames = [(start, start + duration) for name, _, start, duration, _ in self.spans if name == 'frame']
+        if not frames:
+            return 0.
+        elapsed = max(end for _, end in frames) - min(start for start, _ in frames)
+        return len(frames) / elapsed if elapsed > 0 else 0.
+
+    def summary(self):
+        """ Rolling summary of the last frames: fps and mean time of each stage by frame
+        :return: str"""
+        with self.lock:
+            frame_ends = list(self.frame_ends)
+            recent = {name: list(values) for name, values in self.recent.items()}
+        fps = (len(frame_ends) - 1) / (frame_ends[-1] - frame_ends[0]) if len(frame_ends) > 1 else 0.
+        last_frame = self.frame if self.frame is not None else 0
+        stages = []
+        for name, values in recent.items():
+            durations = [duration for frame, duration in values if frame is not None and frame > last_frame - self.window]
+            if name != 'frame' and durations:
+                stages.append('{} {:.1f}'.format(name, sum(durations) * 1000 / min(self.window, last_frame + 1)))
+        return 'frame {} | {:.2f} fps | ms/frame: {}'.format(last_frame, fps, ', '.join(stages))
+
+    def export_chrome_trace(self, path):
+        """ Save the spans in Chrome trace event format (chrome://tracing, Perfetto)
+        :param path (str): json file"""
+        with self.lock:
+            spans = list(self.spans)
+        pid = os.getpid()
+        events = [{'name': name, 'cat': 'capture', 'ph': 'X', 'pid': pid, 'tid': tid,
+                   'ts': (start - self.origin) * 1e6, 'dur': duration * 1e6, 'args': {'frame': frame}}
+                  for name, frame, start, duration, tid in spans]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    def stage_stats(self):
+        """ Latency of each stage per frame (spans of the same stage and frame are added, e.g. one per camera)
+        :return: dict stage = {'count', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms', 'histogram'}"""
+        with self.lock:
+            spans = list(self.spans)
+        per_frame = {}
+        for name, frame, _, duration, _ in spans:
+            key = (name, frame)
+            per_frame[key] = per_frame.get(key, 0.) + duration
+
+        stages = {}
+        for (name, _), duration in per_frame.items():
+            stages.setdefault(name, []).append(duration * 1000)
+
+        stats = {}
+        edges_ms = [0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, float('inf')]
+        for name, durations in stages.items():
+            durations = np.array(durations)
+            counts, _ = np.histogram(durations, bins=edges_ms)
+            stats[name] = {'count': len(durations),
+                           'mean_ms': float(durations.mean()),
+                           'p50_ms': float(np.percentile(durations, 50)),
+                           'p95_ms': float(np.percentile(durations, 95)),
+                           'p99_ms': float(np.percentile(durations, 99)),
+                           'max_ms': float(durations.max()),
+                           'histogram': {'edges_ms': edges_ms[:-1], 'counts': counts.tolist()}}
+        return stats
+
+
+TRACER = Tracer()
+
+
+def span(name, frame=None):
+    """Time a stage with the global tracer"""
+    return TRACER.span(name, frame)
+
+
+def traced(name):
+    """Decorator timing every call of a function with the global tracer"""
+    def decorator(fn):
+        def wrapper(*args, **kwargs):
+            if not TRACER.enabled:
+                return fn(*args, **kwargs)
+            with TRACER.span(name):
+                return fn(*args, **kwargs)
+        wrapper.__name__ = fn.__name__
+        wrapper.__doc__ = fn.__doc__
+        return wrapper
+    return decorator
@@ -1,13 +1,26 @@
 import airsim
 import os
 import json
+import time
 
-from Visualization import visualize
-from image_utils import getResponseImages, save_images
+from visualization_process import VisualizationProcess
+from image_utils import save_images, FrameBuffers
+from image_ring import ImagePublisher
+from capture_pipeline import CapturePipeline, get_frame
 from camera_drone import MultiRotor
 from settings import Configuration
-from pedestrians import get_name_pedestrians, update_gt3d_pedestrian, save_3dgroundTruth, \
-    update_gt2d_pedestrian, save_2dgroundTruth, get_gt3d_pedestrian_info
+from gt_store import GroundTruthStore
+from depth_store import DepthStore
+from image_encoder import ImageEncoder, SegmentationPalette
+from segmentation_gt import SegmentationGT
+from spatial_index import PedestrianGrid
+from pose_queries import PoseQueryPool, GroundTruthRequests
+from client_pool import RPC_ERRORS, create_clients, recover
+from checkpoint import write_checkpoint, resume_capture, clear_capture
+from sim_clock import SimClock
+from trajectory import PoseTrajectories
+from instrumentation import TRACER, span
+from pedestrians import get_dict_colors, get_name_pedestrians, update_gt3d_pedestrian, update_gt2d_pedestrian
 
 
 """
@@ -33,11 +46,13 @@ def load_settings_airsim():
     return settings
 
 
-def InitDrones(velocity):
+def InitDrones(velocity, airsim_settings=None):
     """ Initialize uavs
     :param velocity (float): speed at which the drones will move
+           airsim_settings (dict): AirSim settings, by default loaded from settings.json
     :return: uavs: Multirotor Class"""
-    airsim_settings = load_settings_airsim()
+    if airsim_settings is None:
+        airsim_settings = load_settings_airsim()
     vehicles = airsim_settings['Vehicles']
 
     uavs = []
@@ -51,7 +66,7 @@ def InitDrones(velocity):
     return uavs
 
 
-def CV_Capture(clients, uavs, config, frames_to_capture):
+def CV_Capture(clients, uavs, config, frames_to_capture, query_clients=None):
     drone_names = config.camera_names
 
     print('-> Drone names defined {} in MODE: {} '.format(drone_names, config.mode))
@@ -78,15 +93,21 @@ def CV_Capture(clients, uavs, config, frames_to_capture):
         if not os.path.exists(final_path):
             os.makedirs(final_path)
     config.path_save = path_save
+    for drone in uavs:
+        drone.open_state_log(path_save, append=config.resume)
 
     # -------------------Weather----------------------------
     # config.set_weather(client_ref, 'fog', 0.2)
 
     # -------------Init Pedestrians Info--------------------
-    gt3d_pedestrians, gt2d_pedestrians = {}, {}
+    gt2d_pedestrians = {}
     struct_ref = 'BP_P_'  # reference structure in Unreal to look for the pedestrians
     name_pedestrians, dict_names = get_name_pedestrians(client_ref, struct_ref, segmentation=config.semantic_segmentation)
     print('-> Pedestrians found in the scene: {}'.format(name_pedestrians))
+    if not config.resume:
+        clear_capture(path_save, drone_names)
+    gt_store = GroundTruthStore(path_save, drone_names, name_pedestrians, config.gt_chunk_size,
+                                append=config.resume)
 
     for d_name in drone_names:
         gt2d_pedestrians[d_name] = {}
@@ -102,49 +123,186 @@ def CV_Capture(clients, uavs, config, frames_to_capture):
         print('NEXT POS DRONE', next_pos)
         task = drone.moveTOpos(client_ref, next_pos, next_yaw)
 
-    frame_index = 0
-    while frame_index < frames_to_capture:
-        print(frame_index)
-        frame_index_key = str(frame_index)
-        frame_index_key = frame_index_key.zfill(4)
-
-        # Get images from external cameras
-        images = getResponseImages(clients, config)
-
-        info_gt3d_pedestrians_scene = get_gt3d_pedestrian_info(client_ref, name_pedestrians)
-        captured_pedestrians = []
-        for i, d_name in enumerate(drone_names):
-            # Update drone and camera state
-            drone = uavs[i]
-            drone.update_state_cam_info(client_ref, frame_index, images[d_name]['rgb'])
-            drone.update_state_drone_info(client_ref, frame_index)
-
-            # Update 2d pedestrians bbox obtained
-            gt2d_pedestrians[d_name][frame_index_key] = []
-            gt2d_pedestrians, pedestrians_in_frame = update_gt2d_pedestrian(client_ref, d_name, gt2d_pedestrians, info_gt3d_pedestrians_scene, images[d_name]['rgb'], frame_index_key, config, uav=drone)
-            captured_pedestrians = captured_pedestrians + pedestrians_in_frame
-
-            # Save images
-            save_images(images[d_name], frame_index_key, d_name, config)
-
-        # Update 3d pedestrians position
-        captured_pedestrians = set(captured_pedestrians)
-        gt3d_pedestrians = update_gt3d_pedestrian(info_gt3d_pedestrians_scene, captured_pedestrians, gt3d_pedestrians, frame_index_key)
-
-        # Visualize data
-        if config.visualize_images and config.vis_pedestrian_2dGT:
-            visualize(drone_names, images, frame_index, gt2d_pedestrians, dict_names)
-        elif config.visualize_images:
-            visualize(drone_names, images, frame_index)
-        frame_index += 1
+    # --------Pipelined capture-----------------------
+    # Images are requested with their own clients so that client_ref stays free for ground truth queries
+    pipeline = None
+    if config.pipelined:
+        assert len(clients) > config.number_cameras, 'Pipelined capture needs number_cameras + 1 clients'
+        pipeline = CapturePipeline(clients[1:], config)
+    buffers = FrameBuffers() if config.reuse_image_buffers else None
+
+    # --------Depth storage-----------------------
+    if 'D' in config.image_types and config.depth_storage == 'chunked':
+        config.depth_store = DepthStore(path_save, drone_names, config.depth_chunk_frames, config.depth_compression,
+                                        append=config.resume)
+
+    # --------Image encoding-----------------------
+    config.image_encoder = ImageEncoder(config.encoder_processes)
+    if config.segmentation_indexed:
+        config.segmentation_palette = SegmentationPalette(get_dict_colors())
+
+    # --------2d ground truth from segmentation-----------------------
+    if config.gt2d_source == 'segmentation':
+        config.segmentation_gt = SegmentationGT(name_pedestrians, get_dict_colors())
+
+    # --------Concurrent pose and detection requests--------
+    pose_pool = None
+    if query_clients:
+        pose_pool = PoseQueryPool(query_clients)
+
+    # --------Pose sampling--------
+    trajectories = None
+    if config.pose_sampling_factor > 1:
+        trajectories = PoseTrajectories(name_pedestrians, config.pose_sampling_factor, config.pose_error_bound,
+                                        config.pose_angle_bound)
+
+    # --------Instrumentation--------
+    if config.trace:
+        TRACER.enable()
+
+    # --------Visualization process--------
+    viewer = None
+    if config.visualize_images:
+        video_path = path_save + '/preview.mp4' if config.vis_headless else None
+        viewer = VisualizationProcess(drone_names, dict_names, config.vis_max_fps, config.vis_tile_width, video_path)
+
+    # --------Shared memory image rings--------
+    publisher = None
+    if config.shm_publish:
+        publisher = ImagePublisher(drone_names, config.shm_prefix, config.shm_slots)
+
+    # --------Synchronized capture--------
+    clock = None
+    if config.sync_step is not None:
+        clock = SimClock(client_ref, config.sync_step, config.sync_timeout)
+        clock.start()
+
+    # --------Ground truth requests of each frame--------
+    detection_cameras = drone_names if config.gt2d_source == 'detections' else []
+    gt_requests = GroundTruthRequests(client_ref, name_pedestrians, detection_cameras, config, pose_pool, trajectories,
+                                      clock, uavs=uavs)
+
+    # The simulation runs in real time again even if the capture stops with an error
+    try:
+        # --------Resume from the last checkpoint--------
+        frame_index = 0
+        if config.resume:
+            frame_index = resume_capture(config, gt_store, uavs)
+
+        while frame_index < frames_to_capture:
+            frame_start = time.perf_counter()
+            frame_index_key = str(frame_index)
+            frame_index_key = frame_index_key.zfill(4)
+            TRACER.set_frame(frame_index)
+
+            # Requests of the frame, repeated when they fail after the retries of the client pool
+            for attempt in range(config.frame_retries + 1):
+                try:
+                    # Images of the frame and, right after them, its ground truth (the next frame is prefetched with its
+                    # ground truth in the same background job)
+                    if pipeline is not None:
+                        prefetch = frame_index + 1 < frames_to_capture and clock is None
+                        images, ground_truth = pipeline.get_frame(frame_index, gt_requests, prefetch)
+                    else:
+                        images, ground_truth = get_frame(clients, config, buffers, gt_requests, frame_index)
+                    info_gt3d_pedestrians_scene, detections, drone_states, rpc_stats = ground_truth
+                    break
+                except RPC_ERRORS as e:
+                    if attempt == config.frame_retries:
+                        raise
+                    print('-> Frame {} failed ({}), retrying {}/{}'.format(frame_index, e, attempt + 1, config.frame_retries))
+                    recover(clients + (query_clients or []))
+            if publisher is not None:
+                publisher.publish(frame_index, images)
+            pedestrian_grid = PedestrianGrid(info_gt3d_pedestrians_scene) if config.frustum_culling else None
+            captured_pedestrians = []
+            for i, d_name in enumerate(drone_names):
+                # Update drone and camera state
+                drone = uavs[i]
+                drone.record_state(frame_index, images[d_name]['timestamp'], images[d_name]['rgb'], drone_states[i])
+
+                # Update 2d pedestrians bbox obtained
+                gt2d_pedestrians[d_name] = {frame_index_key: []}
+                depth_matrix = images[d_name]['depth'] if 'D' in config.image_types else images[d_name]['rgb']
+                info_gt3d_camera = info_gt3d_pedestrians_scene
+                if pedestrian_grid is not None:
+                    info_gt3d_camera = pedestrian_grid.candidates(drone.camera_model, depth_matrix.shape[1], depth_matrix.shape[0], far=config.frustum_far,
+                                                                  min_height=config.frustum_min_height)
+                gt2d_pedestrians, pedestrians_in_frame = update_gt2d_pedestrian(client_ref, d_name, gt2d_pedestrians, info_gt3d_camera, depth_matrix, frame_index_key, config, uav=drone, bboxes=detections.get(d_name), segmentation=images[d_name].get('segmentation'))
+                captured_pedestrians = captured_pedestrians + pedestrians_in_frame
+                gt_store.add_2d(d_name, frame_index, gt2d_pedestrians[d_name][frame_index_key])
+
+                # Save images
+                if pipeline is not None:
+                    pipeline.save_images(images[d_name], frame_index_key, d_name)
+                else:
+                    save_images(images[d_name], frame_index_key, d_name, config)
+
+            # Update 3d pedestrians position
+            captured_pedestrians = set(captured_pedestrians)
+            gt3d_pedestrians = update_gt3d_pedestrian(info_gt3d_pedestrians_scene, captured_pedestrians, {}, frame_index_key)
+            gt_store.add_3d(frame_index, gt3d_pedestrians[frame_index_key])
+            gt_store.add_scene(frame_index, info_gt3d_pedestrians_scene)
+            gt_store.end_frame(frame_index)
+
+            # Next sim step, the ground truth and images of this frame are already requested
+            if clock is not None:
+                clock.advance()
+
+            # Visualize data (tiles copied to the visualization process, the images are not modified)
+            if viewer is not None:
+                with span('visualize'):
+                    gt2d_frame = {cam: gt2d_pedestrians[cam][frame_index_key] for cam in drone_names} if config.vis_pedestrian_2dGT else None
+                    viewer.publish(frame_index, images, gt2d_frame)
+
+            TRACER.end_frame(frame_index, frame_start)
+            # Stats of the pose query pool, empty without it
+            stats = [rpc_stats] if rpc_stats else []
+            if TRACER.enabled and config.trace_summary_every:
+                if (frame_index + 1) % config.trace_summary_every == 0:
+                    print(TRACER.summary(), *stats)
+            else:
+                print(frame_index, *stats)
+            if config.checkpoint_every and ((frame_index + 1) % config.checkpoint_every == 0 or frame_index + 1 == frames_to_capture):
+                write_checkpoint(frame_index, config, gt_store, pipeline, uavs)
+            frame_index += 1
+    finally:
+        if clock is not None:
+            clock.stop()
+
+    if clock is not None:
+        print('-> {}'.format(clock.format_stats()))
+    if viewer is not None:
+        viewer.close()
+        print('-> {}'.format(viewer.format_stats()))
+    if publisher is not None:
+        publisher.close()
+    if trajectories is not None:
+        print('-> {}'.format(trajectories.format_stats()))
+    if pipeline is not None:
+        pipeline.close()
+    if config.depth_store is not None:
+        config.depth_store.close()
+    config.image_encoder.close()
+    print('-> Encoding {}'.format(config.image_encoder.format_stats()))
+    with open(path_save + '/encode_stats.json', 'w') as f:
+        json.dump(config.image_encoder.get_stats(), f)
+    if pose_pool is not None:
+        pose_pool.close()
+        with open(path_save + '/rpc_stats.json', 'w') as f:
+            json.dump(pose_pool.history, f)
+    if config.trace:
+        TRACER.export_chrome_trace(path_save + '/trace.json')
+        TRACER.disable()
 
     # Save pedestrians data
-    save_3dgroundTruth(gt3d_pedestrians, config.path_save)
-    save_2dgroundTruth(gt2d_pedestrians, drone_names, config.path_save)
+    gt_store.close()
+    if config.export_gt_json:
+        gt_store.export_legacy_json(config.path_save)
 
-    # Save sensor data
+    # Save sensor data (states.bin, legacy json files exported on demand)
     for drone in uavs:
-        drone.save_info_state(config.path_save)
+        drone.save_info_state(config.path_save, config.export_gt_json)
 
 
 if __name__ == "__main__":
@@ -159,9 +317,10 @@ if __name__ == "__main__":
     uavs = InitDrones(velocity)
     config = Configuration(img_types, frames_to_capture, save_mode, name_experiment=name_experiment, external=False, uavs=uavs, visualize_images=True, vis_pedestrian_2dGT=True, save_camera_state=True)
 
-    # Initializing Vehicle of AirSim in Unreal
-    clients = [airsim.MultirotorClient() for _ in range(config.number_cameras)]
+    # Initializing Vehicle of AirSim in Unreal: connections shared by the image, pose and detection requests
+    pool, clients, query_clients = create_clients(airsim.MultirotorClient, config)
     client = clients[0]
 
     # Data capture
-    CV_Capture(clients, uavs, config, frames_to_capture)
+    CV_Capture(clients, uavs, config, frames_to_capture, query_clients)
+    print('-> {}'.format(pool.format_stats()))
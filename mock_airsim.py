@@ -0,0 +1,643 @@
+"""
+Stand-in for the AirSim client used by this project, to run CV_Capture without Unreal (e.g. CPU-only benchmarks).
+It implements the part of the airsim module used by the entry points and serves synthetic RGB, depth and segmentation
+frames of pedestrians walking on straight paths, seen by external cameras or drones.
+
+Usage:
+    import mock_airsim
+    world = mock_airsim.configure(number_cameras=4, number_pedestrians=80, width=1920, height=1080)
+    mock_airsim.install()  # before importing the entry points, 'import airsim' returns this module
+    import main_cv_fixed
+    config = Configuration('RGB-D', 100, 'start', 'MockTest', settings_airsim=world.settings)
+    main_cv_fixed.CV_Capture([mock_airsim.VehicleClient() for _ in range(config.number_cameras)], config, 100)
+"""
+import os
+import re
+import sys
+import math
+import time
+import threading
+import zlib
+import numpy as np
+
+from camera_model import CameraModel
+from reprojection import project_cylinders
+
+PEDESTRIAN_WIDTH = 0.58
+PEDESTRIAN_HEIGHT = 1.75
+PALETTE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'segmentation_rgb.txt')
+# Other meshes of the scene, region [xmin, ymin, xmax, ymax] (fraction of the image) that they cover in every camera
+STATIC_MESHES = {'SM_Ground': [0., 0.6, 1., 1.], 'SM_Building_01': [0.05, 0.2, 0.25, 0.6],
+                 'SM_Building_02': [0.6, 0.15, 0.8, 0.6], 'SM_Tree_01': [0.4, 0.35, 0.5, 0.6],
+                 'SM_Tree_03': [0.85, 0.3, 0.95, 0.6], 'SM_Sidewalk': [0., 0.85, 1., 1.]}
+
+
+# ----------------airsim types----------------
+class ImageType:
+    Scene = 0
+    DepthPlanar = 1
+    DepthPerspective = 2
+    DepthVis = 3
+    DisparityNormalized = 4
+    Segmentation = 5
+    SurfaceNormals = 6
+    Infrared = 7
+
+
+class WeatherParameter:
+    Rain = 0
+    Roadwetness = 1
+    Snow = 2
+    RoadSnow = 3
+    MapleLeaf = 4
+    RoadLeaf = 5
+    Dust = 6
+    Fog = 7
+    Enabled = 8
+
+
+class Vector3r:
+    def __init__(self, x_val=0.0, y_val=0.0, z_val=0.0):
+        self.x_val = x_val
+        self.y_val = y_val
+        self.z_val = z_val
+
+
+class Vector2r:
+    def __init__(self, x_val=0.0, y_val=0.0):
+        self.x_val = x_val
+        self.y_val = y_val
+
+
+class Quaternionr:
+    def __init__(self, x_val=0.0, y_val=0.0, z_val=0.0, w_val=1.0):
+        self.x_val = x_val
+        self.y_val = y_val
+        self.z_val = z_val
+        self.w_val = w_val
+
+
+class Pose:
+    def __init__(self, position_val=None, orientation_val=None):
+        self.position = position_val if position_val is not None else Vector3r()
+        self.orientation = orientation_val if orientation_val is not None else Quaternionr()
+
+
+class YawMode:
+    def __init__(self, is_rate=True, yaw_or_rate=0.0):
+        self.is_rate = is_rate
+        self.yaw_or_rate = yaw_or_rate
+
+
+class ImageRequest:
+    def __init__(self, camera_name, image_type, pixels_as_float=False, compress=True):
+        self.camera_name = str(camera_name)
+        self.image_type = image_type
+        self.pixels_as_float = pixels_as_float
+        self.compress = compress
+
+
+class ImageResponse:
+    def __init__(self, camera_name, image_type, width, height, time_stamp, image_data_uint8=b'', image_data_float=None):
+        self.camera_name = camera_name
+        self.image_type = image_type
+        self.width = width
+        self.height = height
+        self.time_stamp = time_stamp
+        self.image_data_uint8 = image_data_uint8
+        self.image_data_float = image_data_float if image_data_float is not None else []
+        self.pixels_as_float = image_data_float is not None
+        self.compress = False
+
+
+class CameraInfo:
+    def __init__(self, pose, fov):
+        self.pose = pose
+        self.fov = fov
+        self.proj_mat = None
+
+
+class KinematicsState:
+    def __init__(self, position, orientation):
+        self.position = position
+        self.orientation = orientation
+        self.linear_velocity = Vector3r()
+        self.angular_velocity = Vector3r()
+        self.linear_acceleration = Vector3r()
+        self.angular_acceleration = Vector3r()
+
+
+class Box2D:
+    def __init__(self, xmin, ymin, xmax, ymax):
+        self.min = Vector2r(xmin, ymin)
+        self.max = Vector2r(xmax, ymax)
+
+
+class DetectionInfo:
+    def __init__(self, name, box2D, relative_pose):
+        self.name = name
+        self.geo_point = None
+        self.box2D = box2D
+        self.box3D = None
+        self.relative_pose = relative_pose
+
+
+class GpsData:
+    def __init__(self, time_stamp):
+        self.time_stamp = time_stamp
+        self.gnss = None
+        self.is_valid = False
+
+
+def to_quaternion(pitch, roll, yaw):
+    """Same convention as airsim.to_quaternion (angles in radians)"""
+    t0 = math.cos(yaw * 0.5)
+    t1 = math.sin(yaw * 0.5)
+    t2 = math.cos(roll * 0.5)
+    t3 = math.sin(roll * 0.5)
+    t4 = math.cos(pitch * 0.5)
+    t5 = math.sin(pitch * 0.5)
+    return Quaternionr(x_val=t0 * t3 * t4 - t1 * t2 * t5,
+                       y_val=t0 * t2 * t5 + t1 * t3 * t4,
+                       z_val=t1 * t2 * t4 - t0 * t3 * t5,
+                       w_val=t0 * t2 * t4 + t1 * t3 * t5)
+
+
+def list_to_2d_float_array(flst, width, height):
+    return np.reshape(np.asarray(flst, np.float32), (height, width))
+
+
+def wait_key(message=''):
+    print(message)
+
+
+class _Task:
+    """Result of the *Async calls, movements are resolved by the world clock"""
+
+    def join(self):
+        return None
+
+
+# ----------------Simulated world----------------
+def make_settings(number_cameras=2, number_drones=0, radius=15.0, height=3.0, fov=90):
+    """ AirSim settings with external cameras on a circle looking at the center of the scene, or drones
+    :return: dict as ./Documents/AirSim/settings.json"""
+    settings = {'SettingsVersion': 1.7}
+    if number_drones > 0:
+        settings['SimMode'] = 'Multirotor'
+        settings['Vehicles'] = {}
+        for i in range(number_drones):
+            angle = 2 * math.pi * i / number_drones
+            settings['Vehicles']['Drone' + str(i + 1)] = {'VehicleType': 'SimpleFlight',
+                                                         'X': radius * math.cos(angle), 'Y': radius * math.sin(angle), 'Z': 0}
+    else:
+        settings['SimMode'] = 'ComputerVision'
+        settings['ExternalCameras'] = {}
+        for i in range(number_cameras):
+            angle = 2 * math.pi * i / number_cameras
+            settings['ExternalCameras']['cam' + str(i + 1)] = {
+                'X': radius * math.cos(angle), 'Y': radius * math.sin(angle), 'Z': -height,
+                'Pitch': -math.degrees(math.atan2(height, radius)), 'Roll': 0,
+                'Yaw': math.degrees(math.atan2(-math.sin(angle), -math.cos(angle))),
+                'FOV_Degrees': fov}
+    return settings
+
+
+def load_palette():
+    """Segmentation colors [r,g,b] by object id, as pedestrians.get_dict_colors"""
+    palette = {}
+    with open(PALETTE_FILE) as f:
+        for line in f:
+            key, value = line.split('\t')
+            palette[int(key)] = [int(v) for v in value.strip().strip('[]').split(',')]
+    return palette
+
+
+class SimWorld:
+    """
+    Synthetic scene: pedestrians walking on straight lines inside a square area and bouncing at its limits,
+    external cameras and drones defined by AirSim settings. The clock follows real time unless it is paused.
+    """
+
+    def __init__(self, settings, width=640, height=480, number_pedestrians=20, area=20.0, speed=1.4,
+                 detection_drop=0.1, rpc_latency=0.0, depth_as_list=True, failure_rate=0.0, seed=0):
+        self.settings = settings
+        self.width = width
+        self.height = height
+        self.area = area
+        self.detection_drop = detection_drop
+        self.rpc_latency = rpc_latency
+        self.depth_as_list = depth_as_list
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.RLock()
+        # Probability that a request drops its connection, the client fails until it is created again
+        self.failure_rate = failure_rate
+        self.failure_rng = np.random.default_rng(seed + 1)
+
+        # Clock
+        self.sim_time = 0.0
+        self.paused = False
+        self.last_wall = time.perf_counter()
+
+        # Pedestrians, pose z is the middle of the body with the ground at z = 0
+        self.pedestrian_names = ['BP_P_Pedestrian_' + str(i).zfill(3) for i in range(number_pedestrians)]
+        self.positions = np.c_[self.rng.uniform(-area, area, (number_pedestrians, 2)),
+                               np.full(number_pedestrians, -PEDESTRIAN_HEIGHT / 2)]
+        headings = self.rng.uniform(-math.pi, math.pi, number_pedestrians)
+        self.velocities = np.c_[np.cos(headings), np.sin(headings), np.zeros(number_pedestrians)] * speed
+        # AirSim starts with an arbitrary segmentation id for every mesh (derived from its name)
+        self.static_meshes = list(STATIC_MESHES)
+        self.segmentation_ids = {name: zlib.crc32(name.encode()) % 256 for name in self.pedestrian_names + self.static_meshes}
+        self.detection_filters = set()
+
+        # External cameras
+        self.cameras = {}
+        for name, cam in settings.get('ExternalCameras', {}).items():
+            orientation = to_quaternion(math.radians(cam.get('Pitch', 0)), math.radians(cam.get('Roll', 0)),
+                                        math.radians(cam.get('Yaw', 0)))
+            self.cameras[name] = {'position': [cam['X'], cam['Y'], cam['Z']],
+                                  'orientation': [orientation.w_val, orientation.x_val, orientation.y_val, orientation.z_val],
+                                  'fov': cam.get('FOV_Degrees', 90)}
+
+        # Drones, positions in local coordinates (origin at their start position)
+        self.vehicles = {}
+        for name, vehicle in settings.get('Vehicles', {}).items():
+            # Looking at the center of the scene until a yaw is commanded
+            self.vehicles[name] = {'origin': np.array([vehicle['X'], vehicle['Y'], vehicle['Z']], dtype=float),
+                                   'position': np.zeros(3), 'goal': None, 'velocity': 0.,
+                                   'yaw': math.atan2(-vehicle['Y'], -vehicle['X'])}
+
+        self.base_images = {}
+        self.palette = load_palette()
+        # Connections of the clients not closed yet
+        self.open_connections = 0
+
+    # ---------Clock------------------
+    def update(self):
+        """Advance the world with the real time elapsed since the last call (if not paused)"""
+        with self.lock:
+            now = time.perf_counter()
+            if not self.paused:
+                self.step(now - self.last_wall)
+            self.last_wall = now
+
+    def step(self, dt):
+        """Move pedestrians and drones dt seconds"""
+        with self.lock:
+            self.sim_time += dt
+            self.positions += self.velocities * dt
+            for axis in (0, 1):
+                out = np.abs(self.positions[:, axis]) > self.area
+                self.velocities[out, axis] *= -1
+                self.positions[:, axis] = np.clip(self.positions[:, axis], -self.area, self.area)
+
+            for vehicle in self.vehicles.values():
+                if vehicle['goal'] is None:
+                    continue
+                direction = vehicle['goal'] - vehicle['position']
+                distance = np.linalg.norm(direction)
+                advance = vehicle['velocity'] * dt
+                if distance <= advance:
+                    vehicle['position'] = vehicle['goal'].copy()
+                    vehicle['goal'] = None
+                elif distance > 0:
+                    vehicle['position'] = vehicle['position'] + direction / distance * advance
+
+    def time_stamp(self):
+        return int(self.sim_time * 1e9)
+
+    # ---------Cameras------------------
+    def camera_pose(self, camera_name, vehicle_name='', external=False, local=False):
+        """ :return: position [x,y,z], orientation [w,x,y,z], fov"""
+        if external or not vehicle_name:
+            cam = self.cameras[camera_name]
+            return cam['position'], cam['orientation'], cam['fov']
+        vehicle = self.vehicles[vehicle_name]
+        position = vehicle['position'] if local else vehicle['position'] + vehicle['origin']
+        # Drone camera looks slightly down in the direction of the drone
+        q = to_quaternion(math.radians(-15), 0, vehicle['yaw'])
+        return list(position), [q.w_val, q.x_val, q.y_val, q.z_val], 90
+
+    def camera_model(self, camera_name, vehicle_name='', external=False):
+        position, orientation, fov = self.camera_pose(camera_name, vehicle_name, external)
+        return CameraModel(position, orientation, fov)
+
+    def project_pedestrians(self, camera_model):
+        """ :return: bboxes array N X 4, depth array N, valid array N bool"""
+        centers = self.positions.copy()
+        centers[:, 2] += PEDESTRIAN_HEIGHT / 2
+        bboxes, valid = project_cylinders(centers, camera_model, self.width, self.height, PEDESTRIAN_WIDTH, PEDESTRIAN_HEIGHT)
+        depth = camera_model.to_camera(self.positions)[:, 0]
+        return bboxes, depth, valid
+
+    def base_image(self, key, camera_name):
+        """Static background of each camera, generated once"""
+        image = self.base_images.get((key, camera_name))
+        if image is None:
+            rows = np.linspace(0, 1, self.height, dtype=np.float32)[:, None]
+            cols = np.linspace(0, 1, self.width, dtype=np.float32)[None, :]
+            if key == 'rgb':
+                shape = (self.height, self.width)
+                gradient = np.stack([rows * 120 + cols * 60, np.broadcast_to(rows * 80 + 60, shape),
+                                     np.broadcast_to(cols * 120 + 40, shape)], axis=2)
+                noise = self.rng.integers(-8, 9, (self.height, self.width, 3))
+                image = np.clip(gradient + noise, 0, 255).astype(np.uint8)
+            elif key == 'depth':
+                # Ground plane getting closer to the bottom of the image
+                image = np.broadcast_to(100. - rows * 95., (self.height, self.width)).astype(np.float32)
+            else:
+                image = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+            self.base_images[(key, camera_name)] = image
+        return image
+
+    def render(self, request, vehicle_name='', external=False):
+        """ Synthetic image of a camera, pedestrians are drawn as boxes
+        :return: ImageResponse"""
+        with self.lock:
+            camera_model = self.camera_model(request.camera_name, vehicle_name, external)
+            bboxes, depth, valid = self.project_pedestrians(camera_model)
+            time_stamp = self.time_stamp()
+            if request.image_type == ImageType.DepthPlanar:
+                key = 'depth'
+            elif request.image_type == ImageType.Segmentation:
+                key = 'segmentation'
+            else:
+                key = 'rgb'
+            if key == 'segmentation':
+                image = self.static_segmentation()
+            else:
+                image = self.base_image(key, request.camera_name + vehicle_name).copy()
+
+            # Far to near so that the closest pedestrian is drawn last
+            for i in np.argsort(-depth):
+                if not valid[i]:
+                    continue
+                xmin, ymin, xmax, ymax = np.clip(bboxes[i], 0, [self.width, self.height, self.width, self.height])
+                if xmax <= xmin or ymax <= ymin:
+                    continue
+                if key == 'depth':
+                    image[ymin:ymax, xmin:xmax] = depth[i]
+                elif key == 'segmentation':
+                    image[ymin:ymax, xmin:xmax] = self.segmentation_color(self.pedestrian_names[i])
+                else:
+                    image[ymin:ymax, xmin:xmax] = ((i * 53) % 256, (i * 97) % 256, (i * 193) % 256)
+
+        if key == 'depth':
+            data = image.ravel().tolist() if self.depth_as_list else image.tobytes()
+            return ImageResponse(request.camera_name, request.image_type, self.width, self.height, time_stamp,
+                                 image_data_float=data)
+        return ImageResponse(request.camera_name, request.image_type, self.width, self.height, time_stamp,
+                             image_data_uint8=image.tobytes())
+
+    def static_segmentation(self):
+        """ Segmentation of the static meshes with their current ids
+        :return: array H X W X 3 BGR"""
+        layout = self.base_images.get('static_layout')
+        if layout is None:
+            # Index of the mesh of each pixel, len(static_meshes) where there is none
+            layout = np.full((self.height, self.width), len(self.static_meshes), dtype=np.int32)
+            scale = np.array([self.width, self.height, self.width, self.height])
+            for k, name in enumerate(self.static_meshes):
+                xmin, ymin, xmax, ymax = (np.array(STATIC_MESHES[name]) * scale).astype(int)
+                layout[ymin:ymax, xmin:xmax] = k
+            self.base_images['static_layout'] = layout
+        colors = np.array([self.segmentation_color(name) for name in self.static_meshes] + [(0, 0, 0)], dtype=np.uint8)
+        return colors[layout]
+
+    def segmentation_color(self, name):
+        """BGR color of the segmentation id of an object (palette of segmentation_rgb.txt)"""
+        object_id = self.segmentation_ids.get(name, 0)
+        r, g, b = self.palette[object_id % len(self.palette)]
+        return b, g, r
+
+    def detections(self, camera_name, vehicle_name='', external=False):
+        """AirSim detections: bbox width oversized x2, some pedestrians randomly missing"""
+        if (camera_name, vehicle_name) not in self.detection_filters:
+            return []
+        with self.lock:
+            camera_model = self.camera_model(camera_name, vehicle_name, external)
+            bboxes, depth, valid = self.project_pedestrians(camera_model)
+            drop = self.rng.random(len(bboxes)) < self.detection_drop
+        detections = []
+        for i in np.flatnonzero(valid & ~drop):
+            xmin, ymin, xmax, ymax = bboxes[i].astype(float)
+            width = xmax - xmin
+            xmin, xmax = xmin - width / 2, xmax + width / 2
+            # Only pedestrians completely inside the frame, the others are left to the 3d reprojection
+            if xmin <= 0 or ymin <= 0 or xmax >= self.width or ymax >= self.height:
+                continue
+            box = Box2D(xmin, ymin, xmax, ymax)
+            detections.append(DetectionInfo(self.pedestrian_names[i], box, Pose()))
+        return detections
+
+    def object_pose(self, name):
+        with self.lock:
+            if name not in self.pedestrian_names:
+                nan = float('nan')
+                return Pose(Vector3r(nan, nan, nan), Quaternionr(nan, nan, nan, nan))
+            i = self.pedestrian_names.index(name)
+            x, y, z = self.positions[i]
+            yaw = math.atan2(self.velocities[i, 1], self.velocities[i, 0])
+        return Pose(Vector3r(x, y, z), to_quaternion(0, 0, yaw))
+
+
+_worlds = {}
+
+
+def configure(settings=None, number_cameras=2, number_drones=0, ip='127.0.0.1', port=41451, **kwargs):
+    """ Create the simulated world served at ip:port
+    :param settings (dict): AirSim settings, by default make_settings(number_cameras, number_drones)
+           kwargs: SimWorld parameters (width, height, number_pedestrians, ...)
+    :return: SimWorld"""
+    if settings is None:
+        settings = make_settings(number_cameras, number_drones)
+    world = SimWorld(settings, **kwargs)
+    _worlds[(ip or '127.0.0.1', port)] = world
+    return world
+
+
+def install():
+    """Register this module as 'airsim' so that the project modules import it"""
+    sys.modules['airsim'] = sys.modules[__name__]
+    return sys.modules[__name__]
+
+
+# ----------------Clients----------------
+class RpcClient:
+    """Connection of a client (the msgpackrpc.Client of airsim), counted in SimWorld.open_connections until closed"""
+
+    def __init__(self, world):
+        self.world = world
+        self.closed = False
+        with world.lock:
+            world.open_connections += 1
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            with self.world.lock:
+                self.world.open_connections -= 1
+
+
+class VehicleClient:
+    def __init__(self, ip='', port=41451, timeout_value=3600):
+        key = (ip or '127.0.0.1', port)
+        if key not in _worlds:
+            configure(ip=ip, port=port)
+        self.world = _worlds[key]
+        self.client = RpcClient(self.world)
+        self.connected = True
+
+    def _call(self):
+        if not self.connected or self.client.closed:
+            raise ConnectionError('Connection to the simulator lost')
+        if self.world.failure_rate > 0:
+            with self.world.lock:
+                self.connected = self.world.failure_rng.random() >= self.world.failure_rate
+            if not self.connected:
+                raise ConnectionError('Connection to the simulator lost')
+        if self.world.rpc_latency > 0:
+            time.sleep(self.world.rpc_latency)
+        self.world.update()
+
+    # ---------Connection------------------
+    def confirmConnection(self):
+        self._call()
+        print('Connected!')
+
+    def ping(self):
+        self._call()
+        return True
+
+    def reset(self):
+        self._call()
+
+    # ---------Images------------------
+    def simGetImages(self, requests, vehicle_name='', external=False):
+        self._call()
+        return [self.world.render(request, vehicle_name, external) for request in requests]
+
+    def simGetCameraInfo(self, camera_name, vehicle_name='', external=False):
+        self._call()
+        with self.world.lock:
+            position, orientation, fov = self.world.camera_pose(str(camera_name), vehicle_name, external, local=True)
+        w, x, y, z = orientation
+        return CameraInfo(Pose(Vector3r(*position), Quaternionr(x, y, z, w)), fov)
+
+    def simGetFocalLength(self, camera_name, vehicle_name='', external=False):
+        self._call()
+        return 11.9
+
+    # ---------Objects------------------
+    def simListSceneObjects(self, name_regex='.*'):
+        self._call()
+        return [name for name in self.world.pedestrian_names + self.world.static_meshes if re.match(name_regex, name)]
+
+    def simGetObjectPose(self, object_name):
+        self._call()
+        return self.world.object_pose(object_name)
+
+    def simSetSegmentationObjectID(self, mesh_name, object_id, is_name_regex=False):
+        self._call()
+        names = self.simListSceneObjects(mesh_name) if is_name_regex else [mesh_name]
+        for name in names:
+            self.world.segmentation_ids[name] = object_id
+        return len(names) > 0
+
+    def simAddDetectionFilterMeshName(self, camera_name, image_type, mesh_name, vehicle_name='', external=False):
+        self._call()
+        self.world.detection_filters.add((str(camera_name), vehicle_name))
+
+    def simGetDetections(self, camera_name, image_type, vehicle_name='', external=False):
+        self._call()
+        return self.world.detections(str(camera_name), vehicle_name, external)
+
+    # ---------Simulation------------------
+    def simPause(self, is_paused):
+        self._call()
+        self.world.paused = is_paused
+
+    def simIsPause(self):
+        self._call()
+        return self.world.paused
+
+    def simContinueForTime(self, seconds):
+        """The world advances instantly and stays paused"""
+        self._call()
+        self.world.step(seconds)
+        self.world.paused = True
+
+    def simEnableWeather(self, enable):
+        self._call()
+
+    def simSetWeatherParameter(self, param, val):
+        self._call()
+
+    def simSetTimeOfDay(self, is_enabled, start_datetime='', is_start_datetime_dst=False, celestial_clock_speed=1,
+                        update_interval_secs=60, move_sun=True):
+        self._call()
+
+    # ---------Vehicles------------------
+    def enableApiControl(self, is_enabled, vehicle_name=''):
+        self._call()
+
+    def armDisarm(self, arm, vehicle_name=''):
+        self._call()
+        return True
+
+    def simGetGroundTruthKinematics(self, vehicle_name=''):
+        self._call()
+        with self.world.lock:
+            vehicle = self.world.vehicles[vehicle_name]
+            position = Vector3r(*vehicle['position'])
+            orientation = to_quaternion(0, 0, vehicle['yaw'])
+        return KinematicsState(position, orientation)
+
+    def simSetVehiclePose(self, pose, ignore_collision, vehicle_name=''):
+        self._call()
+        with self.world.lock:
+            vehicle = self.world.vehicles[vehicle_name]
+            vehicle['position'] = np.array([pose.position.x_val, pose.position.y_val, pose.position.z_val])
+            vehicle['goal'] = None
+
+    def getGpsData(self, gps_name='', vehicle_name=''):
+        self._call()
+        return GpsData(self.world.time_stamp())
+
+
+class MultirotorClient(VehicleClient):
+    def takeoffAsync(self, timeout_sec=20, vehicle_name=''):
+        self._call()
+        with self.world.lock:
+            self.world.vehicles[vehicle_name]['position'][2] = -3.
+        return _Task()
+
+    def moveToPositionAsync(self, x, y, z, velocity, timeout_sec=3e38, drivetrain=None, yaw_mode=None,
+                            lookahead=-1, adaptive_lookahead=1, vehicle_name=''):
+        self._call()
+        with self.world.lock:
+            vehicle = self.world.vehicles[vehicle_name]
+            vehicle['goal'] = np.array([x, y, z], dtype=float)
+            vehicle['velocity'] = velocity
+            if yaw_mode is not None and not yaw_mode.is_rate:
+                vehicle['yaw'] = math.radians(yaw_mode.yaw_or_rate)
+        return _Task()
+
+
+if __name__ == "__main__":
+    # Smoke run of both entry points against the stand-in
+    frames_to_capture = 5
+    install()
+    from settings import Configuration
+
+    import main_cv_fixed
+    world = configure(number_cameras=2, number_pedestrians=20)
+    config = Configuration('RGB-DS', frames_to_capture, 'start', 'MockFixed', settings_airsim=world.settings)
+    main_cv_fixed.CV_Capture([VehicleClient() for _ in range(config.number_cameras)], config, frames_to_capture)
+
+    import main_cv_movable
+    world = configure(number_drones=1, number_pedestrians=20)
+    uavs = main_cv_movable.InitDrones(0.3, world.settings)
+    config = Configuration('RGB-DS', frames_to_capture, 'start', 'MockMovable', external=False, uavs=uavs,
+                           settings_airsim=world.settings)
+    main_cv_movable.CV_Capture([MultirotorClient() for _ in range(config.number_cameras)], uavs, config, frames_to_capture)
@@ -3,6 +3,7 @@ import pathlib
 import airsim
 
 from reprojection import gt2d_from_gt3d, check_bbox
+from instrumentation import span, traced
 
 
 def get_dict_colors():
@@ -34,8 +35,11 @@ def get_name_pedestrians(client, ref_struct, segmentation=False):
     name_pedestrians = client.simListSceneObjects(ref_struct + '.*')
     dict_names = {name: i for i, name in enumerate(name_pedestrians)}
     if segmentation:
+        assert len(name_pedestrians) < 256, 'segmentation ids 1-255: only up to 255 pedestrians can be segmented'
         colors = get_dict_colors()
         color_to_pedestrian = {}
+        # Every mesh starts with an arbitrary id: set the rest of the scene to 0 so that only pedestrians have ids > 0
+        client.simSetSegmentationObjectID('.*', 0, True)
         for i, name_ped in enumerate(name_pedestrians):
             client.simSetSegmentationObjectID(name_ped, i + 1, True)
             color_to_pedestrian[name_ped] = colors[i + 1]
@@ -45,6 +49,31 @@ def get_name_pedestrians(client, ref_struct, segmentation=False):
     return name_pedestrians, dict_names
 
 
+def pose_to_info(name_ped, pose):
+    """ 3d ground truth of one pedestrian
+    :param name_ped (str): pedestrian name
+           pose: airsim.Pose
+    :return: info (dict): {'id': name_pedestrian, 'pos_x': x, 'pos_y': y, 'pos_z': z, 'orient_w': o_w, 'orient_x': o_x, 'orient_y': o_y, 'orient_z': o_z}"""
+    pos_x = pose.position.x_val
+    pos_y = pose.position.y_val
+    pos_z = pose.position.z_val
+
+    orient_w = pose.orientation.w_val
+    orient_x = pose.orientation.x_val
+    orient_y = pose.orientation.y_val
+    orient_z = pose.orientation.z_val
+
+    info = {'id': name_ped,
+            'pos_x': pos_x,
+            'pos_y': pos_y,
+            'pos_z': pos_z,
+            'orient_w': orient_w,
+            'orient_x': orient_x,
+            'orient_y': orient_y,
+            'orient_z': orient_z}
+    return info
+
+
 def get_gt3d_pedestrian_info(client, name_pedestrians):
     """ Update 3d ground truth of pedestrians presented in the scene
     :param client: airsim.VehicleClient
@@ -56,25 +85,21 @@ def get_gt3d_pedestrian_info(client, name_pedestrians):
     info_pedestrians_3d = []
     for name_ped in name_pedestrians:
         pose = client.simGetObjectPose(name_ped)
-        pos_x = pose.position.x_val
-        pos_y = pose.position.y_val
-        pos_z = pose.position.z_val
+        info_pedestrians_3d.append(pose_to_info(name_ped, pose))
+    return info_pedestrians_3d
 
-        orient_w = pose.orientation.w_val
-        orient_x = pose.orientation.x_val
-        orient_y = pose.orientation.y_val
-        orient_z = pose.orientation.z_val
 
-        info = {'id': name_ped,
-                'pos_x': pos_x,
-                'pos_y': pos_y,
-                'pos_z': pos_z,
-                'orient_w': orient_w,
-                'orient_x': orient_x,
-                'orient_y': orient_y,
-                'orient_z': orient_z}
-        info_pedestrians_3d.append(info)
-    return info_pedestrians_3d
+def get_detections(client, cam_name, config):
+    """ Get AirSim detections of pedestrians
+    :param client: airsim.VehicleClient
+           cam_name (str): camera name
+           config: Configuration Class
+    :return: bboxes (list airsim.DetectionInfo)"""
+    if config.external:
+        bboxes = client.simGetDetections(camera_name=cam_name, image_type=airsim.ImageType.Scene, external=True)
+    else:
+        bboxes = client.simGetDetections(camera_name='0', vehicle_name=cam_name, image_type=airsim.ImageType.Scene)
+    return bboxes
 
 
 def update_gt3d_pedestrian(info_gt3d_pedestrians_scene, name_pedestrians, info_pedestrians_3d, frame_index_key, all_pedestrians=False):
@@ -108,26 +133,37 @@ def update_gt3d_pedestrian(info_gt3d_pedestrians_scene, name_pedestrians, info_p
                 'orient_x': orient_x,
                 'orient_y': orient_y,
                 'orient_z': orient_z}
+        if 'predicted' in info_gt3d:
+            info['predicted'] = info_gt3d['predicted']
         info_pedestrians_3d[frame_index_key].append(info)
     return info_pedestrians_3d
 
 
-def update_gt2d_pedestrian(client, cam_name, info_pedestrians, info_gt3d_pedestrians, depth_matrix, frame_index_key, config, uav=None):
+@traced('update_gt2d_pedestrian')
+def update_gt2d_pedestrian(client, cam_name, info_pedestrians, info_gt3d_pedestrians, depth_matrix, frame_index_key, config, uav=None, bboxes=None, segmentation=None):
     """ Update 2d ground truth of pedestrians presented in the scene
     :param client: airsim.VehicleClient
            name_pedestrians (list str): list of pedestrians names to save 2d information
            info_pedestrians (dict): info_pedestrians[cam_name][frame_index_key] = [{info_ped1},{info_ped2},...]
            frame_index_key (str): frame index converted to string, e.g., 0000
            config: Configuration Class
+           bboxes (list airsim.DetectionInfo): detections already requested, e.g. by PoseQueryPool (optional)
+           segmentation: array H X W X 3, segmentation image used when config.gt2d_source is 'segmentation'
     :return: info_pedestrians (dict): info_pedestrians[cam_name][frame_index_key] = [{info_ped1},{info_ped2},...]
              captured_pedestrians (list str): list of pedestrian names detected in the scene"""
     frame_height, frame_width = depth_matrix.shape[0], depth_matrix.shape[1]
 
+    if config.gt2d_source == 'segmentation':
+        camera_model = uav.camera_model if uav is not None else config.get_camera_model(cam_name)
+        with span('gt2d_segmentation'):
+            info_2d = config.segmentation_gt.gt2d(segmentation, info_gt3d_pedestrians, camera_model)
+        info_pedestrians[cam_name][frame_index_key] = info_pedestrians[cam_name][frame_index_key] + info_2d
+        return info_pedestrians, [info['id'] for info in info_2d]
+
     captured_pedestrians = []
-    if config.external:
-        bboxes = client.simGetDetections(camera_name=cam_name, image_type=airsim.ImageType.Scene, external=True)
-    else:
-        bboxes = client.simGetDetections(camera_name='0', vehicle_name=cam_name, image_type=airsim.ImageType.Scene)
+    if bboxes is None:
+        with span('detections'):
+            bboxes = get_detections(client, cam_name, config)
 
     for bbox in bboxes:
         name_ped = bbox.name
@@ -155,7 +191,8 @@ def update_gt2d_pedestrian(client, cam_name, info_pedestrians, info_gt3d_pedestr
             info_pedestrians[cam_name][frame_index_key].append(info)
             captured_pedestrians.append(name_ped)
     # AirSim bounding boxes fails time to time -> check if some existing pedestrian does not have bounding box and obtain by 3d position reprojection
-    filling_2dgt = gt2d_from_gt3d(cam_name, info_pedestrians[cam_name][frame_index_key], info_gt3d_pedestrians, depth_matrix, config, uav)
+    with span('gt2d_from_gt3d'):
+        filling_2dgt = gt2d_from_gt3d(cam_name, info_pedestrians[cam_name][frame_index_key], info_gt3d_pedestrians, depth_matrix, config, uav)
     info_pedestrians[cam_name][frame_index_key] = info_pedestrians[cam_name][frame_index_key] + filling_2dgt
     return info_pedestrians, captured_pedestrians
 
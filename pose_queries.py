@@ -0,0 +1,179 @@
+import time
+import threading
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from functools import partial
+
+from pedestrians import pose_to_info, get_detections, get_gt3d_pedestrian_info
+from instrumentation import span
+
+
+class FrameQuery:
+    """Pending pose and detection requests of one frame"""
+
+    def __init__(self, pool, futures, start):
+        self.pool = pool
+        self.futures = futures
+        self.start = start
+
+    def result(self):
+        """ Wait for the requests of the frame
+        :return: info_gt3d_pedestrians_scene (list): [{'id': name_pedestrian, 'pos_x': x, ...}, ...]
+                 detections (dict): detections[cam_name] = list airsim.DetectionInfo"""
+        # Every request finished before raising a failure, so that the frame can be repeated on the same clients
+        self.wait()
+        info_pedestrians_3d = []
+        detections = {}
+        for future in self.futures:
+            poses, client_detections = future.result()
+            info_pedestrians_3d += poses
+            detections.update(client_detections)
+        self.pool.end_frame(time.perf_counter() - self.start)
+        return info_pedestrians_3d, detections
+
+    def wait(self):
+        """Wait for the requests of the frame without getting their results (frame repeated after a failure)"""
+        wait(self.futures)
+
+
+class PoseQueryPool:
+    """
+    Fan out the per-frame pedestrian pose (simGetObjectPose) and detection (simGetDetections) requests over a pool of
+    airsim clients, as getResponseImages does for the images. Each client serves its own slice of pedestrians and
+    cameras in one task, so the requests of a frame run concurrently between them and with the image requests while
+    a client is never used by two threads at once (airsim clients are not thread safe).
+    """
+
+    def __init__(self, clients):
+        self.clients = clients
+        self.executor = ThreadPoolExecutor(max_workers=len(clients))
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.history = []
+
+    def _timed(self, fn, *args, **kwargs):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        with self.lock:
+            self.latencies.append(time.perf_counter() - start)
+        return result
+
+    def _query_client(self, client, name_pedestrians, camera_names, config):
+        """ Requests of one client, run sequentially
+        :return: poses (list dict) given by pose_to_info
+                 detections (dict): detections[cam_name] = list airsim.DetectionInfo"""
+        poses = [pose_to_info(name_ped, self._timed(client.simGetObjectPose, name_ped)) for name_ped in name_pedestrians]
+        detections = {cam: self._timed(get_detections, client, cam, config) for cam in camera_names}
+        return poses, detections
+
+    def submit(self, name_pedestrians, camera_names, config):
+        """ Start the requests of one frame without waiting for them
+        :param name_pedestrians (list str): list of pedestrians names to get 3d information
+               camera_names (list str): cameras to get detections from
+               config: Configuration Class
+        :return: FrameQuery"""
+        start = time.perf_counter()
+        n_clients = len(self.clients)
+        step = int(np.ceil(len(name_pedestrians) / n_clients)) if len(name_pedestrians) > 0 else 1
+        slices = [name_pedestrians[i:i + step] for i in range(0, len(name_pedestrians), step)]
+
+        # Detections are spread over the clients after the poses
+        client_cameras = [[] for _ in range(n_clients)]
+        for i, cam in enumerate(camera_names):
+            client_cameras[(len(slices) + i) % n_clients].append(cam)
+
+        futures = []
+        for k, client in enumerate(self.clients):
+            names = slices[k] if k < len(slices) else []
+            if names or client_cameras[k]:
+                futures.append(self.executor.submit(self._query_client, client, names, client_cameras[k], config))
+        return FrameQuery(self, futures, start)
+
+    def get_gt3d_pedestrian_info(self, name_pedestrians):
+        """Concurrent version of pedestrians.get_gt3d_pedestrian_info"""
+        info_pedestrians_3d, _ = self.submit(name_pedestrians, [], None).result()
+        return info_pedestrians_3d
+
+    def end_frame(self, wall_time):
+        """Close the latency statistics of the frame"""
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            self.latencies = []
+        stats = {'rpc_count': len(latencies),
+                 'wall_ms': wall_time * 1000,
+                 'mean_ms': float(latencies.mean()) if len(latencies) else 0.,
+                 'p95_ms': float(np.percentile(latencies, 95)) if len(latencies) else 0.,
+                 'max_ms': float(latencies.max()) if len(latencies) else 0.}
+        self.history.append(stats)
+        return stats
+
+    def format_stats(self):
+        """Last frame statistics as a printable line"""
+        if not self.history:
+            return ''
+        stats = self.history[-1]
+        return 'rpc: {} calls in {:.1f} ms (mean {:.2f} ms, p95 {:.2f} ms, max {:.2f} ms)'.format(
+            stats['rpc_count'], stats['wall_ms'], stats['mean_ms'], stats['p95_ms'], stats['max_ms'])
+
+    def close(self):
+        self.executor.shutdown()
+
+
+class GroundTruthRequests:
+    """
+    Ground truth requests of a frame (pedestrian poses, detections and drone states), paired with its images: they are
+    started with the image requests and finished right after them, in the thread requesting the images (prefetch
+    thread of CapturePipeline), so a frame never gets the ground truth of a later time. client is only used by that
+    thread while the requests of a frame run.
+    """
+
+    def __init__(self, client, name_pedestrians, detection_cameras, config, pose_pool=None, trajectories=None,
+                 clock=None, uavs=None):
+        """
+        :param client: airsim client for the sequential requests (without pose_pool) and the drone states
+               name_pedestrians (list str): pedestrians of the scene
+               detection_cameras (list str): cameras to get detections from
+               config: Configuration Class
+               pose_pool: PoseQueryPool, poses and detections requested concurrently with the images
+               trajectories: PoseTrajectories, only some pedestrians are requested each frame
+               clock: SimClock, time of the samples of trajectories in synchronized capture
+               uavs (list): MultiRotor Class whose states are requested"""
+        self.client = client
+        self.name_pedestrians = name_pedestrians
+        self.detection_cameras = detection_cameras
+        self.config = config
+        self.pose_pool = pose_pool
+        self.trajectories = trajectories
+        self.clock = clock
+        self.uavs = uavs or []
+
+    def start(self, frame_index):
+        """ Start the requests of a frame, before its images are requested
+        :return: function without arguments that waits for the requests and returns their results (see finish)"""
+        query_names = self.trajectories.to_query(frame_index) if self.trajectories is not None else self.name_pedestrians
+        query_time = self.clock.sim_time() if self.clock is not None else time.perf_counter()
+        query = None
+        if self.pose_pool is not None:
+            query = self.pose_pool.submit(query_names, self.detection_cameras, self.config)
+        return partial(self.finish, frame_index, query_names, query_time, query)
+
+    def finish(self, frame_index, query_names, query_time, query):
+        """ Wait for the requests of a frame, the sequential ones are made now, right after the images
+        :return: info_gt3d_pedestrians_scene (list): [{'id': name_pedestrian, 'pos_x': x, ...}, ...] every pedestrian
+                 detections (dict): detections[cam_name] = list airsim.DetectionInfo
+                 drone_states (list): given by MultiRotor.request_state for each drone
+                 rpc_stats (str)"""
+        drone_states = [drone.request_state(self.client) for drone in self.uavs]
+        with span('gt3d_poses', frame_index):
+            if query is not None:
+                info_gt3d_pedestrians_scene, detections = query.result()
+                rpc_stats = self.pose_pool.format_stats()
+            else:
+                info_gt3d_pedestrians_scene = get_gt3d_pedestrian_info(self.client, query_names)
+                detections = {cam: get_detections(self.client, cam, self.config) for cam in self.detection_cameras}
+                rpc_stats = ''
+            if self.trajectories is not None:
+                info_gt3d_pedestrians_scene = self.trajectories.complete(frame_index, query_time, info_gt3d_pedestrians_scene)
+        return info_gt3d_pedestrians_scene, detections, drone_states, rpc_stats
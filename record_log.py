@@ -0,0 +1,71 @@
+import os
+import json
+import numpy as np
+
+
+class RecordLog:
+    """
+    Append-only binary file of fixed-width records (numpy structured dtype). Records are written as they come and the
+    file can be read back in one call with np.fromfile or np.memmap. The dtype is saved next to it (<path>.dtype.json)
+    so that the file can be loaded without knowing it. A record partially written by a crash is dropped when loading.
+    """
+
+    def __init__(self, path, dtype):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        with open(path + '.dtype.json', 'w') as f:
+            json.dump(self.dtype.descr, f)
+        self.file = open(path, 'ab')
+        # Drop an incomplete last record before appending new ones
+        size = self.file.seek(0, os.SEEK_END)
+        if size % self.dtype.itemsize:
+            self.file.truncate(size - size % self.dtype.itemsize)
+            self.file.seek(0, os.SEEK_END)
+
+    def __len__(self):
+        return self.file.tell() // self.dtype.itemsize
+
+    def append(self, records):
+        """ Append records
+        :param records: structured array of self.dtype, a single record (np.void) or a tuple with the record fields"""
+        if isinstance(records, tuple):
+            records = np.array([records], dtype=self.dtype)
+        self.file.write(np.asarray(records, dtype=self.dtype).tobytes())
+
+    def flush(self):
+        """Push the appended records to the operating system (and to disk with fsync)"""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def truncate(self, number_records):
+        """Keep only the first number_records records"""
+        self.file.flush()
+        self.file.truncate(number_records * self.dtype.itemsize)
+        self.file.seek(0, os.SEEK_END)
+
+    def close(self):
+        if not self.file.closed:
+            self.file.flush()
+            self.file.close()
+
+    @staticmethod
+    def load_dtype(path):
+        with open(path + '.dtype.json', 'r') as f:
+            descr = json.load(f)
+        return np.dtype([tuple(field) for field in descr])
+
+    @staticmethod
+    def load(path, mmap=False):
+        """ Read the records of a file written with RecordLog
+        :param path (str)
+               mmap (bool): memory map the file instead of reading it
+        :return: structured array"""
+        dtype = RecordLog.load_dtype(path)
+        if not os.path.exists(path):
+            return np.empty(0, dtype=dtype)
+        number_records = os.path.getsize(path) // dtype.itemsize
+        if number_records == 0:
+            return np.empty(0, dtype=dtype)
+        if mmap:
+            return np.memmap(path, dtype=dtype, mode='r', shape=(number_records,))
+        return np.fromfile(path, dtype=dtype, count=number_records)
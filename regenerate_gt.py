@@ -0,0 +1,169 @@
+"""
+Offline 2d ground truth: the 3d poses and camera states recorded in an experiment are projected again, without the
+simulator, with other cylinder sizes, occlusion filter or cameras (recorded or virtual ones). Frames are split in chunks
+processed by a pool of processes, each chunk written as one gt_store chunk per camera in
+record_data/<name_experiment>/<output>, readable with ExperimentDataset(path, gt2d_folder=output).
+
+Every box is a reprojection of the poses requested during the capture (gt_store scene table, AirSim detections can not
+be requested again), so pedestrians that no camera captured can be projected to other cameras. Experiments recorded
+without that table only have the 3d ground truth of the captured pedestrians.
+"""
+import os
+import json
+import math
+import time
+import multiprocessing
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+
+from camera_model import CameraModel
+from dataset import ExperimentDataset
+from gt_store import GT2D_DTYPE, save_atomic_npz
+from image_utils import check_path
+from reprojection import reproject_pedestrians
+
+# Dataset of the worker process, loaded once by init_worker
+_worker = {}
+
+
+def camera_model_from_state(state, width_img):
+    """ CameraModel of a saved camera state: camera_info.json (fov) or drone states (focal length in pixels, f_fov)
+    :param state (dict): {'pos_x', ..., 'orient_w', ..., 'fov' or 'f_fov'}
+           width_img (int): frame width, to get the fov of the drone cameras
+    :return: CameraModel"""
+    if 'fov' not in state:
+        state = dict(state, fov=math.degrees(2 * math.atan(width_img / (2 * state['f_fov']))))
+    return CameraModel.from_state(state)
+
+
+def init_worker(path_experiment, camera_names):
+    _worker['dataset'] = ExperimentDataset(path_experiment, camera_names)
+
+
+def regenerate_chunk(chunk_index, frames, gt3d_rows, cameras, params):
+    """ 2d ground truth of a chunk of frames (run in the worker processes)
+    :param chunk_index (int): number of the chunk files
+           frames: array of frame indexes of the chunk
+           gt3d_rows: structured array GT3D_DTYPE of the chunk sorted by frame (scene poses)
+           cameras (dict): cameras[cam] = {'width', 'height', 'recorded': bool, 'state': dict (virtual cameras)}
+           params (dict): {'output', 'width', 'height', 'occlusion_filter'}
+    :return: number of rows per camera"""
+    dataset = _worker['dataset']
+    rows = {cam: [] for cam in cameras}
+    starts = np.searchsorted(gt3d_rows['frame'], frames, side='left')
+    ends = np.searchsorted(gt3d_rows['frame'], frames, side='right')
+    for frame_index, start, end in zip(frames.tolist(), starts, ends):
+        rows_3d = gt3d_rows[start:end]
+        if len(rows_3d) == 0:
+            continue
+        positions = np.stack([rows_3d['pos_x'], rows_3d['pos_y'], rows_3d['pos_z'] + params['height'] / 2], axis=1)
+
+        for cam, camera in cameras.items():
+            state = camera['state'] if not camera['recorded'] else dataset.get_camera_state(cam, frame_index)
+            if state is None:
+                continue
+            camera_model = camera_model_from_state(state, camera['width'])
+            depth_matrix = None
+            if params['occlusion_filter'] is not None and camera['recorded']:
+                try:
+                    depth_matrix = dataset.get_depth(cam, frame_index)
+                except KeyError:
+                    depth_matrix = None
+
+            selected, bboxes, visibility = reproject_pedestrians(positions, camera_model, camera['width'], camera['height'],
+                                                                 depth_matrix, params['occlusion_filter'],
+                                                                 params['width'], params['height'])
+            cam_rows = np.zeros(len(selected), dtype=GT2D_DTYPE)
+            cam_rows['frame'] = frame_index
+            cam_rows['id'] = rows_3d['id'][selected]
+            for k, column in enumerate(('xmin', 'ymin', 'xmax', 'ymax')):
+                cam_rows[column] = bboxes[:, k]
+            cam_rows['visible_px'] = -1
+            cam_rows['occlusion'] = -1
+            cam_rows['visibility'] = visibility if visibility is not None else -1
+            cam_rows['predicted'] = rows_3d['predicted'][selected]
+            rows[cam].append(cam_rows)
+
+    counts = {}
+    for cam, cam_rows in rows.items():
+        cam_rows = np.concatenate(cam_rows) if cam_rows else np.empty(0, dtype=GT2D_DTYPE)
+        save_atomic_npz(params['output'] + '/gt2d_' + cam + '_' + str(chunk_index).zfill(5) + '.npz', rows=cam_rows)
+        counts[cam] = len(cam_rows)
+    return counts
+
+
+def regenerate_gt(path_experiment, output='gt_regenerated', camera_names=None, virtual_cameras=None, width=0.58,
+                  height=1.75, occlusion_filter=None, frames_per_chunk=500, processes=None):
+    """ Recompute the 2d ground truth of an experiment
+    :param path_experiment (str): record_data/<name_experiment>
+           output (str): folder created in the experiment
+           camera_names (list str): recorded cameras to project to, by default every camera
+           virtual_cameras (dict): cameras not recorded, virtual_cameras[name] = {'pos_x', ..., 'orient_w', ..., 'fov',
+                                   'width', 'height'} (pixels), without occlusion filter
+           width, height (float): cylinder size in meters
+           occlusion_filter: None, 'flag' or 'drop' (recorded cameras with depth)
+           frames_per_chunk (int): frames per task and chunk file
+           processes (int): worker processes, by default the number of cpus
+    :return: rows per camera (dict)"""
+    start = time.time()
+    dataset = ExperimentDataset(path_experiment, camera_names)
+    frames = np.unique(dataset.scene['frame'])
+
+    # Frame size of the recorded cameras from their first frame
+    cameras = {}
+    for cam in dataset.camera_names:
+        if len(dataset.index[cam]) == 0:
+            continue
+        sample = dataset.get(cam, int(dataset.index[cam]['frame'][0]))
+        image = sample.rgb if sample.rgb is not None else sample.depth
+        if image is None:
+            continue
+        cameras[cam] = {'width': image.shape[1], 'height': image.shape[0], 'recorded': True, 'state': None}
+    for cam, state in (virtual_cameras or {}).items():
+        cameras[cam] = {'width': int(state['width']), 'height': int(state['height']), 'recorded': False, 'state': state}
+
+    path_output = path_experiment + '/' + output
+    check_path(path_output)
+    for old_chunk in os.listdir(path_output):
+        if old_chunk.startswith('gt2d_') and old_chunk.endswith('.npz'):
+            os.remove(path_output + '/' + old_chunk)
+    params = {'output': path_output, 'width': width, 'height': height, 'occlusion_filter': occlusion_filter}
+
+    chunks = [frames[i:i + frames_per_chunk] for i in range(0, len(frames), frames_per_chunk)]
+    totals = {cam: 0 for cam in cameras}
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(processes, mp_context=context, initializer=init_worker,
+                             initargs=(path_experiment, dataset.camera_names)) as executor:
+        futures = []
+        for chunk_index, chunk in enumerate(chunks):
+            start_row, end_row = np.searchsorted(dataset.scene['frame'], [chunk[0], chunk[-1] + 1])
+            futures.append(executor.submit(regenerate_chunk, chunk_index, chunk, dataset.scene[start_row:end_row], cameras, params))
+        for chunk_index, future in enumerate(futures):
+            for cam, count in future.result().items():
+                totals[cam] += count
+            print('-> Chunk {}/{} done'.format(chunk_index + 1, len(chunks)))
+
+    info = {'cameras': {cam: {key: value for key, value in camera.items() if key != 'state'} for cam, camera in cameras.items()},
+            'virtual_cameras': virtual_cameras or {}, 'width': width, 'height': height,
+            'occlusion_filter': occlusion_filter, 'frames': len(frames), 'rows': totals, 'seconds': time.time() - start}
+    with open(path_output + '/regenerate_info.json', 'w') as f:
+        json.dump(info, f)
+    with open(path_output + '/pedestrian_names.json', 'w') as f:
+        json.dump(dataset.name_pedestrians, f)
+    print('-> 2d ground truth of {} frames regenerated in {} ({:.1f} s)'.format(len(frames), path_output, info['seconds']))
+    return totals
+
+
+if __name__ == "__main__":
+    # Settings
+    name_experiment = 'TEST_PROJECTIONS'
+    output = 'gt_regenerated'
+    width = 0.5  # cylinder size in meters
+    height = 1.8
+    occlusion_filter = 'flag'  # None, 'flag', 'drop'
+    virtual_cameras = None  # {'cam_top': {'pos_x': 0, 'pos_y': 0, 'pos_z': -20, 'orient_w': 0.7071, 'orient_x': 0, 'orient_y': -0.7071, 'orient_z': 0, 'fov': 90, 'width': 640, 'height': 480}}
+
+    path_experiment = os.path.join(os.getcwd(), 'record_data/' + name_experiment)
+    regenerate_gt(path_experiment, output, virtual_cameras=virtual_cameras, width=width, height=height,
+                  occlusion_filter=occlusion_filter)
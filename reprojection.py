@@ -1,8 +1,10 @@
 import numpy as np
-from geometry_utils import Point2D, Bbox, Cylinder, Point3D, f_add, f_subtract_ground, f_add_ground, f_euclidian_image
+from camera_model import CameraModel
+from geometry_utils import Point2D, Bbox, Point3D, f_add, f_subtract_ground, f_add_ground, f_euclidian_image, \
+    OVERPERCENT_FEET
 
 
-def to3d(depth_px, point, width, height, rot_matrix, translation, f_px):
+def to3d(depth_px, point, width, height, rot_matrix, translation, f_px, transformation_gr=None):
     # From pixel image coordinates to relative 3d camera coordinates
     coord_img_x, coord_img_y = point.getAsXY()
     coord_3d_y = (coord_img_x - width / 2.) * depth_px / f_px
@@ -15,8 +17,9 @@ def to3d(depth_px, point, width, height, rot_matrix, translation, f_px):
              [1]]
 
     # From relative coordinates to global
-    transformation_gr = np.append(rot_matrix, translation, axis=1)
-    transformation_gr = np.append(transformation_gr, [[0,0,0,1]], axis=0)
+    if transformation_gr is None:
+        transformation_gr = np.append(rot_matrix, translation, axis=1)
+        transformation_gr = np.append(transformation_gr, [[0,0,0,1]], axis=0)
 
     assert np.shape(transformation_gr)[0] == 4 and np.shape(transformation_gr)[1] == 4
     global_coord3d = np.dot(transformation_gr, coord)
@@ -27,12 +30,13 @@ def to3d(depth_px, point, width, height, rot_matrix, translation, f_px):
     return Point3D(coord_3d_x, coord_3d_y, coord_3d_z)
 
 
-def from3d(cx, cy, cz, rot_matrix, translation, width, height, f_px):
+def from3d(cx, cy, cz, rot_matrix, translation, width, height, f_px, transformation_gr_inv=None):
     # f_px = 320
-    transformation_gr = np.append(rot_matrix, translation, axis=1)
-    transformation_gr = np.append(transformation_gr, [[0,0,0,1]], axis=0)
-    transformation_gr_inv = np.linalg.inv(transformation_gr)
-    assert np.shape(transformation_gr)[0] == 4 and np.shape(transformation_gr)[1] == 4
+    if transformation_gr_inv is None:
+        transformation_gr = np.append(rot_matrix, translation, axis=1)
+        transformation_gr = np.append(transformation_gr, [[0,0,0,1]], axis=0)
+        transformation_gr_inv = np.linalg.inv(transformation_gr)
+        assert np.shape(transformation_gr)[0] == 4 and np.shape(transformation_gr)[1] == 4
 
     global_point = [[cx],[cy],[cz], [1]]
     # From 3d global coordinates to relative 3d coordinates
@@ -50,32 +54,37 @@ def from3d(cx, cy, cz, rot_matrix, translation, width, height, f_px):
 def from3dCylinder(cam_state, f_px, depth_matrix, cylinder):
     """
     Converts a cylinder in floor plane to a bbox from the specified camera image coordinates
+    cam_state: (translation, rot_matrix) or CameraModel with the transformations already computed
     """
     height_img, width_img = depth_matrix.shape[0], depth_matrix.shape[1]
+    transformation_gr, transformation_gr_inv = None, None
+    if isinstance(cam_state, CameraModel):
+        transformation_gr, transformation_gr_inv = cam_state.extrinsic, cam_state.extrinsic_inv
+        cam_state = cam_state.pose
     translation, rot_matrix = cam_state
 
     center = cylinder.getCenter()
     # 1. Projection of cylinder center
     cx, cy, cz, cwidth, cheight = cylinder.getXYZWH()
-    bottom, depth = from3d(cx, cy, cz, rot_matrix, translation, width_img, height_img, f_px)
+    bottom, depth = from3d(cx, cy, cz, rot_matrix, translation, width_img, height_img, f_px, transformation_gr_inv)
 
     if depth > 0:
         # 2. Add a horizontal vector in the image plane and reproject to 3d
         vector_2d = f_add(bottom, Point2D(10, 0))
-        vector_3d = to3d(depth, vector_2d, width_img, height_img, rot_matrix, translation, f_px)
+        vector_3d = to3d(depth, vector_2d, width_img, height_img, rot_matrix, translation, f_px, transformation_gr)
 
         # 3. Compute 3d normalized vector to the width of the cylinder
         vector_3d_norm = f_subtract_ground(vector_3d, center).normalize(cwidth)
         # 4. Add vector 3d to cylinder center and reproject to image
         wx, wy, wz = f_add_ground(vector_3d_norm, center).getXYZ()
-        feet_edge2d, depth = from3d(wx, wy, wz, rot_matrix, translation, width_img, height_img, f_px)
+        feet_edge2d, depth = from3d(wx, wy, wz, rot_matrix, translation, width_img, height_img, f_px, transformation_gr_inv)
 
         # 5. Compute distance between bbox bottom and the edge
         width = f_euclidian_image(bottom, feet_edge2d) * 2
 
         # Compute of the height
         hx, hy, hheight = cylinder.getHair().getXYZ()
-        head_point, depth = from3d(hx, hy, hheight, rot_matrix, translation, width_img, height_img, f_px)
+        head_point, depth = from3d(hx, hy, hheight, rot_matrix, translation, width_img, height_img, f_px, transformation_gr_inv)
         height = bottom.getAsXY()[1] - head_point.getAsXY()[1]
         bbox = Bbox.FeetWH(bottom, width, height)
     else:
@@ -115,45 +124,189 @@ def check_bbox(xmin, ymin, xmax, ymax, frame_width, frame_height):
     return check, xmin, ymin, xmax, ymax
 
 
+def from3d_batch(points, transformation_gr_inv, width, height, f_px):
+    """ Vectorized from3d
+    :param points: array N X 3 global 3d coordinates
+           transformation_gr_inv: inverse of the 4x4 camera transformation
+    :return: px: array N X 2 int pixel coordinates
+             depth: array N distance along the camera axis"""
+    rel_3dpos = points @ transformation_gr_inv[:3, :3].T + transformation_gr_inv[:3, 3]
+    depth = rel_3dpos[:, 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        px_x = rel_3dpos[:, 1] / depth * f_px + (width / 2.)
+        px_y = rel_3dpos[:, 2] / depth * f_px + (height / 2.)
+    px = np.stack([px_x, px_y], axis=1)
+    # int() truncation as in from3d
+    px = np.trunc(np.nan_to_num(px, nan=0., posinf=0., neginf=0.))
+    return px, depth
+
+
+def project_cylinders(positions, camera_model, width_img, height_img, width=0.58, height=1.75):
+    """
+    Vectorized from3dCylinder for N pedestrians seen from one camera, using the transformations cached in the model
+    :param positions: array N X 3 global coordinates of the cylinder centers
+           camera_model: CameraModel
+           width_img, height_img (int): frame size
+           width, height (float): cylinder size in meters
+    :return: bboxes: array N X 4 int [xmin, ymin, xmax, ymax]
+             valid: array N bool, False when the pedestrian is behind the camera"""
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+    transformation_gr_inv = camera_model.extrinsic_inv
+    rot_matrix = camera_model.extrinsic[:3, :3]
+    translation = camera_model.extrinsic[:3, 3]
+    f_px = camera_model.focal_length_px(width_img)
+
+    # 1. Projection of cylinder centers
+    bottom, depth = from3d_batch(positions, transformation_gr_inv, width_img, height_img, f_px)
+    valid = depth > 0
+
+    # 2. Add a horizontal vector in the image plane and reproject to 3d
+    coord_3d = np.stack([depth,
+                         (bottom[:, 0] + 10 - width_img / 2.) * depth / f_px,
+                         (bottom[:, 1] - height_img / 2.) * depth / f_px], axis=1)
+    vector_3d = coord_3d @ rot_matrix.T + translation
+
+    # 3. Normalize the ground vector to the width of the cylinder and 4. add it to the center
+    vector_ground = vector_3d[:, :2] - positions[:, :2]
+    norm = np.linalg.norm(vector_ground, axis=1)
+    valid &= norm > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        edge = positions.copy()
+        edge[:, :2] += vector_ground * (width / norm)[:, None]
+    feet_edge2d, _ = from3d_batch(edge, transformation_gr_inv, width_img, height_img, f_px)
+
+    # 5. Distance between bbox bottom and the edge
+    bbox_width = np.linalg.norm(feet_edge2d - bottom, axis=1) * 2
+
+    # Height from the projection of the head
+    head = positions.copy()
+    head[:, 2] -= height
+    head_point, _ = from3d_batch(head, transformation_gr_inv, width_img, height_img, f_px)
+    bbox_height = bottom[:, 1] - head_point[:, 1]
+
+    # Bbox.FeetWH
+    feet_height = bbox_height * OVERPERCENT_FEET
+    bboxes = np.stack([bottom[:, 0] - bbox_width / 2,
+                       bottom[:, 1] + feet_height - bbox_height,
+                       bottom[:, 0] + bbox_width / 2,
+                       bottom[:, 1] + feet_height], axis=1)
+    bboxes = np.trunc(np.nan_to_num(bboxes, nan=0., posinf=0., neginf=0.)).astype(np.int64)
+    bboxes[~valid] = 0
+    return bboxes, valid
+
+
+def check_bboxes(bboxes, frame_width, frame_height):
+    """ Vectorized check_bbox
+    :param bboxes: array N X 4 [xmin, ymin, xmax, ymax]
+    :return: check: array N bool
+             bboxes: array N X 4 adapted inside the frame dimensions"""
+    bboxes = np.array(bboxes, copy=True).reshape(-1, 4)
+    check = np.ones(len(bboxes), dtype=bool)
+    for axis, size in ((0, frame_width), (1, frame_height)):
+        cmin, cmax = bboxes[:, axis], bboxes[:, axis + 2]
+        outside = (cmax < 0) | (cmin > size)
+        clip_min = ~outside & (cmax > 0) & (0 > cmin)
+        clip_max = ~outside & ~clip_min & (cmin < size) & (size < cmax)
+        check &= ~outside
+        cmin[clip_min] = 0
+        cmax[clip_max] = size
+
+    height = bboxes[:, 3] - bboxes[:, 1]
+    width = bboxes[:, 2] - bboxes[:, 0]
+    check &= (height >= 2) & (width >= 2)
+    return check, bboxes
+
+
+def depth_visibility(bboxes, depths, depth_matrix, samples=8, tolerance=0.25):
+    """
+    Visible fraction of N projected pedestrians: a grid of samples X samples points in each bbox is compared with the
+    depth frame, a point is occluded when something is closer to the camera than the front of the pedestrian
+    :param bboxes: array N X 4 [xmin, ymin, xmax, ymax] inside the frame
+           depths: array N distance of the pedestrians along the camera axis in meters (minus the cylinder radius)
+           depth_matrix: array H X W (X 1) in millimeters, clamped at 65535
+           samples (int): grid size per axis
+           tolerance (float): meters
+    :return: array N float [0, 1]"""
+    depth_matrix = depth_matrix.reshape(depth_matrix.shape[0], depth_matrix.shape[1])
+    height, width = depth_matrix.shape
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+    steps = (np.arange(samples) + 0.5) / samples
+    xs = (bboxes[:, 0, None] + (bboxes[:, 2] - bboxes[:, 0])[:, None] * steps).astype(np.int64)
+    ys = (bboxes[:, 1, None] + (bboxes[:, 3] - bboxes[:, 1])[:, None] * steps).astype(np.int64)
+    np.clip(xs, 0, width - 1, out=xs)
+    np.clip(ys, 0, height - 1, out=ys)
+
+    # N X samples X samples depth of the scene in meters
+    scene_depth = depth_matrix[ys[:, :, None], xs[:, None, :]]
+    visible = (scene_depth / 1000. >= (np.asarray(depths) - tolerance)[:, None, None]) | (scene_depth >= 65535)
+    return visible.reshape(len(bboxes), -1).mean(axis=1)
+
+
+def reproject_pedestrians(positions, camera_model, frame_width, frame_height, depth_matrix=None, occlusion_filter=None,
+                          width=0.58, height=1.75):
+    """ Bboxes of the pedestrians projected inside the frame and their visibility in the depth frame
+    :param positions: array N X 3 cylinder centers
+           camera_model: CameraModel
+           depth_matrix: array H X W (X 1) in millimeters, needed by the occlusion filter
+           occlusion_filter: None, 'flag' or 'drop' (see Configuration)
+           width, height (float): cylinder size in meters
+    :return: selected: array K indexes of the pedestrians kept
+             bboxes: array K X 4 int [xmin, ymin, xmax, ymax]
+             visibility: array K float [0, 1] or None without occlusion filter"""
+    bboxes, valid = project_cylinders(positions, camera_model, frame_width, frame_height, width, height)
+    check, bboxes = check_bboxes(bboxes, frame_width, frame_height)
+    selected = np.flatnonzero(check & valid)
+
+    visibility = None
+    if occlusion_filter is not None and depth_matrix is not None and len(selected) > 0:
+        # Distance of the front of the cylinder to the camera
+        depths = camera_model.to_camera(positions[selected])[:, 0] - width
+        visibility = depth_visibility(bboxes[selected], depths, depth_matrix)
+        if occlusion_filter == 'drop':
+            selected, visibility = selected[visibility > 0], visibility[visibility > 0]
+    return selected, bboxes[selected], visibility
+
+
 def gt2d_from_gt3d(cam_name, gt2d_iteration, gt3d_iteration, depth_matrix, config, uav=None):
     """
     :param cam_name (str): camera name
            gt2d_iteration: ground truth capture by AirSim in 2D: list of dict = {'id': name_pedestrian, 'xmin': xmin_bbox, 'ymin': ymin_bbox, 'xmax': xmax_bbox, 'ymax': ymax_bbox}
            gt3d_iteration: ground truth capture by AirSim in 3D: list of dict = {'id': name_pedestrian, 'pos_x': 3d coord x, 'pos_y': 3d coord y, 'pos_z': 3d coord z}
-           depth_matrix: array H X W  [0,100000]
+           depth_matrix: array H X W  [0,100000] (mm). Without depth images only its shape is used
            config: Configuration Class
+    With config.occlusion_filter and depth images, each bbox gets its 'visibility' from the depth frame and the
+    completely hidden pedestrians are dropped ('drop') or kept with visibility 0 ('flag')
     """
     width = 0.58
     height = 1.75
     if uav is not None:
-        cam_state = uav.extrinsics_camera
-        f_px = uav.cam_states[-1]['f_fov']
+        camera_model = uav.camera_model
     else:
-        cam_state = config.get_pose(cam_name)
-        f_px = config.get_focal_length_px(cam_name, depth_matrix)
+        camera_model = config.get_camera_model(cam_name)
     frame_height, frame_width = depth_matrix.shape[0], depth_matrix.shape[1]
 
-    ped_scene = [gt3d['id'] for gt3d in gt3d_iteration]
-    ped_detected = [gt2d['id'] for gt2d in gt2d_iteration]
-    ped_to_detect = list(set(ped_scene) ^ set(ped_detected))
+    # Pedestrians in the scene without AirSim bounding box
+    ped_detected = set(gt2d['id'] for gt2d in gt2d_iteration)
+    ped_to_detect = [gt3d for gt3d in gt3d_iteration if gt3d['id'] not in ped_detected]
+    if len(ped_to_detect) == 0:
+        return []
+
+    positions = np.array([[gt3d['pos_x'], gt3d['pos_y'], gt3d['pos_z'] + (height / 2)] for gt3d in ped_to_detect])
+    depth = depth_matrix if 'D' in config.image_types else None
+    selected, bboxes, visibility = reproject_pedestrians(positions, camera_model, frame_width, frame_height, depth,
+                                                         config.occlusion_filter, width, height)
 
-    ped_3d_info = {gt3d['id']: [gt3d['pos_x'], gt3d['pos_y'], gt3d['pos_z']] for gt3d in gt3d_iteration if
-                   gt3d['id'] in ped_to_detect}
     info_2d = []
-    for ped in ped_to_detect:
-        x, y, z = ped_3d_info[ped]
-        z = z + (height / 2)
-
-        cylinder = Cylinder.XYZWH(x, y, z, width, height)
-        bbox = from3dCylinder(cam_state, f_px, depth_matrix, cylinder)
-        xmin, ymin, xmax, ymax = bbox.getAsXmYmXMYM()
-        check, xmin, ymin, xmax, ymax = check_bbox(xmin, ymin, xmax, ymax, frame_width, frame_height)
-
-        if check:
-            info = {'id': ped,
-                    'xmin': int(xmin),
-                    'ymin': int(ymin),
-                    'xmax': int(xmax),
-                    'ymax': int(ymax)}
-            info_2d.append(info)
+    for k, i in enumerate(selected):
+        xmin, ymin, xmax, ymax = bboxes[k].tolist()
+        info = {'id': ped_to_detect[i]['id'],
+                'xmin': int(xmin),
+                'ymin': int(ymin),
+                'xmax': int(xmax),
+                'ymax': int(ymax)}
+        if visibility is not None:
+            info['visibility'] = float(visibility[k])
+        if 'predicted' in ped_to_detect[i]:
+            info['predicted'] = ped_to_detect[i]['predicted']
+        info_2d.append(info)
     return info_2d
@@ -0,0 +1,118 @@
+import numpy as np
+
+from image_encoder import SegmentationPalette
+from reprojection import project_cylinders, check_bboxes
+
+# Fraction of the reprojected cylinder bbox covered by the silhouette of a fully visible standing pedestrian
+SILHOUETTE_FILL = 0.45
+# Instances with less visible pixels are ignored (segmentation noise at the borders of the objects)
+MIN_VISIBLE_PIXELS = 10
+
+
+class SegmentationGT:
+    """
+    2d ground truth from the segmentation images. get_name_pedestrians gives the segmentation id i + 1 to the pedestrian
+    i, so a lookup table color -> id -> pedestrian labels every pixel at once, and the instances (tight bboxes and
+    visible pixels) are obtained from the labelled pixels sorted by pedestrian.
+    """
+
+    def __init__(self, name_pedestrians, color_dict, silhouette_fill=SILHOUETTE_FILL, min_visible_pixels=MIN_VISIBLE_PIXELS):
+        """
+        :param name_pedestrians (list str): pedestrians in the order of get_name_pedestrians
+               color_dict (dict): color_dict[id] = [r, g, b], see pedestrians.get_dict_colors"""
+        self.name_pedestrians = list(name_pedestrians)
+        self.palette = SegmentationPalette(color_dict)
+        self.silhouette_fill = silhouette_fill
+        self.min_visible_pixels = min_visible_pixels
+
+        # segmentation id -> pedestrian index, -1 for the background and the other objects
+        self.id_to_pedestrian = np.full(len(self.palette.colors_bgr), -1, dtype=np.int32)
+        number_ids = len(self.name_pedestrians)
+        assert number_ids < len(self.id_to_pedestrian), \
+            'segmentation ids: {} pedestrians, at most {}'.format(number_ids, len(self.id_to_pedestrian) - 1)
+        self.id_to_pedestrian[1:number_ids + 1] = np.arange(number_ids)
+
+    def label_image(self, segmentation):
+        """ Instance masks of every pedestrian in one image
+        :param segmentation: array H X W X 3 BGR
+        :return: labels: array H X W int32, pedestrian index of each pixel (-1 not a pedestrian)"""
+        return self.id_to_pedestrian[self.palette.to_index(segmentation)]
+
+    @staticmethod
+    def instance_masks(labels, pedestrians):
+        """ Binary masks of some pedestrians
+        :param labels: array H X W given by label_image
+               pedestrians: array K of pedestrian indexes
+        :return: array K X H X W bool"""
+        return labels[None, :, :] == np.asarray(pedestrians)[:, None, None]
+
+    def instances(self, labels):
+        """ Tight bboxes and visible pixels of the pedestrians of a label image
+        :param labels: array H X W given by label_image
+        :return: pedestrians: array K pedestrian indexes
+                 bboxes: array K X 4 int [xmin, ymin, xmax, ymax] (inclusive pixel coordinates)
+                 visible_px: array K int"""
+        flat = labels.ravel()
+        pixels = np.flatnonzero(flat >= 0)
+        if len(pixels) == 0:
+            return np.empty(0, dtype=np.int32), np.empty((0, 4), dtype=np.int64), np.empty(0, dtype=np.int64)
+
+        pedestrian_of_pixel = flat[pixels]
+        order = np.argsort(pedestrian_of_pixel, kind='stable')
+        pedestrian_of_pixel = pedestrian_of_pixel[order]
+        pixels = pixels[order]
+        starts = np.flatnonzero(np.r_[True, pedestrian_of_pixel[1:] != pedestrian_of_pixel[:-1]])
+
+        ys, xs = np.divmod(pixels, labels.shape[1])
+        bboxes = np.stack([np.minimum.reduceat(xs, starts), np.minimum.reduceat(ys, starts),
+                           np.maximum.reduceat(xs, starts), np.maximum.reduceat(ys, starts)], axis=1)
+        visible_px = np.diff(np.r_[starts, len(pixels)])
+        pedestrians = pedestrian_of_pixel[starts]
+
+        keep = visible_px >= self.min_visible_pixels
+        return pedestrians[keep], bboxes[keep], visible_px[keep]
+
+    def occlusion(self, pedestrians, visible_px, gt3d_iteration, camera_model, width_img, height_img, width=0.58, height=1.75):
+        """ Occlusion ratio: 1 - visible pixels / pixels expected for the pedestrian without occluders (silhouette_fill of
+        the reprojected cylinder bbox, clipped to the frame)
+        :param pedestrians: array K pedestrian indexes, visible_px: array K
+               gt3d_iteration (list): [{'id': name_pedestrian, 'pos_x': x, 'pos_y': y, 'pos_z': z, ...}, ...]
+               camera_model: CameraModel
+        :return: array K float in [0, 1], -1 when it can not be computed (no 3d position or projection)"""
+        occlusion = np.full(len(pedestrians), -1.)
+        positions_3d = {gt3d['id']: (gt3d['pos_x'], gt3d['pos_y'], gt3d['pos_z'] + height / 2) for gt3d in gt3d_iteration}
+        known = np.array([self.name_pedestrians[p] in positions_3d for p in pedestrians], dtype=bool)
+        if not known.any():
+            return occlusion
+
+        positions = np.array([positions_3d[self.name_pedestrians[p]] for p in pedestrians[known]])
+        bboxes, valid = project_cylinders(positions, camera_model, width_img, height_img, width, height)
+        check, bboxes = check_bboxes(bboxes, width_img, height_img)
+        area = (bboxes[:, 2] - bboxes[:, 0]) * (bboxes[:, 3] - bboxes[:, 1]) * self.silhouette_fill
+        valid &= check & (area > 0)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.clip(1 - visible_px[known] / area, 0, 1)
+        occlusion[np.flatnonzero(known)[valid]] = ratio[valid]
+        return occlusion
+
+    def gt2d(self, segmentation, gt3d_iteration, camera_model):
+        """ 2d ground truth of one camera from its segmentation image
+        :param segmentation: array H X W X 3 BGR
+               gt3d_iteration (list): 3d ground truth of the frame, to compute the occlusion
+               camera_model: CameraModel of the camera in this frame
+        :return: list of dict = {'id': name_pedestrian, 'xmin', 'ymin', 'xmax', 'ymax', 'visible_px', 'occlusion'}"""
+        labels = self.label_image(segmentation)
+        pedestrians, bboxes, visible_px = self.instances(labels)
+        occlusion = self.occlusion(pedestrians, visible_px, gt3d_iteration, camera_model, labels.shape[1], labels.shape[0])
+
+        info_2d = []
+        for pedestrian, bbox, pixels, ratio in zip(pedestrians.tolist(), bboxes.tolist(), visible_px.tolist(), occlusion.tolist()):
+            info_2d.append({'id': self.name_pedestrians[pedestrian],
+                            'xmin': bbox[0],
+                            'ymin': bbox[1],
+                            'xmax': bbox[2],
+                            'ymax': bbox[3],
+                            'visible_px': pixels,
+                            'occlusion': ratio})
+        return info_2d
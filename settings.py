@@ -4,26 +4,135 @@ import sys
 import numpy as np
 import airsim
 
-from scipy.spatial.transform import Rotation as R
+from camera_model import CameraModel
+from image_encoder import codec_params, LOSSLESS_CODECS
 
 
 class Configuration:
     def __init__(self, img_types, nframes, save_mode, name_experiment, visualize_images=False,
-                 vis_pedestrian_2dGT=False, save_camera_state=True, external=True, uavs=None):
+                 vis_pedestrian_2dGT=False, save_camera_state=True, external=True, uavs=None,
+                 pipelined=False, writer_workers=4, writer_queue_size=8, reuse_image_buffers=False,
+                 gt_chunk_size=5000, export_gt_json=True, rpc_clients=0, trace=False, trace_summary_every=10,
+                 depth_storage='npy', depth_chunk_frames=500, depth_compression=1,
+                 encoder_processes=0, rgb_codec='png', rgb_level=None, segmentation_codec='png',
+                 segmentation_level=None, segmentation_indexed=False, gt2d_source='detections',
+                 occlusion_filter='flag', frustum_culling=False, frustum_far=None, frustum_min_height=None,
+                 cameras=None, rpc_pool_size=None, rpc_timeout=60, rpc_retries=3, frame_retries=2,
+                 checkpoint_every=100, resume=False, sync_step=None, sync_timeout=60.,
+                 vis_max_fps=10, vis_tile_width=320, vis_headless=False, shm_publish=False, shm_prefix='pedenv',
+                 shm_slots=8, pose_sampling_factor=1, pose_error_bound=0.05, pose_angle_bound=5.,
+                 settings_airsim=None):
 
         self.mode = 'record_data'
-        self.settings_airsim = self.load_settings_airsim()
+        self.settings_airsim = settings_airsim if settings_airsim is not None else self.load_settings_airsim()
         self.number_frames = nframes
         self.camera_states = None
+        self.camera_models = {}
         self.image_types = img_types
         self.save_mode = save_mode
         self.name_experiment = name_experiment
         self.visualize_images = visualize_images
         self.vis_pedestrian_2dGT = vis_pedestrian_2dGT
+        # The visualization process shows the cameras at most vis_max_fps times per second, in tiles vis_tile_width
+        # pixels wide. Headless: preview.mp4 written in the experiment folder instead of a window
+        self.vis_max_fps = vis_max_fps
+        self.vis_tile_width = vis_tile_width
+        self.vis_headless = vis_headless
         self.save_pose_cameras = save_camera_state
         self.external = external
         self.path_save = None
 
+        # Pipelined capture: overlap image requests with ground truth and write frames in background
+        self.pipelined = pipelined
+        self.writer_workers = writer_workers
+        self.writer_queue_size = writer_queue_size
+        # Decode images into preallocated per-camera ring buffers instead of allocating new arrays every frame
+        self.reuse_image_buffers = reuse_image_buffers
+
+        # Ground truth is flushed to disk in chunks of gt_chunk_size rows, legacy json files exported at the end
+        self.gt_chunk_size = gt_chunk_size
+        self.export_gt_json = export_gt_json
+
+        # Extra clients to request pedestrian poses and detections concurrently (0: sequential on the reference client)
+        self.rpc_clients = rpc_clients
+
+        # Connections shared by the image, pose and detection requests (None: one per client, see client_pool), request
+        # timeout in seconds, retries of a failed request on a new connection and retries of a frame whose requests failed
+        self.rpc_pool_size = rpc_pool_size
+        self.rpc_timeout = rpc_timeout
+        self.rpc_retries = rpc_retries
+        self.frame_retries = frame_retries
+
+        # Per-frame timing of the capture loop stages: rolling summary every trace_summary_every frames (0: never)
+        # and Chrome trace (trace.json) saved at the end
+        self.trace = trace
+        self.trace_summary_every = trace_summary_every
+
+        # Depth storage: 'npy' one file per frame, 'chunked' uint16 mm in files of depth_chunk_frames frames with an
+        # index (depth_compression: zlib level, 0 raw frames that can be memory mapped). Store created by CV_Capture
+        assert depth_storage in ('npy', 'chunked'), 'depth_storage must be npy or chunked'
+        self.depth_storage = depth_storage
+        self.depth_chunk_frames = depth_chunk_frames
+        self.depth_compression = depth_compression
+        self.depth_store = None
+
+        # Image encoding: codec ('png', 'webp' lossless, 'jpeg') and level (png compression, jpeg quality) of each stream,
+        # encoded in encoder_processes processes (0: in the saving thread). Segmentation can be saved as ids of the
+        # segmentation_rgb.txt palette (single channel). Encoder and palette created by CV_Capture
+        self.encoder_processes = encoder_processes
+        self.rgb_encoding = codec_params(rgb_codec, rgb_level)
+        self.segmentation_encoding = codec_params(segmentation_codec, segmentation_level)
+        assert not segmentation_indexed or segmentation_codec in LOSSLESS_CODECS, \
+            'segmentation_indexed needs a lossless codec: {}'.format(', '.join(LOSSLESS_CODECS))
+        self.segmentation_indexed = segmentation_indexed
+        self.image_encoder = None
+        self.segmentation_palette = None
+
+        # 2d ground truth from AirSim detections (completed by 3d reprojection) or from the segmentation images (tight
+        # bboxes, visible pixels and occlusion, no detection requests). SegmentationGT created by CV_Capture
+        assert gt2d_source in ('detections', 'segmentation'), 'gt2d_source must be detections or segmentation'
+        assert gt2d_source == 'detections' or img_types == 'RGB-DS', 'gt2d_source segmentation needs RGB-DS images'
+        self.gt2d_source = gt2d_source
+        self.segmentation_gt = None
+
+        # Depth test of the bboxes reprojected from 3d (RGB-D and RGB-DS): 'flag' adds their visibility, 'drop' also
+        # removes the completely hidden pedestrians, None disables it
+        assert occlusion_filter in (None, 'flag', 'drop'), 'occlusion_filter must be None, flag or drop'
+        self.occlusion_filter = occlusion_filter
+
+        # Only the pedestrians inside the view frustum of each camera are projected, found with a grid over the
+        # pedestrian positions built every frame. frustum_far: meters, None up to where the bbox of a pedestrian is
+        # frustum_min_height pixels tall. frustum_min_height: None keeps every bbox that check_bbox accepts (same ground
+        # truth as without culling); a larger height (e.g. 10) prunes much more but drops the farther pedestrians
+        self.frustum_culling = frustum_culling
+        self.frustum_far = frustum_far
+        self.frustum_min_height = frustum_min_height
+
+        # Every checkpoint_every frames (0: never) the saved data is flushed and the frame recorded in checkpoint.json.
+        # resume: continue an existing name_experiment from its last checkpoint instead of frame 0
+        self.checkpoint_every = checkpoint_every
+        self.resume = resume
+
+        # Synchronized capture: the simulation is paused while a frame is captured and advanced sync_step sim seconds
+        # between frames (None: the simulation runs in real time). Images are not prefetched in this mode
+        self.sync_step = sync_step
+        self.sync_timeout = sync_timeout
+
+        # Decoded images of every frame published in shared memory rings of shm_slots frames (<shm_prefix>_<camera>)
+        # for other local processes, see ImageSubscriber in image_ring
+        self.shm_publish = shm_publish
+        self.shm_prefix = shm_prefix
+        self.shm_slots = shm_slots
+
+        # Pedestrian poses requested every pose_sampling_factor frames at most and extrapolated in between (1: every
+        # frame), a pedestrian is queried more often when the extrapolation misses by pose_error_bound meters or
+        # pose_angle_bound degrees (see trajectory.PoseTrajectories)
+        self.pose_sampling_factor = pose_sampling_factor
+        self.pose_error_bound = pose_error_bound
+        self.pose_angle_bound = pose_angle_bound
+
+        # Subset of the external cameras to record (e.g. one shard of sharded_capture), None for every camera
+        self.cameras = cameras
         if self.external:
             self.camera_names, self.number_cameras = self.get_cameras_info()
         elif uavs is not None:
@@ -53,6 +162,11 @@ class Configuration:
                  number of cameras (int)"""
         cameras = self.settings_airsim['ExternalCameras']
         camera_names = list(cameras.keys())
+        if self.cameras is not None:
+            missing = [cam for cam in self.cameras if cam not in camera_names]
+            if missing:
+                sys.exit('Cameras {} not defined in AirSim settings'.format(missing))
+            camera_names = [cam for cam in camera_names if cam in self.cameras]
 
         return camera_names, len(camera_names)
 
@@ -81,6 +195,7 @@ class Configuration:
                 'orient_y': orientation.y_val,
                 'orient_z': orientation.z_val
             }
+            self.camera_models[cam] = CameraModel.from_state(info_cameras[cam])
         return info_cameras
 
     @staticmethod
@@ -96,17 +211,24 @@ class Configuration:
         """Get fov defined in AirSim/settings.json"""
         return self.camera_states[cam_name]['fov']
 
+    def get_camera_model(self, cam_name):
+        """ Get camera model, computed once per camera
+        :param cam_name (str): camera name
+        :return: CameraModel"""
+        camera_model = self.camera_models.get(cam_name)
+        if camera_model is None:
+            camera_model = CameraModel.from_state(self.camera_states[cam_name])
+            self.camera_models[cam_name] = camera_model
+        return camera_model
+
     def get_focal_length_px(self, cam_name, frame):
         """
         :param cam_name (str): camera name
                frame (array image)
         :return: focal lenght in pixels
         """
-        f_fov = self.camera_states[cam_name]['f_fov']
         width_frame = np.shape(frame)[1]
-
-        f_px = width_frame / f_fov
-        return f_px
+        return self.get_camera_model(cam_name).focal_length_px(width_frame)
 
     def get_focal_length_mm(self, cam_name):
         """Get focal lenght in mm
@@ -119,15 +241,7 @@ class Configuration:
         :param cam_name (str): camera name
         :return: translation (list) = [[x], [y], [z]]
                  rot_matrix (3x3 matrix)"""
-        info_cam = self.camera_states[cam_name]
-        translation = [[info_cam['pos_x']],
-                       [info_cam['pos_y']],
-                       [info_cam['pos_z']]]
-
-        quaternions = [info_cam['orient_x'], info_cam['orient_y'], info_cam['orient_z'], info_cam['orient_w']]
-        rot = R.from_quat(quaternions)
-        rot_matrix = rot.as_matrix()
-        return translation, rot_matrix
+        return self.get_camera_model(cam_name).pose
 
     # ---------Weather------------------
     @staticmethod
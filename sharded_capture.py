@@ -0,0 +1,181 @@
+"""
+Sharded capture: one coordinator process starts a capture process per simulator instance (shard), each one reachable at
+its own host/port and recording a disjoint set of external cameras or a weather / time of day variant of the scene.
+Shards are saved in the same experiment, record_data/<name_experiment>/<shard>/ (each one readable as an experiment),
+and their ground truth is merged at the end in record_data/<name_experiment>/gt_merged.
+
+The project modules are imported inside the shard processes, after worker_setup, so that a process can prepare its
+environment (e.g. mock_airsim.install) before 'import airsim'.
+"""
+import os
+import json
+import time
+import multiprocessing
+import numpy as np
+
+
+def camera_shards(camera_names, endpoints):
+    """ Split the cameras between simulator instances
+    :param camera_names (list str): external cameras of the AirSim settings
+           endpoints (list): [(ip, port), ...] one per simulator instance
+    :return: list of shards [{'name': 'shard0', 'ip': ip, 'port': port, 'cameras': [...]}, ...]"""
+    shards = []
+    for i, (ip, port) in enumerate(endpoints):
+        cameras = camera_names[i::len(endpoints)]
+        if cameras:
+            shards.append({'name': 'shard{}'.format(i), 'ip': ip, 'port': port, 'cameras': cameras})
+    return shards
+
+
+def variant_shards(endpoints, variants):
+    """ Record the same cameras with a different weather / time of day in each simulator instance
+    :param endpoints (list): [(ip, port), ...]
+           variants (list): [{'name': 'rain_evening', 'weather': ('rain', 0.5), 'day_time': '2018-02-12 19:00:00'}, ...]
+                            weather and day_time are optional, see Configuration.set_weather and set_day_time
+    :return: list of shards"""
+    assert len(variants) <= len(endpoints), 'One simulator instance is needed per variant'
+    return [dict(variant, ip=ip, port=port) for (ip, port), variant in zip(endpoints, variants)]
+
+
+def run_shard(shard, name_experiment, img_types, frames_to_capture, config_kwargs, worker_setup=None):
+    """ Capture of one shard, run in its own process
+    :param shard (dict): {'name', 'ip', 'port'} and optionally 'cameras', 'weather', 'day_time', 'settings_airsim'
+           name_experiment (str): common experiment, the shard is saved in name_experiment/<shard name>
+           config_kwargs (dict): Configuration parameters shared by every shard
+           worker_setup: function called with the shard before connecting to the simulator (optional)"""
+    if worker_setup is not None:
+        worker_setup(shard)
+    import airsim
+    import main_cv_fixed
+    from settings import Configuration
+    from client_pool import create_clients
+
+    start = time.time()
+    config = Configuration(img_types, frames_to_capture, 'start', name_experiment + '/' + shard['name'],
+                           cameras=shard.get('cameras'), settings_airsim=shard.get('settings_airsim'), **config_kwargs)
+    pool, clients, query_clients = create_clients(airsim.VehicleClient, config, shard['ip'], shard['port'])
+
+    if shard.get('weather') is not None:
+        type_weather, percentage = shard['weather']
+        config.set_weather(clients[0], type_weather, percentage)
+    if shard.get('day_time') is not None:
+        config.set_day_time(clients[0], shard['day_time'])
+
+    main_cv_fixed.CV_Capture(clients, config, frames_to_capture, query_clients)
+
+    info = {key: value for key, value in shard.items() if key != 'settings_airsim'}
+    info.update({'cameras': config.camera_names, 'frames': frames_to_capture, 'seconds': time.time() - start,
+                 'rpc': dict(pool.stats)})
+    with open(config.path_save + '/shard_info.json', 'w') as f:
+        json.dump(info, f)
+
+
+def merge_shards(path_experiment, shards, exit_codes=None):
+    """ Merge the ground truth of the shards: gt_merged/gt2d.npy and gt3d.npy with the shard (and camera) of each row,
+    and gt_merged/gt_index.json with the shards, their cameras and pedestrian names. The status of each shard is 'done',
+    'failed' (the rows saved before the failure are merged) or 'missing'
+    :param path_experiment (str): record_data/<name_experiment>
+           shards (list): shards of the capture
+           exit_codes (list int): exit code of the process of each shard, None to only check their shard_info.json
+    :return: index (dict)"""
+    from gt_store import ChunkedTable, GT2D_DTYPE, GT3D_DTYPE
+    from image_utils import check_path
+
+    gt2d_dtype = np.dtype([('shard', np.int16), ('camera', np.int16)] + GT2D_DTYPE.descr)
+    gt3d_dtype = np.dtype([('shard', np.int16)] + GT3D_DTYPE.descr)
+    index = {'shards': [], 'cameras': [], 'pedestrian_names': {}}
+    rows_2d, rows_3d = [np.empty(0, dtype=gt2d_dtype)], [np.empty(0, dtype=gt3d_dtype)]
+
+    for shard_id, shard in enumerate(shards):
+        path_shard = path_experiment + '/' + shard['name']
+        path_store = path_shard + '/gt_store'
+        info = {'name': shard['name'], 'status': 'missing'}
+        if os.path.exists(path_shard + '/shard_info.json'):
+            with open(path_shard + '/shard_info.json', 'r') as f:
+                info = json.load(f)
+            info['status'] = 'done'
+        if exit_codes is not None:
+            info['exit_code'] = exit_codes[shard_id]
+            if exit_codes[shard_id] != 0:
+                info['status'] = 'failed'
+        index['shards'].append(info)
+        if not os.path.exists(path_store + '/pedestrian_names.json'):
+            continue
+        with open(path_store + '/pedestrian_names.json', 'r') as f:
+            index['pedestrian_names'][shard['name']] = json.load(f)
+
+        gt3d = ChunkedTable(path_store, 'gt3d', GT3D_DTYPE, 1).load()
+        merged = np.zeros(len(gt3d), dtype=gt3d_dtype)
+        merged['shard'] = shard_id
+        for name in GT3D_DTYPE.names:
+            merged[name] = gt3d[name]
+        rows_3d.append(merged)
+
+        for cam in info.get('cameras', shard.get('cameras') or []):
+            if cam not in index['cameras']:
+                index['cameras'].append(cam)
+            gt2d = ChunkedTable(path_store, 'gt2d_' + cam, GT2D_DTYPE, 1).load()
+            merged = np.zeros(len(gt2d), dtype=gt2d_dtype)
+            merged['shard'] = shard_id
+            merged['camera'] = index['cameras'].index(cam)
+            for name in GT2D_DTYPE.names:
+                merged[name] = gt2d[name]
+            rows_2d.append(merged)
+
+    path_merged = path_experiment + '/gt_merged'
+    check_path(path_merged)
+    np.save(path_merged + '/gt2d.npy', np.concatenate(rows_2d))
+    np.save(path_merged + '/gt3d.npy', np.concatenate(rows_3d))
+    with open(path_merged + '/gt_index.json', 'w') as f:
+        json.dump(index, f)
+    return index
+
+
+def run_shards(shards, name_experiment, img_types, frames_to_capture, worker_setup=None, **config_kwargs):
+    """ Run every shard in its own process and merge their ground truth
+    :param shards (list): see camera_shards and variant_shards
+           name_experiment (str), img_types (str), frames_to_capture (int): as CV_Capture
+           worker_setup: function called in each shard process before connecting to the simulator (optional)
+           config_kwargs: Configuration parameters shared by every shard
+    :return: index (dict), see merge_shards"""
+    names = [shard['name'] for shard in shards]
+    assert len(set(names)) == len(names), 'Shard names must be unique'
+
+    path_experiment = os.path.join(os.getcwd(), 'record_data/' + name_experiment)
+    context = multiprocessing.get_context('spawn')
+    processes = []
+    for shard in shards:
+        # Written when the shard finishes: the one of a previous capture would mark a failed shard as done
+        path_info = path_experiment + '/' + shard['name'] + '/shard_info.json'
+        if os.path.exists(path_info):
+            os.remove(path_info)
+        process = context.Process(target=run_shard, name='shard-' + shard['name'],
+                                  args=(shard, name_experiment, img_types, frames_to_capture, config_kwargs, worker_setup))
+        process.start()
+        processes.append(process)
+
+    for shard, process in zip(shards, processes):
+        process.join()
+        if process.exitcode != 0:
+            print('-> Shard {} ({}:{}) failed with exit code {}'.format(shard['name'], shard['ip'], shard['port'], process.exitcode))
+
+    index = merge_shards(path_experiment, shards, [process.exitcode for process in processes])
+    print('-> Shards merged in {}'.format(path_experiment + '/gt_merged'))
+    return index
+
+
+if __name__ == "__main__":
+    # Settings
+    name_experiment = 'SHARDED'
+    img_types = 'RGB-D'  # 'RGB', 'RGB-D', 'RGB-DS'
+    frames_to_capture = 500
+    endpoints = [('127.0.0.1', 41451), ('127.0.0.1', 41452)]  # one Unreal instance per port (ApiServerPort in settings.json)
+
+    # Disjoint cameras per simulator instance
+    camera_names = ['cam1', 'cam2', 'cam3', 'cam4']
+    shards = camera_shards(camera_names, endpoints)
+    # Or the same cameras under different conditions:
+    # shards = variant_shards(endpoints, [{'name': 'sunny', 'day_time': '2018-02-12 12:00:00'},
+    #                                     {'name': 'fog', 'weather': ('fog', 0.3)}])
+
+    run_shards(shards, name_experiment, img_types, frames_to_capture)
@@ -0,0 +1,60 @@
+import time
+
+
+class SimClock:
+    """
+    Synchronized capture: the simulation stays paused while the images of every camera and the pedestrian poses of a
+    frame are requested, so all of them share one sim timestamp, and then advances a fixed step of sim time
+    (simContinueForTime, which pauses the simulation again when the step is over). The capture is no longer real time:
+    slower when the frames take longer to capture than the step, faster when the scene renders quickly.
+    """
+
+    def __init__(self, client, step, timeout=60., poll_interval=0.002):
+        """
+        :param client: airsim client used to control the simulation
+               step (float): sim seconds between frames
+               timeout (float): seconds to wait for the simulation to pause after a step
+               poll_interval (float): seconds between simIsPause requests"""
+        self.client = client
+        self.step = step
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.steps = 0
+        self.start_wall = None
+
+    def wait_paused(self):
+        """Wait until the simulation is paused"""
+        start = time.perf_counter()
+        while not self.client.simIsPause():
+            if time.perf_counter() - start > self.timeout:
+                raise TimeoutError('Simulation not paused {} s after a step of {} s'.format(self.timeout, self.step))
+            time.sleep(self.poll_interval)
+
+    def start(self):
+        """Pause the simulation before the first frame"""
+        self.client.simPause(True)
+        self.wait_paused()
+        self.start_wall = time.perf_counter()
+
+    def advance(self):
+        """Advance the simulation one step, returns when it is paused again"""
+        self.client.simContinueForTime(self.step)
+        self.wait_paused()
+        self.steps += 1
+
+    def sim_time(self):
+        """:return: sim seconds since start"""
+        return self.steps * self.step
+
+    def stop(self):
+        """Let the simulation run in real time again"""
+        self.client.simPause(False)
+
+    def speed(self):
+        """:return: sim seconds captured per wall second (above 1: faster than real time)"""
+        if self.start_wall is None or self.steps == 0:
+            return 0.
+        return self.steps * self.step / (time.perf_counter() - self.start_wall)
+
+    def format_stats(self):
+        return 'sync {} steps of {:.3f} s, x{:.2f} real time'.format(self.steps, self.step, self.speed())
@@ -0,0 +1,74 @@
+import numpy as np
+
+from geometry_utils import OVERPERCENT_FEET
+
+# Margin added to the frustum: half width of the pedestrian cylinder and its height above the pose
+FRUSTUM_MARGIN = 2.
+PEDESTRIAN_HEIGHT = 1.75
+# Smallest bbox side kept by check_bbox in pixels
+MIN_BBOX_SIZE = 2
+
+
+class PedestrianGrid:
+    """
+    Uniform grid over the ground plane (x, y) of the pedestrians of one frame. Built once per frame and queried for
+    every camera: only the cells under the view frustum of the camera are visited and their pedestrians tested against
+    the frustum planes, so the cost depends on the pedestrians near the view of the camera, not on the crowd size.
+    """
+
+    def __init__(self, info_gt3d_pedestrians, cell_size=10.):
+        """
+        :param info_gt3d_pedestrians (list): [{'id': name_pedestrian, 'pos_x': x, 'pos_y': y, 'pos_z': z, ...}, ...]
+               cell_size (float): meters"""
+        self.info = info_gt3d_pedestrians
+        self.cell_size = cell_size
+        self.positions = np.array([[info['pos_x'], info['pos_y'], info['pos_z']] for info in info_gt3d_pedestrians],
+                                  dtype=np.float64).reshape(-1, 3)
+
+        # Pedestrians sorted by cell, each cell is a slice of self.order
+        cells = np.floor(self.positions[:, :2] / cell_size).astype(np.int64)
+        self.origin = cells.min(axis=0) if len(cells) else np.zeros(2, dtype=np.int64)
+        self.shape = (cells.max(axis=0) - self.origin + 1) if len(cells) else np.ones(2, dtype=np.int64)
+        keys = (cells[:, 0] - self.origin[0]) * self.shape[1] + (cells[:, 1] - self.origin[1])
+        self.order = np.argsort(keys, kind='stable')
+        self.keys = keys[self.order]
+
+    def query_box(self, xy_min, xy_max):
+        """ Pedestrians in the cells overlapping a box of the ground plane
+        :return: array of indexes in info_gt3d_pedestrians"""
+        cell_min = np.maximum(np.floor(np.asarray(xy_min) / self.cell_size).astype(np.int64) - self.origin, 0)
+        cell_max = np.minimum(np.floor(np.asarray(xy_max) / self.cell_size).astype(np.int64) - self.origin, self.shape - 1)
+        if len(self.keys) == 0 or np.any(cell_max < cell_min):
+            return np.empty(0, dtype=np.int64)
+
+        # One contiguous range of keys per grid row (x)
+        rows = np.arange(cell_min[0], cell_max[0] + 1)
+        starts = np.searchsorted(self.keys, rows * self.shape[1] + cell_min[1], side='left')
+        ends = np.searchsorted(self.keys, rows * self.shape[1] + cell_max[1], side='right')
+        if len(rows) == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([self.order[start:end] for start, end in zip(starts, ends)])
+
+    def candidates(self, camera_model, width, height, margin=FRUSTUM_MARGIN, far=None, min_height=None):
+        """ Pedestrians that can appear in the image of a camera
+        :param camera_model: CameraModel
+               width, height (int): frame size
+               margin (float): meters the frustum is enlarged
+               far (float): farthest distance in meters, by default the distance where the reprojected bbox of a
+                            pedestrian is always shorter than min_height
+               min_height (int): pixels, pedestrians farther away are dropped (1 pixel of margin for the truncation of
+                                 the bbox coordinates). None is MIN_BBOX_SIZE: every bbox that check_bbox accepts is
+                                 kept, but the far plane of a 1280 px, 90 degrees camera is then at 1.2 km and the grid
+                                 hardly prunes. Larger values lose the farthest pedestrians of the ground truth
+        :return: list of dict, subset of info_gt3d_pedestrians in the same order"""
+        if min_height is None:
+            min_height = MIN_BBOX_SIZE
+        if far is None:
+            far = camera_model.focal_length_px(width) * PEDESTRIAN_HEIGHT * (1 + OVERPERCENT_FEET) / (min_height - 1)
+        corners = camera_model.frustum_corners(width, height, far + margin)
+        indexes = self.query_box(corners[:, :2].min(axis=0) - margin, corners[:, :2].max(axis=0) + margin)
+        if len(indexes) == 0:
+            return []
+        indexes = np.sort(indexes)
+        inside = camera_model.in_frustum(self.positions[indexes], width, height, margin, far)
+        return [self.info[i] for i in indexes[inside]]
@@ -0,0 +1,57 @@
+import json
+import numpy as np
+
+from record_log import RecordLog
+
+# One record per frame and drone: the drone (AirSimLocal) and its camera poses, quaternions as w, x, y, z
+STATE_DTYPE = np.dtype([('frame', np.int32), ('timestamp', np.uint64), ('focal_length', np.float64), ('f_fov', np.float64),
+                        ('drone_pos_x', np.float64), ('drone_pos_y', np.float64), ('drone_pos_z', np.float64),
+                        ('drone_orient_w', np.float64), ('drone_orient_x', np.float64), ('drone_orient_y', np.float64), ('drone_orient_z', np.float64),
+                        ('cam_pos_x', np.float64), ('cam_pos_y', np.float64), ('cam_pos_z', np.float64),
+                        ('cam_orient_w', np.float64), ('cam_orient_x', np.float64), ('cam_orient_y', np.float64), ('cam_orient_z', np.float64)])
+
+STATE_FILE = 'states.bin'
+POSE_COLUMNS = ('pos_x', 'pos_y', 'pos_z', 'orient_w', 'orient_x', 'orient_y', 'orient_z')
+
+
+def load_states(path, mmap=False):
+    """ States of a drone
+    :param path (str): drone folder of the experiment
+           mmap (bool): memory map the file instead of reading it
+    :return: structured array of STATE_DTYPE"""
+    return RecordLog.load(path + '/' + STATE_FILE, mmap)
+
+
+def trajectory(states, prefix='cam'):
+    """ Vectorized trajectory of the drone or its camera
+    :param states: structured array given by load_states
+           prefix (str): 'cam' or 'drone'
+    :return: frames: array N
+             positions: array N X 3
+             quaternions: array N X 4 (w, x, y, z)"""
+    positions = np.stack([states[prefix + '_pos_' + axis] for axis in 'xyz'], axis=1)
+    quaternions = np.stack([states[prefix + '_orient_' + axis] for axis in 'wxyz'], axis=1)
+    return np.asarray(states['frame']), positions, quaternions
+
+
+def states_to_dicts(states, prefix='cam'):
+    """ States in the layout of the legacy state_info.json (prefix 'drone') and state_cam_info.json (prefix 'cam')
+    :return: list of dict = {'frame_index', 'focal_length', ('f_fov',) 'pos_x', ..., 'orient_z'}"""
+    info_states = []
+    for state in states:
+        info_state = {'frame_index': int(state['frame']), 'focal_length': float(state['focal_length'])}
+        if prefix == 'cam':
+            info_state['f_fov'] = float(state['f_fov'])
+        info_state.update({column: float(state[prefix + '_' + column]) for column in POSE_COLUMNS})
+        info_states.append(info_state)
+    return info_states
+
+
+def export_states_json(path):
+    """ Write state_info.json and state_cam_info.json of a drone folder from its state log
+    :param path (str): drone folder of the experiment"""
+    states = load_states(path)
+    with open(path + '/state_info.json', 'w') as f:
+        json.dump(states_to_dicts(states, 'drone'), f)
+    with open(path + '/state_cam_info.json', 'w') as f:
+        json.dump(states_to_dicts(states, 'cam'), f)
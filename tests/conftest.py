@@ -0,0 +1,19 @@
+import os
+import sys
+import shutil
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Every test runs against the simulated AirSim of mock_airsim, registered before the project modules import airsim
+import mock_airsim
+mock_airsim.install()
+
+
+@pytest.fixture
+def capture_dir(tmp_path, monkeypatch):
+    """Working directory of a capture: record_data/ and color_to_pedestrian.json are written in it"""
+    shutil.copy(os.path.join(ROOT, 'segmentation_rgb.txt'), str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
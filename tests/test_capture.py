@@ -0,0 +1,83 @@
+import os
+import json
+import numpy as np
+import pytest
+
+import airsim
+import mock_airsim
+import main_cv_fixed
+import main_cv_movable
+from settings import Configuration
+from client_pool import create_clients
+from gt_store import ChunkedTable, FRAME_DTYPE, GT3D_DTYPE
+from depth_store import DepthReader
+
+NUMBER_FRAMES = 6
+
+
+def fixed_capture(number_frames, name_experiment, **kwargs):
+    world = mock_airsim.configure(number_cameras=2, number_pedestrians=8, width=160, height=120)
+    config = Configuration('RGB-DS', number_frames, 'start', name_experiment, settings_airsim=world.settings, **kwargs)
+    pool, clients, client_queries = create_clients(airsim.VehicleClient, config)
+    main_cv_fixed.CV_Capture(clients, config, number_frames, client_queries)
+    return config
+
+
+def saved_frames(config):
+    return ChunkedTable(config.path_save + '/gt_store', 'frames', FRAME_DTYPE, 1).load()['frame']
+
+
+def test_fixed_cameras(capture_dir):
+    config = fixed_capture(NUMBER_FRAMES, 'FIXED')
+    assert sorted(saved_frames(config)) == list(range(NUMBER_FRAMES))
+    for cam in config.camera_names:
+        for folder in ('Frames', 'Depth', 'Segmentation'):
+            assert len(os.listdir(config.path_save + '/' + cam + '/' + folder)) == NUMBER_FRAMES
+        with open(config.path_save + '/' + cam + '/gt2d_pedestrians.json', 'r') as f:
+            assert len(json.load(f)) > 0
+    assert os.path.exists(config.path_save + '/gt3d_pedestrians.json')
+
+
+def test_drones(capture_dir):
+    world = mock_airsim.configure(number_cameras=0, number_drones=1, number_pedestrians=8, width=160, height=120)
+    uavs = main_cv_movable.InitDrones(0.3, world.settings)
+    config = Configuration('RGB-D', NUMBER_FRAMES, 'start', 'DRONES', external=False, uavs=uavs,
+                           settings_airsim=world.settings)
+    pool, clients, client_queries = create_clients(airsim.MultirotorClient, config)
+    main_cv_movable.CV_Capture(clients, uavs, config, NUMBER_FRAMES, client_queries)
+
+    assert sorted(saved_frames(config)) == list(range(NUMBER_FRAMES))
+    for cam in config.camera_names:
+        assert len(os.listdir(config.path_save + '/' + cam + '/Frames')) == NUMBER_FRAMES
+    assert os.path.exists(config.path_save + '/Drone1/state_info.json')
+
+
+def test_resume_rollback(capture_dir, monkeypatch):
+    """A capture interrupted after its checkpoint is resumed without duplicated or missing frames"""
+    options = dict(pipelined=True, depth_storage='chunked', depth_chunk_frames=4, checkpoint_every=5, gt_chunk_size=7)
+    update_gt3d_pedestrian = main_cv_fixed.update_gt3d_pedestrian
+
+    def crash(info_pedestrians, captured, gt3d, key):
+        if int(key) == 8:
+            raise KeyboardInterrupt('crash')
+        return update_gt3d_pedestrian(info_pedestrians, captured, gt3d, key)
+
+    monkeypatch.setattr(main_cv_fixed, 'update_gt3d_pedestrian', crash)
+    with pytest.raises(KeyboardInterrupt):
+        fixed_capture(12, 'RESUME', **options)
+    with open('record_data/RESUME/checkpoint.json', 'r') as f:
+        assert json.load(f)['frame_index'] == 4
+
+    monkeypatch.setattr(main_cv_fixed, 'update_gt3d_pedestrian', update_gt3d_pedestrian)
+    config = fixed_capture(12, 'RESUME', resume=True, **options)
+
+    frames = saved_frames(config)
+    assert sorted(frames) == list(range(12))
+    gt3d = ChunkedTable(config.path_save + '/gt_store', 'gt3d', GT3D_DTYPE, 1).load()
+    assert len(np.unique(gt3d[['frame', 'id']])) == len(gt3d)
+    for cam in config.camera_names:
+        depth = DepthReader(config.path_save + '/' + cam + '/Depth')
+        assert list(depth.frames) == list(range(12))
+        for folder in ('Frames', 'Segmentation'):
+            prefixes = sorted(int(name.split('_')[0]) for name in os.listdir(config.path_save + '/' + cam + '/' + folder))
+            assert prefixes == list(range(12))
@@ -0,0 +1,24 @@
+import numpy as np
+
+from image_encoder import SegmentationPalette
+
+
+def test_segmentation_palette_round_trip():
+    rng = np.random.default_rng(0)
+    # Unique colors, as the ones of segmentation_rgb.txt
+    packed = rng.choice(2 ** 24, 256, replace=False)
+    color_dict = {i: [int(c >> 16), int(c >> 8 & 255), int(c & 255)] for i, c in enumerate(packed)}
+    palette = SegmentationPalette(color_dict)
+
+    ids = np.array(sorted(color_dict))
+    index = rng.choice(ids, (48, 64)).astype(np.uint8)
+    segmentation = palette.to_color(index)
+    assert segmentation.shape == (48, 64, 3)
+    np.testing.assert_array_equal(segmentation[0, 0], color_dict[int(index[0, 0])][::-1])
+    np.testing.assert_array_equal(palette.to_index(segmentation), index)
+
+
+def test_unknown_colors_to_background():
+    palette = SegmentationPalette({0: [0, 0, 0], 1: [10, 20, 30], 2: [200, 100, 50]})
+    segmentation = np.array([[[30, 20, 10], [1, 2, 3], [50, 100, 200]]], dtype=np.uint8)
+    np.testing.assert_array_equal(palette.to_index(segmentation), [[1, 0, 2]])
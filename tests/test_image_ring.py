@@ -0,0 +1,60 @@
+import os
+import numpy as np
+import pytest
+
+from image_ring import ImageRing, ImagePublisher, ImageSubscriber, ring_name
+
+PREFIX = 'pedtest{}'.format(os.getpid())
+
+
+def images(frame_index, height=12, width=16):
+    return {'timestamp': 1000 + frame_index,
+            'rgb': np.full((height, width, 3), frame_index, dtype=np.uint8),
+            'depth': np.full((height, width, 1), frame_index * 10., dtype=np.float32)}
+
+
+@pytest.fixture
+def publisher():
+    publisher = ImagePublisher(['cam1'], prefix=PREFIX, slots=4)
+    yield publisher
+    publisher.close()
+
+
+def test_ring_write_read(publisher):
+    publisher.publish(0, {'cam1': images(0)})
+    ring = ImageRing.attach(ring_name(PREFIX, 'cam1'))
+    assert 'segmentation' not in ring.layout
+
+    frame = ring.read(0)
+    assert frame['frame_index'] == 0 and frame['timestamp'] == 1000
+    np.testing.assert_array_equal(frame['rgb'], images(0)['rgb'])
+    np.testing.assert_array_equal(frame['depth'], images(0)['depth'])
+
+    for frame_index in range(1, 6):
+        publisher.publish(frame_index, {'cam1': images(frame_index)})
+    # Overwritten slots
+    assert ring.read(0) is None
+    assert ring.view(1) == (None, None)
+    sequence, frame = ring.view(5)
+    assert frame['frame_index'] == 5 and int(frame['rgb'][0, 0, 0]) == 5
+    assert ring.valid(5, sequence)
+    del frame
+    ring.close()
+
+
+def test_subscriber_reads_every_frame(publisher):
+    publisher.publish(0, {'cam1': images(0)})
+    subscriber = ImageSubscriber('cam1', prefix=PREFIX, timeout=1.)
+    # Attached after the first frame: it still gets frame 0
+    for frame_index in range(1, 3):
+        publisher.publish(frame_index, {'cam1': images(frame_index)})
+    assert [subscriber.next_frame(timeout=0)['frame_index'] for _ in range(3)] == [0, 1, 2]
+    assert subscriber.next_frame(timeout=0) is None
+
+    # Too far behind: the oldest frames are skipped
+    for frame_index in range(3, 10):
+        publisher.publish(frame_index, {'cam1': images(frame_index)})
+    assert subscriber.next_frame(timeout=0)['frame_index'] == 7
+    assert subscriber.skipped == 4
+    assert subscriber.latest()['frame_index'] == 9
+    subscriber.close()
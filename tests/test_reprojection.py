@@ -0,0 +1,21 @@
+import numpy as np
+
+from reprojection import check_bbox, check_bboxes
+
+WIDTH, HEIGHT = 640, 480
+
+
+def test_check_bboxes_matches_check_bbox():
+    rng = np.random.default_rng(0)
+    corners = rng.uniform(-200, 900, (2000, 2))
+    sizes = rng.uniform(0, 300, (2000, 2))
+    bboxes = np.concatenate([corners, corners + sizes], axis=1)
+    # Boxes on the borders of the frame and smaller than 2 pixels
+    bboxes[:4] = [[-10, 0, 0, 50], [WIDTH, 10, WIDTH + 5, 20], [10, -5, 11.5, 40], [0, 0, WIDTH, HEIGHT]]
+
+    check, adapted = check_bboxes(bboxes, WIDTH, HEIGHT)
+    for i, bbox in enumerate(bboxes):
+        expected = check_bbox(*bbox, WIDTH, HEIGHT)
+        assert check[i] == expected[0]
+        if expected[0]:
+            np.testing.assert_array_equal(adapted[i], expected[1:])
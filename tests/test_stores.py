@@ -0,0 +1,75 @@
+import numpy as np
+
+from record_log import RecordLog
+from depth_store import DepthStore, DepthReader
+
+DTYPE = np.dtype([('frame', np.int32), ('timestamp', np.uint64), ('value', np.float64)])
+
+
+def test_record_log_round_trip(tmp_path):
+    path = str(tmp_path / 'log.bin')
+    log = RecordLog(path, DTYPE)
+    records = np.array([(i, 1000 + i, i / 10) for i in range(10)], dtype=DTYPE)
+    log.append(records[:9])
+    log.append(tuple(records[9]))
+    log.close()
+
+    np.testing.assert_array_equal(RecordLog.load(path), records)
+    np.testing.assert_array_equal(RecordLog.load(path, mmap=True), records)
+    assert RecordLog.load_dtype(path) == DTYPE
+
+
+def test_record_log_drops_partial_record(tmp_path):
+    path = str(tmp_path / 'log.bin')
+    log = RecordLog(path, DTYPE)
+    log.append(np.array([(i, i, i) for i in range(3)], dtype=DTYPE))
+    log.file.write(b'\x01' * (DTYPE.itemsize // 2))
+    log.close()
+    assert len(RecordLog.load(path)) == 3
+
+    log = RecordLog(path, DTYPE)
+    assert len(log) == 3
+    log.append((3, 3, 3.))
+    log.truncate(2)
+    log.append((4, 4, 4.))
+    log.close()
+    assert list(RecordLog.load(path)['frame']) == [0, 1, 4]
+
+
+def test_depth_store_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    depths = [rng.uniform(0, 70000, (24, 32, 1)) for _ in range(7)]
+    for compression in (0, 1):
+        path_save = str(tmp_path / 'level{}'.format(compression))
+        store = DepthStore(path_save, ['cam1'], chunk_frames=3, compression=compression)
+        for frame_index, depth in enumerate(depths):
+            store.append('cam1', frame_index, 100 + frame_index, depth)
+        store.close()
+
+        reader = DepthReader(path_save + '/cam1/Depth')
+        assert len(reader) == len(depths)
+        for frame_index, depth in reader:
+            expected = np.rint(np.clip(depths[frame_index][:, :, 0], 0, 65535)).astype(np.uint16)
+            np.testing.assert_array_equal(depth, expected)
+            assert reader.timestamp(frame_index) == 100 + frame_index
+
+
+def test_depth_store_truncate(tmp_path):
+    path_save = str(tmp_path)
+    depth = np.full((8, 8), 1234.)
+    store = DepthStore(path_save, ['cam1'], chunk_frames=3)
+    for frame_index in range(8):
+        store.append('cam1', frame_index, frame_index, depth + frame_index)
+    store.close()
+
+    # Resume after frame 4
+    store = DepthStore(path_save, ['cam1'], chunk_frames=3, append=True)
+    store.truncate({'cam1': 5})
+    for frame_index in range(5, 7):
+        store.append('cam1', frame_index, frame_index, depth - frame_index)
+    store.close()
+
+    reader = DepthReader(path_save + '/cam1/Depth')
+    assert list(reader.frames) == list(range(7))
+    assert reader.get(4)[0, 0] == 1238
+    assert reader.get(6)[0, 0] == 1228
@@ -0,0 +1,154 @@
+import airsim
+import numpy as np
+
+from pedestrians import pose_to_info
+
+
+def quaternion_dot(q0, q1):
+    return np.sum(q0 * q1, axis=1)
+
+
+def slerp(q0, q1, u):
+    """ Vectorized spherical linear interpolation of quaternions, extrapolation when u > 1
+    :param q0, q1: arrays N X 4 (w, x, y, z) unit quaternions
+           u: array N, 0 gives q0 and 1 gives q1
+    :return: array N X 4"""
+    dot = quaternion_dot(q0, q1)
+    # Shortest path: q and -q are the same rotation
+    q1 = np.where(dot[:, None] < 0, -q1, q1)
+    theta = np.arccos(np.clip(np.abs(dot), -1., 1.))
+    sin_theta = np.sin(theta)
+    small = sin_theta < 1e-6
+    with np.errstate(divide='ignore', invalid='ignore'):
+        w0 = np.where(small, 1 - u, np.sin((1 - u) * theta) / sin_theta)
+        w1 = np.where(small, u, np.sin(u * theta) / sin_theta)
+    q = w0[:, None] * q0 + w1[:, None] * q1
+    return q / np.linalg.norm(q, axis=1)[:, None]
+
+
+def quaternion_angle(q0, q1):
+    """:return: array N rotation in degrees between the quaternions"""
+    return np.degrees(2 * np.arccos(np.clip(np.abs(quaternion_dot(q0, q1)), 0., 1.)))
+
+
+class PoseTrajectories:
+    """
+    Pedestrian poses without one simGetObjectPose per pedestrian and frame: each pedestrian is queried every
+    interval frames (1 up to sampling_factor) and its pose in the frames between is extrapolated from its last two
+    samples, positions at constant velocity and orientations with slerp. Every sample is compared with the prediction
+    for it: an error above error_bound meters (or angle_bound degrees) sets the interval of the pedestrian back to 1,
+    an error below a quarter of the bound (extrapolation errors grow with the square of the time) doubles it. Samples
+    are spread over the frames so that each one queries about 1 / sampling_factor of the crowd.
+
+    Poses are extrapolated and not interpolated between samples because the ground truth of a frame is saved with
+    its images, before the next samples exist. Each pose is flagged with 'predicted' (0 requested, 1 extrapolated),
+    saved in the ground truth tables.
+    """
+
+    def __init__(self, name_pedestrians, sampling_factor=4, error_bound=0.05, angle_bound=5.):
+        """
+        :param name_pedestrians (list str): pedestrians of the scene
+               sampling_factor (int): maximum frames between two queries of a pedestrian
+               error_bound (float): meters
+               angle_bound (float): degrees"""
+        assert sampling_factor >= 1, 'pose_sampling_factor must be at least 1'
+        self.name_pedestrians = list(name_pedestrians)
+        self.index = {name: i for i, name in enumerate(self.name_pedestrians)}
+        self.sampling_factor = sampling_factor
+        self.error_bound = error_bound
+        self.angle_bound = angle_bound
+
+        n = len(self.name_pedestrians)
+        self.samples = np.zeros(n, dtype=np.int64)
+        self.time = np.zeros(n)
+        self.prev_time = np.zeros(n)
+        self.position = np.zeros((n, 3))
+        self.prev_position = np.zeros((n, 3))
+        self.orientation = np.tile([1., 0., 0., 0.], (n, 1))
+        self.prev_orientation = self.orientation.copy()
+        self.interval = np.ones(n, dtype=np.int64)
+        self.next_frame = np.zeros(n, dtype=np.int64)
+
+        self.stats = {'frames': 0, 'queried': 0, 'predicted': 0, 'corrections': 0}
+
+    def to_query(self, frame_index):
+        """:return: list str pedestrians whose pose has to be requested in this frame"""
+        return [self.name_pedestrians[i] for i in np.flatnonzero(self.next_frame <= frame_index)]
+
+    def predict(self, idx, t):
+        """ Extrapolated poses at time t
+        :param idx: array K pedestrian indexes
+               t (float): seconds, in the clock of the samples
+        :return: positions: array K X 3
+                 orientations: array K X 4 (w, x, y, z)"""
+        position, orientation = self.position[idx].copy(), self.orientation[idx].copy()
+        moving = self.samples[idx] >= 2
+        if np.any(moving):
+            m = idx[moving]
+            dt = self.time[m] - self.prev_time[m]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                u = np.where(dt > 0, 1 + (t - self.time[m]) / dt, 1.)
+            position[moving] = self.prev_position[m] + (self.position[m] - self.prev_position[m]) * u[:, None]
+            orientation[moving] = slerp(self.prev_orientation[m], self.orientation[m], u)
+        return position, orientation
+
+    def update(self, frame_index, t, info_pedestrians_3d):
+        """ Add the poses requested in a frame and schedule the next query of each pedestrian
+        :param frame_index (int)
+               t (float): seconds when the poses were requested
+               info_pedestrians_3d (list): [{'id': name_pedestrian, 'pos_x': x, ...}, ...] given by pose_to_info"""
+        if len(info_pedestrians_3d) == 0:
+            return
+        idx = np.array([self.index[info['id']] for info in info_pedestrians_3d])
+        position = np.array([[info['pos_x'], info['pos_y'], info['pos_z']] for info in info_pedestrians_3d])
+        orientation = np.array([[info['orient_w'], info['orient_x'], info['orient_y'], info['orient_z']]
+                                for info in info_pedestrians_3d])
+
+        # Error of the model in the samples that it predicted
+        interval = np.ones(len(idx), dtype=np.int64)
+        checked = self.samples[idx] >= 2
+        if np.any(checked):
+            predicted_position, predicted_orientation = self.predict(idx[checked], t)
+            error = np.linalg.norm(predicted_position - position[checked], axis=1)
+            angle = quaternion_angle(predicted_orientation, orientation[checked])
+            exceeded = (error > self.error_bound) | (angle > self.angle_bound)
+            accurate = (error < self.error_bound / 4) & (angle < self.angle_bound / 4)
+            current = self.interval[idx[checked]]
+            interval[checked] = np.where(exceeded, 1, np.where(accurate, np.minimum(current * 2, self.sampling_factor), current))
+            self.stats['corrections'] += int(exceeded.sum())
+
+        self.prev_time[idx], self.time[idx] = self.time[idx], t
+        self.prev_position[idx], self.position[idx] = self.position[idx], position
+        self.prev_orientation[idx], self.orientation[idx] = self.orientation[idx], orientation
+        self.samples[idx] += 1
+
+        # Next frame multiple of the interval shifted by the pedestrian index, to spread the queries over the frames
+        self.interval[idx] = interval
+        first = frame_index + 1
+        self.next_frame[idx] = first + (interval - (first + idx) % interval) % interval
+
+    def complete(self, frame_index, t, info_pedestrians_3d):
+        """ Poses of every pedestrian in a frame: the ones requested and the predicted ones
+        :param info_pedestrians_3d (list): poses requested for to_query(frame_index)
+        :return: info_pedestrians_3d (list): [{'id': name_pedestrian, 'pos_x': x, ..., 'predicted': 0 or 1}, ...] in
+                                             name_pedestrians order"""
+        self.update(frame_index, t, info_pedestrians_3d)
+        queried = {info['id']: dict(info, predicted=0) for info in info_pedestrians_3d}
+        missing = np.array([i for i, name in enumerate(self.name_pedestrians) if name not in queried], dtype=np.int64)
+        self.stats['frames'] += 1
+        self.stats['queried'] += len(queried)
+        self.stats['predicted'] += len(missing)
+
+        if len(missing) > 0:
+            position, orientation = self.predict(missing, t)
+            for k, i in enumerate(missing.tolist()):
+                w, x, y, z = orientation[k].tolist()
+                pose = airsim.Pose(airsim.Vector3r(*position[k].tolist()), airsim.Quaternionr(x, y, z, w))
+                queried[self.name_pedestrians[i]] = dict(pose_to_info(self.name_pedestrians[i], pose), predicted=1)
+        return [queried[name] for name in self.name_pedestrians]
+
+    def format_stats(self):
+        total = self.stats['queried'] + self.stats['predicted']
+        return 'poses {} queried, {} predicted (x{:.2f} fewer requests), {} corrections'.format(
+            self.stats['queried'], self.stats['predicted'], total / max(self.stats['queried'], 1), self.stats['corrections'])
+
@@ -0,0 +1,192 @@
+"""
+Visualization process fed through shared memory. Kept apart from Visualization.py (and airsim) so that the spawned
+process only imports OpenCV and NumPy.
+"""
+import cv2
+import math
+import time
+import multiprocessing
+import numpy as np
+
+from multiprocessing import shared_memory
+
+# Boxes per camera sent to the visualization process
+MAX_BOXES = 512
+
+
+def grid_shape(number_cameras):
+    """ Rows and columns of the grid of tiles
+    :return: rows, cols"""
+    cols = int(math.ceil(math.sqrt(number_cameras)))
+    rows = int(math.ceil(number_cameras / cols))
+    return rows, cols
+
+
+def shared_layout(number_cameras, tile_height, tile_width):
+    """ Arrays of the shared memory block: header [sequence, frame_index], tiles, boxes [id, xmin, ymin, xmax, ymax]
+    (in tile pixels) and number of boxes of each camera
+    :return: list of (name, shape, dtype, offset), size in bytes"""
+    arrays = [('header', (2,), np.int64),
+              ('tiles', (number_cameras, tile_height, tile_width, 3), np.uint8),
+              ('boxes', (number_cameras, MAX_BOXES, 5), np.float32),
+              ('counts', (number_cameras,), np.int32)]
+    layout, offset = [], 0
+    for name, shape, dtype in arrays:
+        layout.append((name, shape, dtype, offset))
+        offset += int(np.prod(shape)) * np.dtype(dtype).itemsize
+        offset += -offset % 64
+    return layout, offset
+
+
+def map_shared(buffer, layout):
+    """:return: dict name = array view of the shared memory buffer"""
+    return {name: np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset) for name, shape, dtype, offset in layout}
+
+
+def compose_grid(tiles, boxes, counts, cameras, frame_index):
+    """ Draw the boxes on the tiles and place them in a grid
+    :param tiles: array N X h X w X 3, boxes: array N X MAX_BOXES X 5, counts: array N
+    :return: array rows*h X cols*w X 3"""
+    number_cameras, tile_height, tile_width = tiles.shape[:3]
+    rows, cols = grid_shape(number_cameras)
+    grid = np.zeros((rows * tile_height, cols * tile_width, 3), dtype=np.uint8)
+    for i, cam in enumerate(cameras):
+        tile = grid[(i // cols) * tile_height:(i // cols + 1) * tile_height, (i % cols) * tile_width:(i % cols + 1) * tile_width]
+        tile[:] = tiles[i]
+        for identity, xmin, ymin, xmax, ymax in boxes[i, :counts[i]].astype(int).tolist():
+            cv2.rectangle(tile, (xmin, ymin), (xmax, ymax), (255, 255, 255), 1)
+            cv2.putText(tile, str(identity), (xmin, max(ymin - 2, 8)), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 0, 255), 1)
+        cv2.putText(tile, str(cam), (5, tile_height - 8), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 0, 0), 1)
+    cv2.putText(grid, str(frame_index), (5, 15), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1)
+    return grid
+
+
+def run_viewer(shm_name, layout, cameras, lock, new_frame, stop, video_path=None, fps=10):
+    """ Visualization process: shows (or writes to video_path when headless) the last frame published
+    :param shm_name (str): shared memory block written by VisualizationProcess.publish
+           lock, new_frame, stop: multiprocessing Lock and Events
+           video_path (str): mp4 file, None to show a window"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    arrays = map_shared(shm.buf, layout)
+    writer = None
+    try:
+        while not stop.is_set():
+            if not new_frame.wait(0.1):
+                if video_path is None:
+                    cv2.waitKey(1)
+                continue
+            with lock:
+                new_frame.clear()
+                frame_index = int(arrays['header'][1])
+                tiles = arrays['tiles'].copy()
+                boxes = arrays['boxes'].copy()
+                counts = arrays['counts'].copy()
+            grid = compose_grid(tiles, boxes, counts, cameras, frame_index)
+
+            if video_path is None:
+                cv2.imshow('Frames', grid)
+                cv2.waitKey(1)
+                continue
+            if writer is None:
+                writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (grid.shape[1], grid.shape[0]))
+            writer.write(grid)
+    finally:
+        if writer is not None:
+            writer.release()
+        if video_path is None:
+            cv2.destroyAllWindows()
+        del arrays
+        shm.close()
+
+
+class VisualizationProcess:
+    """
+    Visualization in its own process, so that drawing, compositing and showing the frames never stalls the capture.
+    publish() downsamples the rgb image of each camera to a tile and copies it with the 2d boxes to shared memory, at
+    most max_fps times per second: frames published meanwhile, or while the process is reading the last one, are
+    dropped. The process shows the cameras in a grid (any number of cameras) or, headless, writes an mp4 preview.
+    """
+
+    def __init__(self, cameras, dict_names=None, max_fps=10, tile_width=320, video_path=None):
+        """
+        :param cameras (list str): camera names
+               dict_names (dict): pedestrian name to int identity, to label the boxes
+               max_fps (float): frames published per second
+               tile_width (int): pixels of each camera in the grid
+               video_path (str): headless mode, mp4 file written instead of showing a window"""
+        self.cameras = list(cameras)
+        self.dict_names = dict_names or {}
+        self.min_interval = 1. / max_fps if max_fps else 0.
+        self.max_fps = max_fps
+        self.tile_width = tile_width
+        self.video_path = video_path
+        self.last_publish = 0.
+        self.published = 0
+        self.dropped = 0
+        self.process = None
+        self.shm = None
+
+    def _start(self, height, width):
+        """Shared memory and process are created with the first frame, when the tile size is known"""
+        tile_height = int(round(height * self.tile_width / width))
+        self.scale = self.tile_width / width
+        self.layout, size = shared_layout(len(self.cameras), tile_height, self.tile_width)
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        self.arrays = map_shared(self.shm.buf, self.layout)
+
+        context = multiprocessing.get_context('spawn')
+        self.lock = context.Lock()
+        self.new_frame = context.Event()
+        self.stop = context.Event()
+        self.process = context.Process(target=run_viewer, name='Visualization', daemon=True,
+                                       args=(self.shm.name, self.layout, self.cameras, self.lock, self.new_frame,
+                                             self.stop, self.video_path, self.max_fps or 10))
+        self.process.start()
+
+    def publish(self, frame_index, images, gt2d_frame=None):
+        """ Send a frame to the visualization process, dropped when it comes too soon or the process is busy
+        :param frame_index (int)
+               images (dict): {'cam1': {'rgb': array H X W X 3, ...}, ...}, not modified
+               gt2d_frame (dict): {'cam1': [{'id': name_pedestrian, 'xmin': xmin, ...}, ...], ...} (optional)
+        :return: True if the frame was published"""
+        now = time.perf_counter()
+        if now - self.last_publish < self.min_interval:
+            self.dropped += 1
+            return False
+        if self.process is None:
+            height, width = images[self.cameras[0]]['rgb'].shape[:2]
+            self._start(height, width)
+        if not self.lock.acquire(block=False):
+            self.dropped += 1
+            return False
+        try:
+            tile_height = self.arrays['tiles'].shape[1]
+            for i, cam in enumerate(self.cameras):
+                cv2.resize(images[cam]['rgb'], (self.tile_width, tile_height), dst=self.arrays['tiles'][i], interpolation=cv2.INTER_AREA)
+                info_pedestrians = (gt2d_frame or {}).get(cam, [])[:MAX_BOXES]
+                boxes = [(self.dict_names.get(ped['id'], -1), ped['xmin'], ped['ymin'], ped['xmax'], ped['ymax']) for ped in info_pedestrians]
+                if boxes:
+                    boxes = np.array(boxes, dtype=np.float32)
+                    boxes[:, 1:] *= self.scale
+                    self.arrays['boxes'][i, :len(boxes)] = boxes
+                self.arrays['counts'][i] = len(boxes)
+            self.arrays['header'][:] = (self.published, frame_index)
+            self.new_frame.set()
+        finally:
+            self.lock.release()
+        self.last_publish = now
+        self.published += 1
+        return True
+
+    def close(self):
+        """Stop the process (the mp4 preview is complete after it)"""
+        if self.process is not None:
+            self.stop.set()
+            self.process.join()
+            self.process = None
+            del self.arrays
+            self.shm.close()
+            self.shm.unlink()
+
+    def format_stats(self):
+        return 'visualization {} frames shown, {} dropped'.format(self.published, self.dropped)